@@ -0,0 +1,116 @@
+import math
+import time
+
+STATS = ("mean", "min", "max", "count", "last")
+
+
+class _Window:
+    # running statistics of one point over the current tumbling window
+    __slots__ = ("length", "base", "end", "min", "max", "sum", "count", "last")
+
+    def __init__(self, length):
+        self.length = length
+        self.base = length
+        self.end = None
+        self.count = 0
+
+    def start(self, now):
+        # windows are aligned to multiples of their length on the wall clock
+        self.end = (math.floor(now / self.length) + 1) * self.length
+        self.count = 0
+
+    def add(self, value):
+        if self.count:
+            if value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+            self.sum += value
+        else:
+            self.min = self.max = self.sum = value
+        self.count += 1
+        self.last = value
+
+    def summary(self):
+        return {
+            "mean": self.sum / self.count,
+            "min": self.min,
+            "max": self.max,
+            "count": self.count,
+            "last": self.last,
+        }
+
+
+class WindowAggregator:
+    """Streaming aggregation of polled values over tumbling windows. Every point with a
+    window (seconds) keeps a running min/max/sum/count/last, so memory per point is
+    constant whatever the poll rate, and one summary is produced when its window ends.
+    """
+
+    def __init__(self, points):
+        """
+        :param points: list of Point, only the ones with a window are aggregated
+        """
+        self._windows = {p.name: _Window(p.window) for p in points if p.window}
+
+    def __contains__(self, name):
+        return name in self._windows
+
+    def scale(self, factor, keep=()):
+        """
+        Function to stretch the windows of all points but keep by factor from the next
+        window on, 1 restores the configured lengths
+        """
+        for name, w in self._windows.items():
+            w.length = w.base * (1 if name in keep else factor)
+
+    def add(self, values, now=None):
+        """
+        Function to add polled values, closing the windows which ended before now
+        :param values: dict of point name -> value
+        :param now: time.time() of the poll
+        :return: list of (window end, point name, summary dict) of closed windows
+        """
+        if now is None:
+            now = time.time()
+        closed = self.flush(now)
+        for name, value in values.items():
+            w = self._windows.get(name)
+            if w is None:
+                continue
+            if w.end is None:
+                w.start(now)
+            w.add(value)
+        return closed
+
+    def close(self, now=None):
+        """
+        Function to close all windows with samples, also the ones which did not end yet,
+        e.g. before the aggregator is replaced. Those are stamped now instead of their end
+        :return: list of (window end or now, point name, summary dict)
+        """
+        if now is None:
+            now = time.time()
+        closed = []
+        for name, w in self._windows.items():
+            if w.end is not None and w.count:
+                closed.append((min(w.end, now), name, w.summary()))
+            w.end = None
+            w.count = 0
+        return closed
+
+    def flush(self, now=None):
+        """
+        Function to close the windows which ended before now
+        :return: list of (window end, point name, summary dict), windows without any
+                 sample are left out
+        """
+        if now is None:
+            now = time.time()
+        closed = []
+        for name, w in self._windows.items():
+            if w.end is not None and now >= w.end:
+                if w.count:
+                    closed.append((w.end, name, w.summary()))
+                w.start(now)
+        return closed
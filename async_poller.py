@@ -0,0 +1,495 @@
+import asyncio
+import logging
+import time
+
+from modbus.register_map import decode_block
+from modbus.slave_health import OPEN, SlaveHealth
+from trace_buffer import CONNECT, ERROR, POLL, READ, TIMEOUT
+
+logger = logging.getLogger("async_poller")
+
+# pipelined polls of a slave failing in a row before it is read one request at a time,
+# and seconds until its pipeline depth is tried again, doubled on every failed retry
+PIPELINE_FAILURES = 3
+PIPELINE_RETRY = 600
+PIPELINE_MAX_RETRY = 24 * 3600
+
+
+class SlaveStats:
+    __slots__ = (
+        "polls",
+        "timeouts",
+        "errors",
+        "connects",
+        "skipped",
+        "last_start",
+        "last_duration",
+    )
+
+    def __init__(self):
+        self.polls = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_start = 0.0
+        self.last_duration = 0.0
+
+
+class AsyncPoller:
+    """Polls many modbus TCP slaves concurrently with the pymodbus asyncio client.
+    Each slave keeps its own connection, also units behind one Modbus TCP gateway, every
+    slave poll is bounded by the timeout of the slave, and at most max_concurrency
+    requests are in flight over all slaves, so the cycle takes about as long as the
+    slowest slave instead of the sum of all.
+    A slave with pipeline > 1 gets up to that many read requests sent on its connection
+    without waiting for the replies, matched by MBAP transaction id. A slave failing
+    pipelined reads in PIPELINE_FAILURES polls in a row, while its serial reads go
+    through, falls back to one request at a time until PIPELINE_RETRY seconds later.
+    poll() is synchronous and runs the event loop owned by the poller.
+    With a PollMetrics the connect, read and decode stages and every slave poll are timed,
+    with a TraceBuffer they are recorded as trace events. With a RegisterCache the raw
+    registers of every block read are kept for the ModbusProxy, with a CaptureWriter they
+    are appended to a capture file for replay.
+    Every slave has a SlaveHealth: connects and requests time out after a few round trip
+    times of the slave instead of its full timeout, and a slave failing circuit_failures
+    polls in a row is left out of the polls until its backoff expired, so a dead slave
+    costs neither radio nor cycle time. on_circuit is called with (slave, opened) when
+    the circuit of a slave opens or closes again.
+    write() sets registers over the same connections, each block read back to verify it.
+    close_idle() closes the connections not used for idle_timeout seconds, the poll loop
+    calls it every time it wakes up.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=8,
+        metrics=None,
+        trace=None,
+        cache=None,
+        capture=None,
+        min_timeout=0.2,
+        circuit_failures=3,
+        circuit_backoff=30,
+        circuit_max_backoff=900,
+        on_circuit=None,
+        idle_timeout=60,
+    ):
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self.trace = trace
+        self.cache = cache
+        self.capture = capture
+        self.min_timeout = min_timeout
+        self.circuit_failures = circuit_failures
+        self.circuit_backoff = circuit_backoff
+        self.circuit_max_backoff = circuit_max_backoff
+        self.on_circuit = on_circuit
+        self.idle_timeout = idle_timeout
+        # slave name -> SlaveHealth
+        self.health = {}
+        self.loop = asyncio.new_event_loop()
+        # slave name -> AsyncModbusTcpClient. Units behind one Modbus TCP gateway get a
+        # connection each, so that closing the one of a unit which timed out does not
+        # cut the requests in flight for the others
+        self._clients = {}
+        # slave name -> time.monotonic() its connection was last used
+        self._used = {}
+        self._semaphore = None
+        # slave name -> pipeline depth in use, lowered to 1 when the slave rejects it
+        self._pipeline = {}
+        # slave name -> pipelined polls failed in a row
+        self._pipeline_failed = {}
+        # slave name -> (time.monotonic() the depth is tried again, next back-off)
+        self._pipeline_retry = {}
+        self.stats = {}
+
+    def poll(self, jobs, on_values=None):
+        """
+        Function to poll a list of slaves at once
+        :param jobs: list of (Slave, read plan)
+        :param on_values: called with (slave, values) as soon as a slave is done, so the
+                 publisher gets the values of fast slaves without waiting for slow ones
+        :return: dict of slave name -> dict of point name -> value
+        """
+        return self.loop.run_until_complete(self._poll_all(jobs, on_values))
+
+    def configure(
+        self,
+        max_concurrency=8,
+        min_timeout=0.2,
+        circuit_failures=3,
+        circuit_backoff=30,
+        circuit_max_backoff=900,
+        idle_timeout=60,
+    ):
+        """
+        Function to apply the settings of a reloaded config.yaml between two polls, the
+        round trip estimates and circuit states of the slaves are kept
+        """
+        self.idle_timeout = idle_timeout
+        if max_concurrency != self.max_concurrency:
+            self.max_concurrency = max_concurrency
+            self._semaphore = None
+        self.min_timeout = min_timeout
+        self.circuit_failures = circuit_failures
+        self.circuit_backoff = circuit_backoff
+        self.circuit_max_backoff = circuit_max_backoff
+        for health in self.health.values():
+            health.configure(
+                min_timeout, circuit_failures, circuit_backoff, circuit_max_backoff
+            )
+
+    def _ensure_semaphore(self):
+        if self._semaphore is None:
+            # created here to bind it to the running loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _poll_all(self, jobs, on_values):
+        self._ensure_semaphore()
+        results = await asyncio.gather(
+            *(self._poll_slave(slave, plan, on_values) for slave, plan in jobs)
+        )
+        return {slave.name: values for (slave, plan), values in zip(jobs, results)}
+
+    def _health(self, slave):
+        health = self.health.get(slave.name)
+        if health is None:
+            health = self.health[slave.name] = SlaveHealth(
+                slave.timeout,
+                self.min_timeout,
+                self.circuit_failures,
+                self.circuit_backoff,
+                self.circuit_max_backoff,
+            )
+        return health
+
+    async def _poll_slave(self, slave, plan, on_values):
+        stats = self.stats.setdefault(slave.name, SlaveStats())
+        health = self._health(slave)
+        start = stats.last_start = time.monotonic()
+        if not health.allow(start):
+            stats.skipped += 1
+            return {}
+        values = {}
+        try:
+            values = await asyncio.wait_for(
+                self._read_plan(slave, plan, values), slave.timeout
+            )
+            if health.success():
+                logger.warning("%s: answering again, circuit closed", slave.name)
+                self._circuit(slave, False)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            timeout = health.timeout()
+            if self.trace is not None:
+                self.trace.record(TIMEOUT, slave.name, 0, timeout)
+            logger.warning("%s: no response within %.3gs", slave.name, timeout)
+            self._close(slave)
+            self._failure(slave, health, True)
+        except Exception as e:
+            stats.errors += 1
+            if self.trace is not None:
+                self.trace.record(ERROR, slave.name)
+            logger.error("%s: %s", slave.name, e)
+            self._close(slave)
+            self._failure(slave, health, False)
+        stats.polls += 1
+        stats.last_duration = time.monotonic() - start
+        if self.metrics is not None:
+            self.metrics.record("poll", stats.last_duration)
+        if self.trace is not None:
+            self.trace.record(POLL, slave.name, len(values), stats.last_duration)
+        if on_values is not None:
+            on_values(slave, values)
+        return values
+
+    def _failure(self, slave, health, timed_out):
+        if health.failure(time.monotonic(), timed_out):
+            logger.error(
+                "%s: %d polls failed, circuit open, next try in %.0fs",
+                slave.name,
+                health.failed,
+                health.retry_at - time.monotonic(),
+            )
+            self._circuit(slave, True)
+
+    def _circuit(self, slave, opened):
+        if self.on_circuit is not None:
+            try:
+                self.on_circuit(slave, opened)
+            except Exception:
+                logger.exception("on_circuit")
+
+    async def _connect(self, slave):
+        self._used[slave.name] = time.monotonic()
+        client = self._clients.get(slave.name)
+        if client is None:
+            # imported on the first connect, so that it overlaps the MQTT connect of
+            # the gateway started before the first poll
+            from pymodbus.client import AsyncModbusTcpClient
+
+            # reconnect_delay=0, reconnects are done by the next poll instead
+            client = AsyncModbusTcpClient(
+                slave.host,
+                port=slave.port,
+                timeout=slave.timeout,
+                retries=0,
+                reconnect_delay=0,
+            )
+            self._clients[slave.name] = client
+        if not client.connected:
+            start = time.monotonic()
+            # a TCP connect takes about one round trip, a dead slave no longer than a
+            # request does
+            await asyncio.wait_for(client.connect(), self._health(slave).timeout())
+            self.stats.setdefault(slave.name, SlaveStats()).connects += 1
+            elapsed = time.monotonic() - start
+            if self.metrics is not None:
+                self.metrics.record("connect", elapsed)
+            if self.trace is not None:
+                event = CONNECT if client.connected else ERROR
+                self.trace.record(event, slave.name, 0, elapsed)
+        return client if client.connected else None
+
+    async def _read_block(self, client, slave, block):
+        async with self._semaphore:
+            health = self._health(slave)
+            start = time.monotonic()
+            result = await asyncio.wait_for(
+                client.read_holding_registers(
+                    block.address, block.count, slave=slave.unit
+                ),
+                health.timeout(),
+            )
+            elapsed = time.monotonic() - start
+            health.sample(elapsed)
+            if self.metrics is not None:
+                self.metrics.record("read", elapsed)
+            if self.trace is not None:
+                self.trace.record(READ, slave.name, block.address, elapsed)
+            return result
+
+    async def _read_pipelined(self, client, slave, blocks, depth):
+        # send up to depth requests before the first reply, exceptions are returned
+        window = asyncio.Semaphore(depth)
+
+        async def read(block):
+            async with window:
+                return await self._read_block(client, slave, block)
+
+        return await asyncio.gather(*(read(b) for b in blocks), return_exceptions=True)
+
+    def _depth(self, slave):
+        depth = self._pipeline.get(slave.name)
+        if depth is None:
+            return slave.pipeline
+        if time.monotonic() < self._pipeline_retry[slave.name][0]:
+            return depth
+        logger.warning("%s: trying pipelined reads again", slave.name)
+        del self._pipeline[slave.name]
+        return slave.pipeline
+
+    def _pipeline_failure(self, slave):
+        # a lost reply or a dropped connection fails one poll, a slave which does not
+        # take pipelined requests fails all of them
+        failed = self._pipeline_failed.get(slave.name, 0) + 1
+        if failed < PIPELINE_FAILURES:
+            self._pipeline_failed[slave.name] = failed
+            return
+        self._pipeline_failed.pop(slave.name, None)
+        backoff = self._pipeline_retry.get(slave.name, (0, PIPELINE_RETRY))[1]
+        self._pipeline[slave.name] = 1
+        self._pipeline_retry[slave.name] = (
+            time.monotonic() + backoff,
+            min(PIPELINE_MAX_RETRY, 2 * backoff),
+        )
+        logger.warning(
+            "%s: pipelined reads failed %d polls in a row, reading serially for %ds",
+            slave.name,
+            failed,
+            backoff,
+        )
+
+    def _pipeline_success(self, slave):
+        self._pipeline_failed.pop(slave.name, None)
+        self._pipeline_retry.pop(slave.name, None)
+
+    async def _read_plan(self, slave, plan, values):
+        # values is filled in place, so blocks read before a timeout are kept
+        client = await self._connect(slave)
+        if client is None:
+            raise ConnectionError(f"cannot connect to {slave.host}:{slave.port}")
+        depth = self._depth(slave)
+        pipeline_failed = False
+        if depth > 1 and len(plan) > 1:
+            results = await self._read_pipelined(client, slave, plan, depth)
+            if not any(isinstance(r, Exception) for r in results):
+                self._pipeline_success(slave)
+                for block, result in zip(plan, results):
+                    self._decode(slave, block, result, values)
+                return values
+            # this poll is read again serially, a failure of that as well was no
+            # fault of the pipelining
+            self._close(slave)
+            client = await self._connect(slave)
+            if client is None:
+                raise ConnectionError(f"cannot connect to {slave.host}:{slave.port}")
+            pipeline_failed = True
+        for block in plan:
+            result = await self._read_block(client, slave, block)
+            self._decode(slave, block, result, values)
+        if pipeline_failed:
+            self._pipeline_failure(slave)
+        return values
+
+    def _decode(self, slave, block, result, values):
+        if result.isError():
+            self.stats[slave.name].errors += 1
+            if self.trace is not None:
+                self.trace.record(ERROR, slave.name, block.address)
+            logger.warning("%s: %s", slave.name, result)
+            return
+        if self.cache is not None:
+            self.cache.put(slave.name, slave.unit, block.address, result.registers)
+        if self.capture is not None:
+            self.capture.write(
+                slave.name,
+                slave.unit,
+                self.stats[slave.name].last_start,
+                block.address,
+                result.registers,
+            )
+        if self.metrics is None:
+            values.update(decode_block(block, result.registers))
+            return
+        start = time.monotonic()
+        values.update(decode_block(block, result.registers))
+        self.metrics.record("decode", time.monotonic() - start)
+
+    def probe_pipeline(self, slave, block, depths=(1, 2, 4, 8), requests=32):
+        """
+        Function to measure the read throughput of a slave at several pipeline depths
+        :param slave: Slave to measure
+        :param block: ReadBlock which is read requests times at every depth
+        :return: (best depth, dict of depth -> requests per second, None if rejected)
+                 best is the smallest depth within 5% of the highest throughput, None
+                 when the first depth was rejected already
+        """
+        return self.loop.run_until_complete(
+            self._probe_pipeline(slave, block, depths, requests)
+        )
+
+    async def _probe_pipeline(self, slave, block, depths, requests):
+        self._ensure_semaphore()
+        rates = {}
+        for depth in depths:
+            client = await self._connect(slave)
+            if client is None:
+                raise ConnectionError(f"cannot connect to {slave.host}:{slave.port}")
+            start = time.monotonic()
+            results = await self._read_pipelined(
+                client, slave, [block] * requests, depth
+            )
+            elapsed = time.monotonic() - start
+            if any(isinstance(r, Exception) or r.isError() for r in results):
+                logger.warning("%s: pipeline depth %d rejected", slave.name, depth)
+                rates[depth] = None
+                self._close(slave)
+                break
+            rates[depth] = requests / elapsed
+        measured = {d: r for d, r in rates.items() if r is not None}
+        if not measured:
+            # even the first depth failed, e.g. a wrong address or a slave not answering
+            return None, rates
+        best_rate = max(measured.values())
+        best = min(d for d, r in measured.items() if r >= 0.95 * best_rate)
+        return best, rates
+
+    def write(self, slave, blocks):
+        """
+        Function to write blocks of holding registers to a slave, each with one
+        write_registers request and read back after it
+        :param blocks: list of WriteBlock
+        :return: list of None for every block written and read back unchanged, the
+                 error text for the others
+        """
+        return self.loop.run_until_complete(self._write_blocks(slave, blocks))
+
+    async def _write_blocks(self, slave, blocks):
+        self._ensure_semaphore()
+        if self._health(slave).state == OPEN:
+            return [f"{slave.name} not answering, circuit open"] * len(blocks)
+        errors = []
+        for block in blocks:
+            # the full timeout of the slave, storing settings may take a datalogger
+            # much longer than a read
+            try:
+                error = await asyncio.wait_for(
+                    self._write_block(slave, block), slave.timeout
+                )
+                errors.append(error)
+            except asyncio.TimeoutError:
+                self._close(slave)
+                errors.append(f"no response within {slave.timeout}s")
+            except Exception as e:
+                self._close(slave)
+                errors.append(str(e) or type(e).__name__)
+        return errors
+
+    async def _write_block(self, slave, block):
+        client = await self._connect(slave)
+        if client is None:
+            raise ConnectionError(f"cannot connect to {slave.host}:{slave.port}")
+        count = len(block.registers)
+        async with self._semaphore:
+            result = await client.write_registers(
+                block.address, list(block.registers), slave=slave.unit
+            )
+            if result.isError():
+                return f"write {block.address}/{count}: {result}"
+            result = await client.read_holding_registers(
+                block.address, count, slave=slave.unit
+            )
+        if result.isError():
+            return f"read back {block.address}/{count}: {result}"
+        if self.cache is not None:
+            self.cache.put(slave.name, slave.unit, block.address, result.registers)
+        if list(result.registers) != list(block.registers):
+            return f"read back {result.registers} after writing {list(block.registers)}"
+        return None
+
+    def _close(self, slave):
+        client = self._clients.pop(slave.name, None)
+        if client is not None:
+            client.close()
+
+    def close_idle(self, now=None):
+        """
+        Function to close the connections not used for idle_timeout seconds, e.g. of
+        slaves polled only every hour, they are opened again by the next poll
+        """
+        if now is None:
+            now = time.monotonic()
+        for name in list(self._clients):
+            if now - self._used.get(name, now) > self.idle_timeout:
+                logger.debug("%s: closing idle connection", name)
+                self._clients.pop(name).close()
+
+    def forget(self, slave):
+        """
+        Function to drop the connection, pipeline depth and health of a slave removed
+        or changed by a config reload
+        """
+        self._close(slave)
+        self._used.pop(slave.name, None)
+        self._pipeline.pop(slave.name, None)
+        self._pipeline_failed.pop(slave.name, None)
+        self._pipeline_retry.pop(slave.name, None)
+        self.health.pop(slave.name, None)
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+        self.loop.close()
@@ -0,0 +1,67 @@
+"""Micro-benchmark of block decoding against the per-register loop read_hr used before.
+
+Run from the application directory (the one holding the modbus package, built from
+this repository by benchmarks/mirror_tree.py):
+    python3 benchmarks/bench_decode.py [number of registers]
+"""
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from modbus.decoder import BlockLayout, decode_array  # noqa: E402
+
+
+def convert_to_float(combined_value):
+    combined_value_in_bytes = combined_value.to_bytes(4, byteorder="big")
+    return struct.unpack("!f", combined_value_in_bytes)[0]
+
+
+def legacy_decode_float(registers, word_order="reverse"):
+    # per-register loop of read_hr before the block decoder
+    modbus_data = []
+    for j in range(0, len(registers), 2):
+        if word_order == "standard":
+            upper_16bits = registers[j]
+            lower_16bits = registers[j + 1]
+        else:
+            upper_16bits = registers[j + 1]
+            lower_16bits = registers[j]
+        combined_value = (upper_16bits << 16) | lower_16bits
+        modbus_data.append(convert_to_float(combined_value))
+    return modbus_data
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    registers = [random.randrange(0x10000) for _ in range(size)]
+    # datalogger like mixed layout: reverse floats followed by 16bit integers
+    fields = [(o, "32bit_float", "reverse") for o in range(0, size // 2, 2)]
+    fields += [(o, "16bit_integer", "standard") for o in range(size // 2, size)]
+    mixed = BlockLayout(fields, size)
+
+    assert [str(v) for v in legacy_decode_float(registers)] == [
+        str(v) for v in decode_array(registers, "32bit_float", "reverse")
+    ]
+
+    number = 2000
+    cases = [
+        ("legacy per-register loop", lambda: legacy_decode_float(registers)),
+        ("decode_array", lambda: decode_array(registers, "32bit_float", "reverse")),
+        ("BlockLayout mixed", lambda: mixed.decode(registers)),
+    ]
+    baseline = None
+    for name, fn in cases:
+        seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        baseline = baseline or seconds
+        print(
+            f"{name:28s} {seconds * 1e6:8.2f} us/block "
+            f"{size / seconds / 1e6:6.2f} M registers/s  x{baseline / seconds:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
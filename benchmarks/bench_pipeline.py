@@ -0,0 +1,41 @@
+"""Measure the best Modbus TCP pipeline depth of a slave.
+
+Run from the application directory (the one holding the modbus package, built from
+this repository by benchmarks/mirror_tree.py):
+    python3 benchmarks/bench_pipeline.py HOST [PORT] [UNIT] [ADDRESS] [COUNT]
+and set the reported depth as pipeline of the slave in config.yaml.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from modbus.async_poller import AsyncPoller  # noqa: E402
+from modbus.register_map import Point, Slave, plan_reads  # noqa: E402
+
+
+def main():
+    host = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 502
+    unit = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    address = int(sys.argv[4]) if len(sys.argv) > 4 else 199
+    count = int(sys.argv[5]) if len(sys.argv) > 5 else 37
+
+    points = [Point(f"r{i}", address + i) for i in range(count)]
+    block = plan_reads(points, register_base=0)[0]
+    slave = Slave("probe", host, port, unit, 10, points)
+    poller = AsyncPoller()
+    try:
+        best, rates = poller.probe_pipeline(slave, block)
+    finally:
+        poller.close()
+    for depth, rate in rates.items():
+        print(f"depth {depth:2d}: " + ("rejected" if rate is None else f"{rate:8.1f} reads/s"))
+    if best is None:
+        print("no depth worked, check the address and count of the block")
+    else:
+        print(f"best pipeline depth: {best}")
+
+
+if __name__ == "__main__":
+    main()
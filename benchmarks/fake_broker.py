@@ -0,0 +1,138 @@
+"""Minimal MQTT 3.1.1 broker stand-in which records what the gateway publishes.
+
+It answers CONNECT, PUBLISH (QoS 0, 1 and 2), SUBSCRIBE and PINGREQ well enough for
+paho-mqtt, keeps every line of every publish and counts the bytes in both directions.
+SmartREST 2.0 template collections published to s/ut/<X-ID> are remembered and the
+existence checks answered on s/dt, like Cumulocity does. Plain TCP only.
+"""
+import socketserver
+import threading
+
+
+def _read_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("closed")
+        data += chunk
+    return data
+
+
+def _encode_length(n):
+    encoded = b""
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        encoded += bytes([byte | 0x80 if n else byte])
+        if not n:
+            return encoded
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def send(self, data):
+        self.server.broker.tx_bytes += len(data)
+        self.request.sendall(data)
+
+    def send_publish(self, topic, payload):
+        topic = topic.encode()
+        body = len(topic).to_bytes(2, "big") + topic + payload.encode()
+        self.send(b"\x30" + _encode_length(len(body)) + body)
+
+    def handle(self):
+        broker = self.server.broker
+        sock = self.request
+        try:
+            while True:
+                header = _read_exact(sock, 1)[0]
+                length = multiplier = 0
+                size = 1
+                while True:
+                    byte = _read_exact(sock, 1)[0]
+                    size += 1
+                    length += (byte & 0x7F) << multiplier
+                    multiplier += 7
+                    if not byte & 0x80:
+                        break
+                body = _read_exact(sock, length)
+                broker.rx_bytes += size + length
+                kind = header >> 4
+                if kind == 1:  # CONNECT
+                    self.send(b"\x20\x02\x00\x00")
+                elif kind == 3:  # PUBLISH
+                    qos = (header >> 1) & 3
+                    topic_len = int.from_bytes(body[:2], "big")
+                    topic = body[2 : 2 + topic_len].decode()
+                    pos = 2 + topic_len
+                    if qos:
+                        packet_id = body[pos : pos + 2]
+                        pos += 2
+                    payload = body[pos:].decode()
+                    if topic.startswith("s/ut/"):
+                        xid = topic[5:]
+                        if payload:
+                            broker.templates.add(xid)
+                        else:
+                            exists = xid in broker.templates
+                            self.send_publish("s/dt", f"{20 if exists else 41},{xid}")
+                    else:
+                        # one SmartREST message may hold several lines
+                        for line in payload.split("\n"):
+                            broker.record(topic, line)
+                    if qos == 1:
+                        self.send(b"\x40\x02" + packet_id)
+                    elif qos == 2:
+                        self.send(b"\x50\x02" + packet_id)
+                elif kind == 6:  # PUBREL
+                    self.send(b"\x70\x02" + body[:2])
+                elif kind == 8:  # SUBSCRIBE
+                    topics = 0
+                    pos = 2
+                    while pos < len(body):
+                        pos += 2 + int.from_bytes(body[pos : pos + 2], "big") + 1
+                        topics += 1
+                    self.send(bytes([0x90, 2 + topics]) + body[:2] + b"\x00" * topics)
+                elif kind == 12:  # PINGREQ
+                    self.send(b"\xd0\x00")
+                elif kind == 14:  # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            return
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeBroker:
+    def __init__(self, host="127.0.0.1", port=0):
+        self._server = _Server((host, port), _Handler)
+        self._server.broker = self
+        self.host, self.port = self._server.server_address
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.messages = []
+        self.templates = set()
+        self._received = threading.Condition()
+
+    def record(self, topic, payload):
+        with self._received:
+            self.messages.append((topic, payload))
+            self._received.notify_all()
+
+    def wait_for(self, count, timeout=10):
+        """
+        Function to wait until count messages have been received in total
+        :return: True if they arrived within timeout
+        """
+        with self._received:
+            return self._received.wait_for(lambda: len(self.messages) >= count, timeout)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,98 @@
+"""Build the application directory the benchmarks run from, out of this repository.
+
+On the FX30 the modules live in packages: modbus/ (poller, register map, decoder,
+proxy, writes) and c8y/ (gateway, SmartREST, and c8y_device.py, which only ships in
+the .update package), with main.py and the other modules beside them. This repository
+keeps all of them flat. The directory built here links every module of the repository
+to its place in that layout, so edits in the repository are picked up without building
+it again:
+    python3 benchmarks/mirror_tree.py /tmp/app
+    cd /tmp/app && python3 benchmarks/run_benchmarks.py
+
+c8y_device.py is taken from the modbus2cumulocity .update package of the
+repository, or the one given with --update.
+"""
+import argparse
+import glob
+import io
+import os
+import tarfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules which are imported from a package on the device, the rest is top level
+PACKAGES = {
+    "modbus": (
+        "async_poller",
+        "decoder",
+        "modbus_client",
+        "modbus_proxy",
+        "modbus_write",
+        "register_map",
+        "slave_health",
+    ),
+    "c8y": ("c8y_gateway", "smartrest"),
+}
+C8Y_DEVICE = "read-only/c8y/c8y_device.py"
+
+
+def _link(source, dest):
+    if os.path.lexists(dest):
+        os.remove(dest)
+    os.symlink(source, dest)
+
+
+def extract_c8y_device(update, dest):
+    """
+    Function to extract c8y_device.py from a .update package, a bzip2 tar archive
+    behind a header of its own
+    """
+    with open(update, "rb") as f:
+        data = f.read()
+    start = data.find(b"BZh")
+    if start < 0:
+        raise ValueError(f"{update}: no bzip2 archive found")
+    with tarfile.open(fileobj=io.BytesIO(data[start:]), mode="r:bz2") as tar:
+        member = next(
+            (m for m in tar.getmembers() if m.name.endswith(C8Y_DEVICE)), None
+        )
+        if member is None:
+            raise ValueError(f"{update}: no {C8Y_DEVICE}")
+        with open(dest, "wb") as f:
+            f.write(tar.extractfile(member).read())
+
+
+def mirror(dest, update):
+    packaged = {m: p for p, modules in PACKAGES.items() for m in modules}
+    for package in list(PACKAGES) + ["benchmarks"]:
+        os.makedirs(os.path.join(dest, package), exist_ok=True)
+    for path in glob.glob(os.path.join(REPO, "*.py")):
+        module = os.path.basename(path)[:-3]
+        _link(path, os.path.join(dest, packaged.get(module, ""), f"{module}.py"))
+    # the scripts find the packages next to the directory they are started from
+    for path in glob.glob(os.path.join(REPO, "benchmarks", "*.py")):
+        _link(path, os.path.join(dest, "benchmarks", os.path.basename(path)))
+    _link(
+        os.path.join(REPO, "config.yaml.template"),
+        os.path.join(dest, "config.yaml.template"),
+    )
+    extract_c8y_device(update, os.path.join(dest, "c8y", "c8y_device.py"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("dest", help="directory to build, created when missing")
+    parser.add_argument("--update", help=".update package holding c8y_device.py")
+    args = parser.parse_args()
+    update = args.update
+    if update is None:
+        updates = sorted(glob.glob(os.path.join(REPO, "modbus2cumulocity.*.update")))
+        if not updates:
+            parser.error("no modbus2cumulocity .update package, give one with --update")
+        update = updates[-1]
+    mirror(os.path.abspath(args.dest), update)
+    print(f"{args.dest}: application directory, c8y_device.py from {update}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Local Modbus TCP slaves serving register maps, built on the pymodbus server.
+
+Every slave runs its own pymodbus ModbusTcpServer on its own event loop thread, can
+delay its replies to simulate a slow link, and counts the requests and bytes it sees.
+"""
+import asyncio
+import random
+import threading
+
+from pymodbus.datastore import (
+    ModbusSequentialDataBlock,
+    ModbusServerContext,
+    ModbusSlaveContext,
+)
+from pymodbus.server.async_io import ModbusServerRequestHandler, ModbusTcpServer
+
+from modbus.decoder import encode_value
+from modbus.register_map import point_size
+
+
+class _Handler(ModbusServerRequestHandler):
+    def callback_data(self, data, addr=None):
+        self.server.sim.rx_bytes += len(data)
+        return super().callback_data(data, addr)
+
+    def execute(self, request, *addr):
+        self.server.sim.requests += 1
+        latency = self.server.sim.latency
+        if latency:
+            # replies are delayed without blocking, so pipelined requests overlap
+            asyncio.get_running_loop().call_later(
+                latency, super().execute, request, *addr
+            )
+        else:
+            super().execute(request, *addr)
+
+    def send(self, message, *addr, **kwargs):
+        if message.should_respond:
+            self.server.sim.tx_bytes += len(self.framer.buildPacket(message))
+        super().send(message, *addr, **kwargs)
+
+
+class _Server(ModbusTcpServer):
+    def handle_new_connection(self):
+        return _Handler(self)
+
+
+class SimulatedSlave:
+    """One Modbus TCP slave holding the points of a register map"""
+
+    def __init__(self, points, port, host="127.0.0.1", latency=0.0, register_base=1):
+        """
+        :param points: list of Point, filled with random values
+        :param port: TCP port to listen on
+        :param latency: seconds every reply is delayed
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        size = max(p.address - register_base + point_size(p) for p in points) + 1
+        registers = [0] * size
+        for p in points:
+            offset = p.address - register_base
+            value = random.uniform(0, 100) if "float" in p.format else random.randint(0, 1)
+            registers[offset : offset + point_size(p)] = encode_value(
+                value, p.format, p.word_order
+            )
+        block = ModbusSequentialDataBlock(0, registers)
+        self.context = ModbusServerContext(
+            slaves=ModbusSlaveContext(hr=block, zero_mode=True), single=True
+        )
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    async def _serve(self):
+        # the pymodbus server binds to the running loop, so it is created in here
+        self._server = _Server(self.context, address=(self.host, self.port))
+        self._server.sim = self
+        await self._server.transport_listen()
+        self._ready.set()
+        await self._server.serving
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve())
+        # drop the handlers of connections the clients left open
+        for task in asyncio.all_tasks(self._loop):
+            task.cancel()
+        self._loop.run_until_complete(asyncio.sleep(0))
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._server.shutdown(), self._loop).result(5)
+            self._thread.join(5)
@@ -0,0 +1,189 @@
+"""Replay of a capture file through the gateway pipeline: decode -> change detection
+-> aggregation -> c8yGateway -> MQTT, against a local fake broker.
+
+Run from the application directory (the one holding the modbus and c8y packages,
+built from this repository by benchmarks/mirror_tree.py):
+    python3 benchmarks/replay_capture.py capture.bin [--config ubuntu/config.yaml]
+        [--speed 1000] [--encoding templates|201] [--messages out.txt]
+
+The points of every slave come from config.yaml, captured reads are decoded with the
+register map in use now, so a changed map can be checked against old site data.
+Polls are replayed on the timeline of the capture divided by --speed (1 for real time,
+0 for as fast as possible); change detection and aggregation windows see the captured
+times, so heartbeats and windows come out as they did on site. --messages writes every
+MQTT message the broker received, to diff the output of two versions.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from c8y.smartrest import TemplateEncoder  # noqa: E402
+from fake_broker import FakeBroker  # noqa: E402
+from main import measurement_map, publish_values  # noqa: E402
+from modbus.register_map import (  # noqa: E402
+    decode_block,
+    load_slaves,
+    plan_reads,
+    point_size,
+)
+from aggregation import WindowAggregator  # noqa: E402
+from capture import read_capture  # noqa: E402
+from config_cache import load_yaml  # noqa: E402
+from report_by_exception import ReportByException  # noqa: E402
+from run_benchmarks import start_gateway, stop_gateway  # noqa: E402
+
+
+class _Decoder:
+    # decodes the points lying wholly inside a captured read, whatever plan read it
+    def __init__(self, slave, register_base):
+        self.slave = slave
+        self.register_base = register_base
+        self._blocks = {}
+
+    def decode(self, address, registers, values):
+        key = (address, len(registers))
+        blocks = self._blocks.get(key)
+        if blocks is None:
+            end = address + len(registers)
+            inside = [
+                p
+                for p in self.slave.points
+                if address <= p.address - self.register_base
+                and p.address - self.register_base + point_size(p) <= end
+            ]
+            blocks = self._blocks[key] = plan_reads(
+                inside,
+                max_gap=len(registers),
+                register_base=self.register_base,
+                max_count=len(registers),
+            )
+        for block in blocks:
+            offset = block.address - address
+            values.update(decode_block(block, registers[offset : offset + block.count]))
+
+
+def polls(path):
+    """
+    Function to group the captured reads into polls
+    :return: generator of (time.time() of the poll, slave name, list of (address,
+             registers)), in the order the polls ended
+    """
+    pending = {}
+    for timestamp, slave, unit, address, registers in read_capture(path):
+        poll = pending.get(slave)
+        if poll is not None and poll[0] != timestamp:
+            yield pending.pop(slave)
+            poll = None
+        if poll is None:
+            poll = pending[slave] = (timestamp, slave, [])
+        poll[2].append((address, registers))
+    yield from sorted(pending.values())
+
+
+def replay(path, config, speed, encoding, broker):
+    modbus_config = config["modbus"]
+    slaves = {sl.name: sl for sl in load_slaves(modbus_config)}
+    register_base = modbus_config.get("register_base", 1)
+    stats = config.get("aggregation", {}).get("stats", ["mean", "min", "max"])
+    heartbeat = 60 * modbus_config.get("send_interval", 6)
+    decoders = {name: _Decoder(sl, register_base) for name, sl in slaves.items()}
+    rbe = {
+        name: ReportByException(
+            [p for p in sl.points if not p.window], default_heartbeat=heartbeat
+        )
+        for name, sl in slaves.items()
+    }
+    aggregators = {name: WindowAggregator(sl.points) for name, sl in slaves.items()}
+    templates = None
+    if encoding == "templates":
+        templates = TemplateEncoder(measurement_map(slaves.values(), stats))
+    client = start_gateway(broker, templates)
+    received = len(broker.messages)
+    mqtt_rx = broker.rx_bytes
+
+    count = reads = unknown = 0
+    first = last = None
+    cpu = time.process_time()
+    started = time.monotonic()
+    for timestamp, name, blocks in polls(path):
+        slave = slaves.get(name)
+        if slave is None:
+            unknown += 1
+            continue
+        if first is None:
+            first = timestamp
+        last = timestamp
+        if speed:
+            delay = started + (timestamp - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        values = {}
+        for address, registers in blocks:
+            decoders[name].decode(address, registers, values)
+        reads += len(blocks)
+        count += 1
+        publish_values(
+            client,
+            slave,
+            values,
+            rbe[name],
+            aggregators[name],
+            stats,
+            timestamp,
+            timestamp=timestamp,
+        )
+    # the last batches leave the publish queue
+    while client.outbox.stats()["depth"]:
+        time.sleep(0.05)
+    time.sleep(0.5)
+    elapsed = time.monotonic() - started
+    cpu = time.process_time() - cpu
+    stop_gateway(client)
+    span = (last - first) if count else 0.0
+    return {
+        "polls": count,
+        "reads": reads,
+        "unknown_slave_polls": unknown,
+        "captured_seconds": round(span, 1),
+        "replay_seconds": round(elapsed, 3),
+        "speedup": round(span / elapsed, 1) if elapsed else 0.0,
+        "cpu_ms_per_poll": round(cpu * 1000 / count, 3) if count else 0.0,
+        "batches": client.outbox.stats()["queued"],
+        "mqtt_messages": len(broker.messages) - received,
+        "mqtt_bytes": broker.rx_bytes - mqtt_rx,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("capture", help="capture file written with capture.path")
+    parser.add_argument("--config", default="ubuntu/config.yaml")
+    parser.add_argument("--speed", type=float, default=1000)
+    parser.add_argument("--encoding", choices=("templates", "201"), default="templates")
+    parser.add_argument("--messages", help="write the MQTT messages to this file")
+    args = parser.parse_args()
+
+    # start_gateway changes the working directory
+    capture = os.path.abspath(args.capture)
+    config = load_yaml(args.config)
+    messages = os.path.abspath(args.messages) if args.messages else None
+
+    broker = FakeBroker().start()
+    try:
+        result = replay(capture, config, args.speed, args.encoding, broker)
+    finally:
+        broker.stop()
+    print(json.dumps(result, indent=1))
+    if messages:
+        with open(messages, "w") as f:
+            for topic, payload in broker.messages:
+                f.write(f"{topic} {payload}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""End-to-end benchmark of the gateway: simulated Modbus slaves -> poller -> change
+detection -> c8yGateway -> MQTT, against a local fake broker.
+
+Run from the application directory (the one holding the modbus and c8y packages,
+built from this repository by benchmarks/mirror_tree.py):
+    python3 benchmarks/run_benchmarks.py [--scenario NAME] [--cycles N]
+        [--encoding templates|201] [--output results.json] [--compare baseline.json]
+        [--tolerance 0.2]
+
+Every scenario polls its slaves for a number of cycles and publishes every value on
+every cycle. A cycle lasts from the start of the poll until the broker has received
+all of its measurements. The slaves run in a child process so that the CPU time is
+the one of the gateway, the fake broker runs in this process but only parses frames.
+With --compare the run fails when latency or CPU per poll got worse than the baseline
+by more than the tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import ssl
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from c8y.c8y_gateway import c8yGateway  # noqa: E402
+from c8y.smartrest import TemplateEncoder  # noqa: E402
+from fake_broker import FakeBroker  # noqa: E402
+from main import measurement_map, publish_values  # noqa: E402
+from modbus.async_poller import AsyncPoller  # noqa: E402
+from modbus.register_map import Point, Slave, plan_reads  # noqa: E402
+from aggregation import WindowAggregator  # noqa: E402
+from report_by_exception import ReportByException  # noqa: E402
+
+BASE_PORT = 5120
+
+# name, number of slaves, registers per slave, seconds between polls (0 for as fast as
+# possible), reply latency of the slaves in seconds, pipeline depth
+SCENARIOS = [
+    ("datalogger", 1, 38, 0, 0.0, 1),
+    ("datalogger_slow_link", 1, 38, 0, 0.02, 1),
+    ("many_slaves", 16, 38, 0, 0.005, 1),
+    ("large_map", 4, 500, 0, 0.005, 1),
+    ("large_map_pipelined", 4, 500, 0, 0.005, 4),
+    ("paced_1s", 8, 120, 1, 0.01, 1),
+]
+
+
+def build_points(registers):
+    # 32 bit floats in reverse word order like the datalogger channels
+    return [
+        Point(
+            f"ch{i}",
+            200 + 2 * i,
+            "32bit_float",
+            "reverse",
+            series=f"ch{i}",
+            decimals=4,
+            heartbeat=0,
+        )
+        for i in range(registers // 2)
+    ]
+
+
+def run_slaves(points, ports, latency, conn):
+    # child process: serve the slaves until told to stop, then send back their counters
+    from modbus_simulator import SimulatedSlave
+
+    slaves = [SimulatedSlave(points, port, latency=latency).start() for port in ports]
+    conn.send("ready")
+    conn.recv()
+    totals = {"requests": 0, "rx_bytes": 0, "tx_bytes": 0}
+    for slave in slaves:
+        totals["requests"] += slave.requests
+        totals["rx_bytes"] += slave.rx_bytes
+        totals["tx_bytes"] += slave.tx_bytes
+        slave.stop()
+    conn.send(totals)
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def start_gateway(broker, templates=None):
+    # c8y_device.yaml is written into the working directory
+    os.chdir(tempfile.mkdtemp(prefix="bench_"))
+    client = c8yGateway(
+        templates=templates,
+        url=broker.host,
+        tenant="bench",
+        device_id="bench",
+        device_type="bench",
+        port=broker.port,
+        ca_certs=None,
+        certfile=None,
+        keyfile=None,
+        cert_reqs=ssl.CERT_NONE,
+    )
+    # the fake broker speaks plain MQTT
+    client._client._ssl = False
+    client._client._ssl_context = None
+    client.start()
+    deadline = time.monotonic() + 10
+    while not client.connected:
+        if time.monotonic() > deadline:
+            raise RuntimeError("cannot connect to the fake broker")
+        time.sleep(0.05)
+    # let the device registration messages go out before measuring
+    time.sleep(0.5)
+    if templates is not None and not templates.ready:
+        raise RuntimeError("template collection not confirmed by the fake broker")
+    return client
+
+
+def stop_gateway(client):
+    client.on = False
+    client._client.disconnect()
+    client.join(5)
+
+
+def run_scenario(scenario, cycles, broker, encoding):
+    name, n_slaves, registers, interval, latency, pipeline = scenario
+    points = build_points(registers)
+    templates = None
+    if encoding == "templates":
+        templates = TemplateEncoder(measurement_map([Slave("map", "", 0, 1, 1, points)], []))
+    client = start_gateway(broker, templates)
+    ports = [BASE_PORT + i for i in range(n_slaves)]
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=run_slaves, args=(points, ports, latency, child), daemon=True
+    )
+    process.start()
+    parent.recv()
+
+    slaves = [
+        Slave(f"s{i}", "127.0.0.1", port, 1, 5, points, pipeline)
+        for i, port in enumerate(ports)
+    ]
+    plan = plan_reads(points, register_base=1)
+    rbe = {sl.name: ReportByException(points) for sl in slaves}
+    aggregators = {sl.name: WindowAggregator(points) for sl in slaves}
+    poller = AsyncPoller(max_concurrency=max(8, n_slaves))
+    jobs = [(sl, plan) for sl in slaves]
+
+    def on_values(sl, values):
+        publish_values(
+            client, sl, values, rbe[sl.name], aggregators[sl.name], [], time.monotonic()
+        )
+
+    # one warm-up cycle opens the connections
+    poller.poll(jobs, on_values)
+    broker.wait_for(len(broker.messages) + n_slaves, timeout=10)
+    time.sleep(0.2)
+
+    durations = []
+    lost = 0
+    mqtt_rx = broker.rx_bytes
+    mqtt_tx = broker.tx_bytes
+    rss_start = rss_peak = rss_bytes()
+    cpu = time.process_time()
+    started = time.monotonic()
+    for cycle in range(cycles):
+        if interval:
+            delay = started + cycle * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        expected = len(broker.messages)
+        t0 = time.monotonic()
+        results = poller.poll(jobs, on_values)
+        expected += sum(1 for values in results.values() if values)
+        if not broker.wait_for(expected, timeout=10):
+            lost += expected - len(broker.messages)
+        durations.append(time.monotonic() - t0)
+        rss_peak = max(rss_peak, rss_bytes())
+    elapsed = time.monotonic() - started
+    cpu = time.process_time() - cpu
+
+    poller.close()
+    stop_gateway(client)
+    parent.send("stop")
+    modbus = parent.recv()
+    process.join(10)
+
+    polls = cycles * n_slaves
+    return {
+        "slaves": n_slaves,
+        "registers": registers,
+        "interval": interval,
+        "latency": latency,
+        "pipeline": pipeline,
+        "encoding": encoding,
+        "cycles": cycles,
+        "polls_per_sec": round(polls / elapsed, 1),
+        "p50_ms": round(percentile(durations, 50) * 1000, 2),
+        "p99_ms": round(percentile(durations, 99) * 1000, 2),
+        "cpu_ms_per_cycle": round(cpu * 1000 / cycles, 3),
+        "cpu_ms_per_poll": round(cpu * 1000 / polls, 3),
+        "cpu_pct": round(100 * cpu / elapsed, 1),
+        "rss_start_kb": rss_start // 1024,
+        "rss_peak_kb": rss_peak // 1024,
+        "rss_growth_per_cycle": round((rss_peak - rss_start) / cycles, 1),
+        "mqtt_bytes_per_poll": round((broker.rx_bytes - mqtt_rx) / polls, 1),
+        "mqtt_ack_bytes": broker.tx_bytes - mqtt_tx,
+        "modbus_requests": modbus["requests"],
+        "modbus_rx_bytes": modbus["rx_bytes"],
+        "modbus_tx_bytes": modbus["tx_bytes"],
+        "lost_messages": lost,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Function to compare results with a baseline run
+    :return: list of regression descriptions, empty when there is none
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ("p50_ms", "p99_ms", "cpu_ms_per_poll"):
+            if base[key] and result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {key} {result[key]} > baseline {base[key]} (+{tolerance:.0%})"
+                )
+        if result["polls_per_sec"] < base["polls_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: polls_per_sec {result['polls_per_sec']} < baseline "
+                f"{base['polls_per_sec']} (-{tolerance:.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", action="append", help="run only these scenarios")
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--encoding", choices=("templates", "201"), default="templates")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a baseline run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s[0] in args.scenario]
+    if not scenarios:
+        parser.error(f"unknown scenario, choose from {[s[0] for s in SCENARIOS]}")
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_file = os.path.abspath(args.compare) if args.compare else None
+
+    broker = FakeBroker().start()
+    results = {}
+    try:
+        for scenario in scenarios:
+            result = results[scenario[0]] = run_scenario(
+                scenario, args.cycles, broker, args.encoding
+            )
+            print(
+                f"{scenario[0]:22s} {result['polls_per_sec']:8.1f} polls/s  "
+                f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+                f"cpu {result['cpu_ms_per_poll']:6.3f} ms/poll  "
+                f"rss {result['rss_peak_kb']} kB  "
+                f"mqtt {result['mqtt_bytes_per_poll']} B/poll  "
+                f"modbus {result['modbus_rx_bytes'] + result['modbus_tx_bytes']} B"
+            )
+    finally:
+        broker.stop()
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"scenarios": results}, f, indent=2)
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)["scenarios"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
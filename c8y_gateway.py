@@ -0,0 +1,472 @@
+import csv
+import datetime
+import io
+import logging
+import threading
+import time
+from concurrent import futures
+
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+
+from c8y.c8y_device import (
+    INVALID_CMD,
+    INVALID_SETTINGS,
+    SET_CONFIG_EXE,
+    SETCMD_EXE,
+    SETCMD_SUC,
+    SETCONFIG_FAIL,
+    SETCONFIG_SUC,
+    c8yDevice,
+)
+from c8y.smartrest import csv_field
+from publish_queue import PublishQueue
+
+logger = logging.getLogger("c8y_gateway")
+
+# largest SmartREST payload put into one MQTT message
+MAX_PAYLOAD = 16384
+# SmartREST static templates raising an alarm of each severity
+ALARM_TEMPLATES = {"CRITICAL": 301, "MAJOR": 302, "MINOR": 303, "WARNING": 304}
+
+
+def format_timestamp(timestamp):
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class c8yGateway(c8yDevice):
+    """c8yDevice which can push all measurements of one poll cycle together.
+    send_batch() turns a dict of series into one Cumulocity measurement with many
+    series (SmartREST static template 201) sharing a single timestamp, published as
+    one MQTT message unless it is larger than MAX_PAYLOAD.
+    Batches go through a bounded PublishQueue to a publisher worker thread of their own,
+    so neither a slow uplink nor the device state machine holds up the poller. The
+    worker takes up to coalesce batches at a time and packs their SmartREST lines into
+    as few MQTT messages as fit in MAX_PAYLOAD.
+    With a TemplateEncoder, batches are sent as SmartREST 2.0 template rows once the
+    server confirmed its template collection, registering it when missing; series
+    without template, and everything until the collection is confirmed, go out as 201.
+    Child devices registered with add_child() are created under the gateway device
+    (SmartREST 101) every time the MQTT session comes up, and batches sent with their
+    id go to the child topics s/us/<child> and s/uc/<xid>/<child>, so one session and
+    one certificate serve any number of slaves.
+    With a DataBudget, the bytes of every message sent and received are accounted.
+    With a MeasurementStore, measurements which cannot be published while the uplink
+    is down are written to disk and replayed in bulk, rate limited, once it is back.
+    With a PollMetrics the encoding and publishing of every batch is timed, and the
+    time from process start to the first published measurement is marked.
+    send_alarm() and clear_alarm() raise and clear alarms of the gateway or a child,
+    through the store like measurements.
+    c8y_Command operations run the function registered under their first word in
+    commands, with the rest of the text and the name of the child device it was sent
+    to. What it returns is the result of the operation, an exception fails it. A
+    command returning a concurrent.futures.Future is reported when the future is done,
+    without holding up the device thread meanwhile.
+    c8y_Configuration operations pass the configuration text to on_settings.
+    """
+
+    def __init__(
+        self,
+        *args,
+        max_payload=MAX_PAYLOAD,
+        store=None,
+        replay_batch=50,  # stored payloads combined into one MQTT message on replay
+        replay_rate=2,  # MQTT messages per second on replay
+        metrics=None,
+        queue_size=1000,  # batches waiting for the publisher worker
+        queue_policy=None,  # drop_oldest, block or spill, spill when there is a store
+        block_timeout=1.0,
+        coalesce=20,  # batches packed together by the publisher worker
+        templates=None,
+        budget=None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.max_payload = max_payload
+        self.store = store
+        self.replay_batch = replay_batch
+        self.replay_rate = replay_rate
+        self.metrics = metrics
+        self.commands = {}
+        # called with the text of a c8y_Configuration operation, raises when invalid
+        self.on_settings = None
+        if queue_policy is None:
+            queue_policy = "drop_oldest" if store is None else "spill"
+        self.outbox = PublishQueue(
+            queue_size, queue_policy, block_timeout, spill=self._spill
+        )
+        self.coalesce = coalesce
+        self.templates = templates
+        self.budget = budget
+        # child device id -> (name, type)
+        self.children = {}
+        self._templates_created = False
+        self._publisher = threading.Thread(
+            target=self._publish_loop, name="publisher", daemon=True
+        )
+        # a full bucket, the first stored payloads go out as soon as the uplink is up
+        self._replay_tokens = float(replay_rate)
+        self._replay_time = time.monotonic()
+
+    def add_child(self, child_id, name, child_type):
+        """
+        Function to register a child device of the gateway, created on the next connect
+        :param child_id: external id of the child, unique in the tenant
+        :param name: name of the child device
+        :param child_type: type of the child device
+        """
+        if any(c in child_id for c in "/+#,"):
+            raise ValueError(f"{child_id}: invalid child device id")
+        self.children[child_id] = (name, child_type)
+        if self.connected:
+            self._create_child(child_id)
+
+    def remove_child(self, child_id):
+        """
+        Function to stop serving a child device, it is neither created on connect nor
+        given operations anymore. The device stays in the inventory of Cumulocity
+        """
+        self.children.pop(child_id, None)
+
+    def _create_child(self, child_id):
+        # 101,childId,name,type, a child which exists already is left as it is
+        name, child_type = self.children[child_id]
+        self.publish(
+            "s/us",
+            f"101,{child_id},{csv_field(name)},{csv_field(child_type)}",
+            wait_for_ack=False,
+        )
+        if self.commands:
+            # a child takes the commands of the gateway, e.g. set for its own slave
+            self.publish(f"s/us/{child_id}", "114,c8y_Command", wait_for_ack=False)
+
+    def send_batch(self, fragment, measurements, timestamp, child=None):
+        """
+        Function to queue the measurements of one poll cycle for the publisher worker
+        :param fragment: measurement fragment, also used as measurement type
+        :param measurements: dict of series -> (value, unit)
+        :param timestamp: datetime shared by all series, or None for now, as the batch
+                 may wait in the queue
+        :param child: id of the child device the measurements belong to, None for the
+                 gateway itself
+        """
+        if not measurements:
+            return
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow()
+        self.outbox.put((fragment, measurements, timestamp, child))
+
+    def send_alarm(self, alarm_type, text, severity="MAJOR", child=None):
+        """
+        Function to raise an alarm on the gateway or one of its child devices, kept in
+        the store like measurements while the uplink is down
+        :param alarm_type: alarm type, an active alarm of the same type is updated
+        :param severity: one of ALARM_TEMPLATES
+        """
+        topic = "s/us" if child is None else f"s/us/{child}"
+        timestamp = format_timestamp(datetime.datetime.utcnow())
+        self.publish_measurements(
+            topic,
+            [
+                f"{ALARM_TEMPLATES[severity]},{csv_field(alarm_type)},"
+                f"{csv_field(text)},{timestamp}"
+            ],
+        )
+
+    def clear_alarm(self, alarm_type, child=None):
+        """
+        Function to clear the active alarm of a type
+        """
+        topic = "s/us" if child is None else f"s/us/{child}"
+        self.publish_measurements(topic, [f"306,{csv_field(alarm_type)}"])
+
+    def _spill(self, batch):
+        # a batch which does not fit in the full publish queue goes to the store
+        for topic, lines in self.encode_lines([batch]).items():
+            self.store.put(topic, lines)
+
+    def encode_lines(self, batches):
+        """
+        Function to encode batches into SmartREST lines, template rows when the
+        template collection is ready, 201 otherwise
+        :param batches: list of (fragment, measurements, timestamp, child)
+        :return: dict of topic -> list of lines
+        """
+        topics = {}
+        for fragment, measurements, timestamp, child in batches:
+            suffix = "" if child is None else f"/{child}"
+            if self.templates is not None and self.templates.ready:
+                rows, measurements = self.templates.encode(
+                    fragment, measurements, timestamp
+                )
+                if rows:
+                    topics.setdefault(
+                        f"s/uc/{self.templates.xid}{suffix}", []
+                    ).extend(rows)
+            if measurements:
+                topics.setdefault(f"s/us{suffix}", []).extend(
+                    self.encode_batch(fragment, measurements, timestamp)
+                )
+        return topics
+
+    def encode_batch(self, fragment, measurements, timestamp):
+        """
+        Function to encode measurements into as few SmartREST 201 messages as possible
+        :return: list of message payloads
+        """
+        # 201,type,time,fragment,series,value,unit,fragment,series,value,unit,...
+        head = f"201,{csv_field(fragment)},"
+        if timestamp is not None:
+            head += format_timestamp(timestamp)
+        messages = []
+        message = head
+        for series, (value, unit) in measurements.items():
+            row = f",{csv_field(fragment)},{csv_field(series)},{value},{csv_field(unit)}"
+            if message != head and len(message) + len(row) > self.max_payload:
+                messages.append(message)
+                message = head
+            message += row
+        messages.append(message)
+        return messages
+
+    def set_templates(self, templates):
+        """
+        Function to switch to another template collection, e.g. after the measurement
+        map changed, 201 is used until the server confirmed it
+        """
+        self.templates = templates
+        self._templates_created = False
+        if self.connected:
+            self._check_templates()
+
+    def save_settings(self, configurationText):
+        if self.on_settings is None:
+            return "configuration not supported"
+        try:
+            self.on_settings(configurationText)
+        except Exception as e:
+            logger.warning(f"configuration rejected: {e}")
+            return str(e)
+        return True
+
+    def _receive_settings(self, payload):
+        # 513,serial,configurationText. The text is a quoted CSV field holding commas,
+        # quotes and newlines, c8yDevice only takes its first word
+        self.publish("s/us", SET_CONFIG_EXE)
+        # wait some time for the portal to switch to executing state
+        time.sleep(10)
+        fields = next(csv.reader(io.StringIO(payload)), [])
+        if len(fields) < 3:
+            logger.warning(f"_receive_settings: invalid from portal {payload}")
+            self.publish("s/us", INVALID_SETTINGS)
+            return
+        r = self.save_settings(fields[2])
+        if type(r) is str:
+            self.publish("s/us", SETCONFIG_FAIL.format(r.replace('"', "'")))
+        else:
+            self.publish("s/us", SETCONFIG_SUC)
+
+    def _execute_command(self, payload):
+        # 511,serial,commandToExecute. The command is a quoted CSV field which may hold
+        # spaces, commas and quotes, c8yDevice only takes its first word. The serial of
+        # an operation of a child device is the child id, its status goes to the child
+        fields = next(csv.reader(io.StringIO(payload)), [])
+        child = fields[1] if len(fields) > 1 and fields[1] in self.children else None
+        topic = "s/us" if child is None else f"s/us/{child}"
+        slave = None if child is None else self.children[child][0]
+        self.publish(topic, SETCMD_EXE)
+        if len(fields) < 3:
+            logger.warning(f"_execute_command: invalid from portal {payload}")
+            self.publish(topic, INVALID_CMD)
+            return
+        name, _, args = fields[2].strip().partition(" ")
+        command = self.commands.get(name)
+        if command is None:
+            logger.warning(f"unknown command {fields[2]}")
+            self.publish(topic, INVALID_CMD)
+            return
+        try:
+            result = command(args.strip(), slave)
+        except Exception as e:
+            logger.warning(f"command {fields[2]} failed: {e}")
+            self.publish(topic, f"502,c8y_Command,{csv_field(e)}")
+            return
+        if isinstance(result, futures.Future):
+            result.add_done_callback(
+                lambda f: self._command_done(topic, fields[2], f)
+            )
+        elif result is None:
+            self.publish(topic, SETCMD_SUC)
+        else:
+            self.publish(topic, f"{SETCMD_SUC},{csv_field(result)}")
+
+    def _command_done(self, topic, command, future):
+        # runs in the thread which completed the future, e.g. the poll loop
+        if future.cancelled():
+            error = "cancelled"
+        else:
+            error = future.exception()
+        if error is not None:
+            logger.warning(f"command {command} failed: {error}")
+            self._publish_qos1(topic, f"502,c8y_Command,{csv_field(error)}")
+        elif future.result() is None:
+            self._publish_qos1(topic, SETCMD_SUC)
+        else:
+            self._publish_qos1(topic, f"{SETCMD_SUC},{csv_field(future.result())}")
+
+    def pack_lines(self, lines):
+        """
+        Function to join SmartREST lines into as few payloads of at most max_payload as
+        possible, one line per row
+        :return: list of payloads
+        """
+        payloads = []
+        payload = ""
+        for line in lines:
+            if payload and len(payload) + len(line) + 1 > self.max_payload:
+                payloads.append(payload)
+                payload = ""
+            payload = f"{payload}\n{line}" if payload else line
+        if payload:
+            payloads.append(payload)
+        return payloads
+
+    def _publish_loop(self):
+        while self.on:
+            try:
+                batches = self.outbox.get_many(self.coalesce, timeout=1)
+                if batches:
+                    start = time.monotonic()
+                    for topic, lines in self.encode_lines(batches).items():
+                        self.publish_measurements(topic, self.pack_lines(lines))
+                    if self.metrics is not None:
+                        self.metrics.record("publish", time.monotonic() - start)
+                if self.store is not None:
+                    self.replay()
+            except:
+                logger.exception("publisher")
+                if self.on:
+                    time.sleep(5)
+
+    def publish_measurements(self, topic, messages):
+        """
+        Function to publish measurement payloads, or store them when they cannot go out
+        now or older payloads are still waiting in the store
+        """
+        if self.store is None:
+            for message in messages:
+                self.publish(topic, message, wait_for_ack=False)
+            if self.metrics is not None:
+                self.metrics.mark("first_publish")
+            return
+        for i, message in enumerate(messages):
+            if (
+                not self.connected
+                or self.store.depth()
+                or not self._try_publish(topic, message)
+            ):
+                self.store.put(topic, messages[i:])
+                return
+
+    def publish(self, topic, message, wait_for_ack=True):
+        if self.budget is not None:
+            self.budget.message(topic, message)
+        super().publish(topic, message, wait_for_ack)
+
+    def _try_publish(self, topic, message):
+        message_info = self._client.publish(topic, message, self.measurement_qos)
+        # paho keeps a QoS 1/2 message it could not send for lack of connection and
+        # sends it after the reconnect, storing it as well would send it twice. Only
+        # messages paho dropped (QoS 0, or its queue full) go to the store
+        queued = message_info.rc == MQTT_ERR_NO_CONN and self.measurement_qos > 0
+        if message_info.rc != MQTT_ERR_SUCCESS and not queued:
+            return False
+        if self.budget is not None:
+            self.budget.message(topic, message)
+        if self.metrics is not None:
+            self.metrics.mark("first_publish")
+        return True
+
+    def replay(self):
+        """
+        Function to publish stored payloads, several per MQTT message, at most
+        replay_rate messages per second
+        """
+        now = time.monotonic()
+        self._replay_tokens = min(
+            self.replay_rate,
+            self._replay_tokens + (now - self._replay_time) * self.replay_rate,
+        )
+        self._replay_time = now
+        while self.connected and self.store.depth() and self._replay_tokens >= 1:
+            rows = self.store.peek(self.replay_batch)
+            topic = rows[0][1]
+            message = ""
+            last_id = None
+            for row_id, row_topic, payload in rows:
+                if row_topic != topic or (
+                    message and len(message) + len(payload) + 1 > self.max_payload
+                ):
+                    break
+                message = f"{message}\n{payload}" if message else payload
+                last_id = row_id
+            if not self._try_publish(topic, message):
+                return
+            self.store.remove(last_id)
+            self._replay_tokens -= 1
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0 and self.children:
+            # children before the measurements of the publisher worker, which goes on
+            # once connected is set, and the gateway before its children (100 is
+            # sent again by the state machine, it is ignored for an existing device)
+            self.publish("s/us", f"100,,{self.device_type}", wait_for_ack=False)
+            for child_id in list(self.children):
+                self._create_child(child_id)
+        super()._on_connect(client, userdata, flags, rc)
+
+    def state_machine(self, event):
+        super().state_machine(event)
+        if event["name"] == "connected" and self.templates is not None:
+            # responses about template collections come on s/dt
+            self._client.subscribe("s/dt")
+            self._check_templates()
+
+    def _check_templates(self):
+        # an empty message asks whether the collection exists: 20,... yes, 41,... no
+        self._publish_qos1(f"s/ut/{self.templates.xid}", "")
+
+    def _publish_qos1(self, topic, message):
+        # template requests and the status of operations done later go out at QoS 1
+        # whatever measurement_qos is, without waiting for the ack
+        if self.budget is not None:
+            self.budget.message(topic, message)
+        self._client.publish(topic, message, 1)
+
+    def _on_message(self, client, userdata, message):
+        if self.budget is not None:
+            self.budget.message(message.topic, message.payload, received=True)
+        if message.topic != "s/dt" or self.templates is None:
+            super()._on_message(client, userdata, message)
+            return
+        response = message.payload.decode("utf-8")
+        if response.startswith("20"):
+            if not self.templates.ready:
+                logger.info(f"template collection {self.templates.xid} ready")
+            self.templates.ready = True
+        elif response.startswith("41"):
+            if self._templates_created:
+                logger.error(
+                    f"template collection {self.templates.xid} not accepted, "
+                    "measurements are sent as 201"
+                )
+                return
+            logger.info(f"registering template collection {self.templates.xid}")
+            self._templates_created = True
+            self._publish_qos1(
+                f"s/ut/{self.templates.xid}", "\n".join(self.templates.template_lines)
+            )
+            self._check_templates()
+
+    def run(self):
+        self._publisher.start()
+        super().run()
@@ -0,0 +1,182 @@
+import logging
+import os
+import struct
+import time
+
+from modbus.register_map import MAX_READ_COUNT
+
+logger = logging.getLogger("capture")
+
+MAGIC = b"MBCAP\x01"
+# record types
+SESSION = 1  # time.time() and time.monotonic() when the file was opened
+SLAVE = 2  # id given to a slave name in the records following it
+BLOCK = 3  # raw registers of one read
+
+_TYPE = struct.Struct("<B")
+_SESSION = struct.Struct("<dd")
+_SLAVE = struct.Struct("<HB")
+# monotonic time of the poll, slave id, unit, protocol address, number of registers
+_BLOCK = struct.Struct("<dHBHH")
+
+
+class CaptureWriter:
+    """Appends the raw registers of every block read to a binary capture file, 16 bytes
+    per block plus 2 per register, with the slave, unit, address and the monotonic time
+    of its poll. Each run of the gateway starts a session holding its wall clock and
+    monotonic time, so records can be put back on the calendar.
+    When the file grows over max_bytes it is moved to <path>.1 and a new one is started.
+    The records of a poll cycle are collected in memory and written with one write()
+    by flush(), so a killed gateway mostly leaves whole cycles behind. A record torn by
+    a power cut is cut off when the file is opened again. A file corrupt before its end
+    is not cut, it is moved to <path>.corrupt and a new one is started.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._buffer = bytearray()
+        self._open()
+
+    def _open(self):
+        # a record torn by a crash or power cut while it was written is cut off, the
+        # new session would otherwise be read as its missing bytes
+        length = _whole_length(self.path)
+        if length is None:
+            # the records after a corrupt one cannot be found again, read_capture still
+            # reads the ones before it
+            logger.error(f"{self.path}: corrupt record, moved to {self.path}.corrupt")
+            os.replace(self.path, f"{self.path}.corrupt")
+        elif os.path.exists(self.path) and os.path.getsize(self.path) > length:
+            logger.warning(f"{self.path}: record cut short at {length}, truncated")
+            os.truncate(self.path, length)
+        self._file = open(self.path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._buffer += _TYPE.pack(SESSION)
+        self._buffer += _SESSION.pack(time.time(), time.monotonic())
+        # slave ids are per file, the names are written again after a rotation
+        self._slaves = {}
+
+    def write(self, slave, unit, timestamp, address, registers):
+        """
+        Function to append the registers of one read
+        :param slave: slave name
+        :param timestamp: time.monotonic() of the poll, shared by all its reads
+        :param address: protocol address of the first register
+        """
+        slave_id = self._slaves.get(slave)
+        if slave_id is None:
+            slave_id = self._slaves[slave] = len(self._slaves)
+            name = slave.encode()
+            self._buffer += _TYPE.pack(SLAVE) + _SLAVE.pack(slave_id, len(name)) + name
+        count = len(registers)
+        self._buffer += _TYPE.pack(BLOCK) + _BLOCK.pack(
+            timestamp, slave_id, unit, address, count
+        )
+        self._buffer += struct.pack(f"<{count}H", *registers)
+
+    def flush(self):
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+        if self._file.tell() > self.max_bytes:
+            self._file.close()
+            os.replace(self.path, f"{self.path}.1")
+            logger.info(f"{self.path} full, moved to {self.path}.1")
+            self._open()
+
+    def close(self):
+        self._file.write(self._buffer)
+        self._buffer.clear()
+        self._file.close()
+
+
+def _records(f):
+    # (record type, fields) of the records after MAGIC, up to a record cut short
+    while True:
+        kind = f.read(_TYPE.size)
+        if not kind:
+            return
+        kind = kind[0]
+        if kind == SESSION:
+            data = f.read(_SESSION.size)
+            if len(data) < _SESSION.size:
+                return
+            yield kind, _SESSION.unpack(data)
+        elif kind == SLAVE:
+            data = f.read(_SLAVE.size)
+            if len(data) < _SLAVE.size:
+                return
+            slave_id, length = _SLAVE.unpack(data)
+            name = f.read(length)
+            if len(name) < length:
+                return
+            yield kind, (slave_id, name.decode())
+        elif kind == BLOCK:
+            data = f.read(_BLOCK.size)
+            if len(data) < _BLOCK.size:
+                return
+            timestamp, slave_id, unit, address, count = _BLOCK.unpack(data)
+            if count > MAX_READ_COUNT:
+                raise ValueError(f"{f.name}: corrupt block of {count} registers")
+            data = f.read(2 * count)
+            if len(data) < 2 * count:
+                return
+            registers = struct.unpack(f"<{count}H", data)
+            yield kind, (timestamp, slave_id, unit, address, registers)
+        else:
+            raise ValueError(f"{f.name}: unknown record type {kind}")
+
+
+def _whole_length(path):
+    # bytes of the capture file up to the end of its last whole record, only a record
+    # cut short by the end of the file is left out, None when one before it is corrupt
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    with f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            if MAGIC.startswith(magic):
+                return 0
+            raise ValueError(f"{path} is not a capture file")
+        end = f.tell()
+        try:
+            for _ in _records(f):
+                end = f.tell()
+        except ValueError:
+            return None
+        return end
+
+
+def read_capture(path):
+    """
+    Function to read a capture file, a record cut short at its end is ignored, a
+    corrupt one raises ValueError after the records before it
+    :return: generator of (time.time(), slave name, unit, address, registers) of every
+             block, the time of the poll it was read in
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        wall = mono = 0.0
+        slaves = {}
+        for kind, fields in _records(f):
+            if kind == SESSION:
+                wall, mono = fields
+                slaves = {}
+            elif kind == SLAVE:
+                slave_id, name = fields
+                slaves[slave_id] = name
+            else:
+                timestamp, slave_id, unit, address, registers = fields
+                yield (
+                    wall + timestamp - mono,
+                    slaves[slave_id],
+                    unit,
+                    address,
+                    registers,
+                )
@@ -0,0 +1,227 @@
+import hashlib
+import logging
+import os
+import pickle
+
+from modbus import decoder, register_map
+from modbus.register_map import load_poll_groups, load_slaves, plan_reads
+
+logger = logging.getLogger("config_cache")
+
+# bump when the layout of the cache file changes
+CACHE_VERSION = 1
+
+
+def _code_key():
+    # the cached namedtuples and layouts belong to the register_map/decoder they came from
+    return tuple(os.stat(m.__file__).st_mtime_ns for m in (register_map, decoder))
+
+
+def load_yaml(path):
+    """
+    Function to parse a YAML file with the libyaml C loader when PyYAML has it
+    """
+    import yaml
+
+    with open(path) as f:
+        return yaml.load(f, Loader=getattr(yaml, "CFullLoader", yaml.FullLoader))
+
+
+class ConfigCache:
+    """config.yaml together with the slaves, poll groups and read plans compiled from
+    it, pickled into one file. On a restart with an unchanged config.yaml (same mtime
+    and size, or same SHA-1 when only the mtime changed) nothing is parsed or planned
+    and yaml is not even imported, so the first poll starts right away.
+    changed() tells whether config.yaml was written since, reload() compiles it again
+    keeping the read plans of the slaves it did not touch.
+    """
+
+    def __init__(self, config_file, cache_file):
+        self.config_file = config_file
+        self.cache_file = cache_file
+        self.config = None
+        self.slaves = None
+        self.groups = None
+        # (slave name, frozenset of group names) -> list of ReadBlock
+        self.plans = {}
+        self.hit = False
+        self._key = None
+        self._dirty = False
+        # (mtime_ns, size) of config.yaml when it was last loaded or rejected
+        self._seen = None
+
+    def load(self):
+        """
+        Function to load the config from the cache, or parse and compile config.yaml
+        :return: config dict
+        """
+        st = os.stat(self.config_file)
+        self._seen = (st.st_mtime_ns, st.st_size)
+        key = {
+            "version": CACHE_VERSION,
+            "code": _code_key(),
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "sha1": None,
+        }
+        cached = self._read_cache()
+        if cached is not None and all(
+            cached["key"][k] == key[k] for k in ("version", "code", "size")
+        ):
+            if cached["key"]["mtime_ns"] == key["mtime_ns"]:
+                key["sha1"] = cached["key"]["sha1"]
+            else:
+                key["sha1"] = self._sha1()
+                # touched but not changed, the new mtime is saved
+                self._dirty = True
+            if key["sha1"] == cached["key"]["sha1"]:
+                self._key = key
+                self.config = cached["config"]
+                self.slaves = cached["slaves"]
+                self.groups = cached["groups"]
+                self.plans = cached["plans"]
+                self.hit = True
+                logger.info(f"config loaded from {self.cache_file}")
+                return self.config
+
+        key["sha1"] = key["sha1"] or self._sha1()
+        self._key = key
+        self.config = load_yaml(self.config_file)
+        self.slaves = load_slaves(self.config["modbus"])
+        self.groups = load_poll_groups(
+            self.config["modbus"], [p for sl in self.slaves for p in sl.points]
+        )
+        self.plans = {}
+        self._dirty = True
+        return self.config
+
+    def changed(self):
+        """
+        Function to check whether config.yaml was written since it was loaded
+        """
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return False
+        return (st.st_mtime_ns, st.st_size) != self._seen
+
+    def reload(self):
+        """
+        Function to load config.yaml again. The read plans of slaves with the same
+        settings and points are kept. An invalid config.yaml leaves the loaded config
+        as it is, and is only tried again once it is written again
+        :return: dict of the names of the slaves added, changed and removed, the names
+                 of the poll groups added, changed and removed, and the old slaves
+        """
+        old = (self._key, self.config, self.slaves, self.groups, self.plans)
+        try:
+            self.load()
+        except Exception:
+            self._key, self.config, self.slaves, self.groups, self.plans = old
+            raise
+        old_config, old_slaves, old_groups, old_plans = old[1:]
+        old_slaves = {sl.name: sl for sl in old_slaves}
+        new_slaves = {sl.name: sl for sl in self.slaves}
+        # plans depend on the points of the slave and on these two
+        same_layout = all(
+            old_config["modbus"].get(k) == self.config["modbus"].get(k)
+            for k in ("max_gap", "register_base")
+        )
+        changed = {
+            name
+            for name, sl in new_slaves.items()
+            if name in old_slaves and (old_slaves[name] != sl or not same_layout)
+        }
+        for (name, groups), plan in old_plans.items():
+            if name in new_slaves and name not in changed:
+                self.plans.setdefault((name, groups), plan)
+        return {
+            "added": set(new_slaves) - set(old_slaves),
+            "changed": changed,
+            "removed": set(old_slaves) - set(new_slaves),
+            "groups": {
+                name
+                for name in set(old_groups) | set(self.groups)
+                if old_groups.get(name) != self.groups.get(name)
+            },
+            "old_slaves": old_slaves,
+        }
+
+    def write(self, text):
+        """
+        Function to replace config.yaml with text, after checking that its slaves and
+        poll groups load
+        """
+        tmp = f"{self.config_file}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        try:
+            config = load_yaml(tmp)
+            slaves = load_slaves(config["modbus"])
+            load_poll_groups(config["modbus"], [p for sl in slaves for p in sl.points])
+        except Exception:
+            os.remove(tmp)
+            raise
+        os.replace(tmp, self.config_file)
+
+    def plan(self, slave, groups):
+        """
+        Function to get the read plan of the points of slave in groups, planned once
+        :param groups: frozenset of group names
+        :return: list of ReadBlock
+        """
+        plan = self.plans.get((slave.name, groups))
+        if plan is None:
+            modbus = self.config["modbus"]
+            plan = self.plans[(slave.name, groups)] = plan_reads(
+                [p for p in slave.points if p.group in groups],
+                modbus.get("max_gap", 0),
+                modbus.get("register_base", 1),
+            )
+            logger.info(
+                f"{slave.name}: groups {sorted(groups)} are polled with {len(plan)} requests"
+            )
+            self._dirty = True
+        return plan
+
+    def save(self):
+        """
+        Function to write the cache file if anything was compiled since it was loaded
+        """
+        if not self._dirty:
+            return
+        tmp = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(
+                    {
+                        "key": self._key,
+                        "config": self.config,
+                        "slaves": self.slaves,
+                        "groups": self.groups,
+                        "plans": self.plans,
+                    },
+                    f,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp, self.cache_file)
+            self._dirty = False
+        except OSError as e:
+            logger.error(f"cannot write {self.cache_file}: {e}")
+
+    def _sha1(self):
+        with open(self.config_file, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached["key"]["version"] == CACHE_VERSION:
+                return cached
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # stale or broken cache, compiled again from config.yaml
+            logger.warning(f"ignoring {self.cache_file}: {e}")
+        return None
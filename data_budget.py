@@ -0,0 +1,168 @@
+import calendar
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("data_budget")
+
+# bytes added to every MQTT message for the fixed header, topic length, packet id,
+# the PUBACK and the TLS record, on top of topic and payload
+MESSAGE_OVERHEAD = 60
+
+
+def _size(data):
+    # bytes on the wire, str goes out UTF-8 encoded
+    return len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+
+
+class DataBudget:
+    """Accounting of the bytes sent and received on the Cumulocity connection per day
+    and per calendar month (UTC), kept in a small JSON file across restarts, and the
+    throttle factor keeping the projected monthly usage under the data plan cap.
+    adjust() raises the factor by step while the month is projected above high of the
+    cap (or the day above high of the daily cap) and lowers it again below low. The
+    factor stretches heartbeats, deadbands and aggregation windows of all points but
+    the priority ones.
+    The counters are written to flash when the factor changes, otherwise at most every
+    save_interval seconds, and by save() at shutdown.
+    """
+
+    def __init__(
+        self,
+        path,
+        monthly_cap,
+        daily_cap=None,
+        high=0.9,
+        low=0.6,
+        step=1.5,
+        max_factor=16,
+        clock=time.time,
+        save_interval=3600,
+    ):
+        """
+        :param path: JSON file holding the counters
+        :param monthly_cap: bytes of the data plan per month
+        :param daily_cap: bytes per day, None for no daily limit
+        """
+        self.path = path
+        self.monthly_cap = monthly_cap
+        self.daily_cap = daily_cap
+        self.high = high
+        self.low = low
+        self.step = step
+        self.max_factor = max_factor
+        self.clock = clock
+        self.save_interval = save_interval
+        self.factor = 1.0
+        self._lock = threading.Lock()
+        self._state = {
+            "day": None,
+            "month": None,
+            "day_sent": 0,
+            "day_received": 0,
+            "month_sent": 0,
+            "month_received": 0,
+            "factor": 1.0,
+        }
+        try:
+            with open(path) as f:
+                self._state.update(json.load(f))
+            self.factor = self._state["factor"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"ignoring {path}: {e}")
+        self._roll(self.clock())
+        self._saved_at = self.clock()
+
+    def _roll(self, now):
+        # new day or month, counters start again
+        today = datetime.datetime.utcfromtimestamp(now)
+        day, month = today.strftime("%Y-%m-%d"), today.strftime("%Y-%m")
+        if self._state["month"] != month:
+            self._state.update(month=month, month_sent=0, month_received=0)
+        if self._state["day"] != day:
+            self._state.update(day=day, day_sent=0, day_received=0)
+
+    def add(self, sent=0, received=0):
+        """
+        Function to account bytes of one MQTT message
+        """
+        with self._lock:
+            self._roll(self.clock())
+            self._state["day_sent"] += sent
+            self._state["day_received"] += received
+            self._state["month_sent"] += sent
+            self._state["month_received"] += received
+
+    def message(self, topic, payload, received=False):
+        size = _size(topic) + _size(payload) + MESSAGE_OVERHEAD
+        if received:
+            self.add(received=size)
+        else:
+            self.add(sent=size)
+
+    def usage(self):
+        """
+        :return: dict of bytes used today and this month, the projected month and the
+                 throttle factor
+        """
+        now = self.clock()
+        with self._lock:
+            self._roll(now)
+            state = dict(self._state)
+        today = datetime.datetime.utcfromtimestamp(now)
+        month_start = datetime.datetime(today.year, today.month, 1)
+        days = calendar.monthrange(today.year, today.month)[1]
+        # at least an hour, the first minutes of a month say nothing about its rate
+        elapsed = max(3600.0, (today - month_start).total_seconds())
+        month = state["month_sent"] + state["month_received"]
+        return {
+            "day": state["day_sent"] + state["day_received"],
+            "month": month,
+            "projected": int(month * days * 86400 / elapsed),
+            "cap": self.monthly_cap,
+            "factor": self.factor,
+        }
+
+    def adjust(self):
+        """
+        Function to raise or lower the throttle factor from the projected usage, and
+        save the counters when it changed or save_interval passed
+        :return: throttle factor, 1 means no throttling
+        """
+        usage = self.usage()
+        load = usage["projected"] / self.monthly_cap
+        if self.daily_cap:
+            load = max(load, usage["day"] / self.daily_cap)
+        factor = self.factor
+        if load > self.high:
+            factor = min(self.max_factor, factor * self.step)
+        elif load < self.low:
+            factor = max(1.0, factor / self.step)
+        if factor != self.factor:
+            logger.warning(
+                f"data budget: {usage['projected']} of {self.monthly_cap} bytes projected "
+                f"this month, throttle factor {self.factor:g} -> {factor:g}"
+            )
+            self.factor = factor
+            self.save()
+        elif self.clock() - self._saved_at >= self.save_interval:
+            self.save()
+        return self.factor
+
+    def save(self):
+        with self._lock:
+            self._state["factor"] = self.factor
+            state = dict(self._state)
+        self._saved_at = self.clock()
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.error(f"cannot write {self.path}: {e}")
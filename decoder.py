@@ -0,0 +1,166 @@
+import struct
+from functools import lru_cache
+
+# format -> (struct code, number of 16bit registers)
+FORMATS = {
+    "16bit_integer": ("h", 1),
+    "16bit_uint": ("H", 1),
+    "32bit_integer": ("i", 2),
+    "32bit_uint": ("I", 2),
+    "32bit_float": ("f", 2),
+    "64bit_integer": ("q", 4),
+    "64bit_uint": ("Q", 4),
+    "64bit_float": ("d", 4),
+}
+
+# Every word/byte order is decoded by packing the registers either big or little endian,
+# then unpacking the value either big or little endian, e.g. for the bytes ABCD of a float:
+#   standard          AB CD   registers packed big endian    -> ABCD, unpacked big endian
+#   reverse           CD AB   registers packed little endian -> DCBA, unpacked little endian
+#   byteswap          BA DC   registers packed little endian -> ABCD, unpacked big endian
+#   reverse_byteswap  DC BA   registers packed big endian    -> DCBA, unpacked little endian
+# word_order -> (pack little endian, unpack little endian)
+WORD_ORDERS = {
+    "standard": (False, False),
+    "reverse": (True, True),
+    "byteswap": (True, False),
+    "reverse_byteswap": (False, True),
+}
+
+
+def register_count(format):
+    return FORMATS[format][1]
+
+
+class _Pass:
+    # one struct.Struct unpacking all non overlapping fields which share a byte order
+    def __init__(self, pack_le, unpack_le):
+        self.pack_le = pack_le
+        self.unpack_le = unpack_le
+        self.codes = []
+        self.indexes = []
+        self.end = 0
+
+    def add(self, index, offset, format):
+        code, width = FORMATS[format]
+        if offset > self.end:
+            self.codes.append(f"{(offset - self.end) * 2}x")
+        self.codes.append(code)
+        self.indexes.append(index)
+        self.end = offset + width
+
+    def compile(self):
+        endian = "<" if self.unpack_le else ">"
+        self.struct = struct.Struct(endian + "".join(self.codes))
+
+
+class BlockLayout:
+    """Precompiled decoder for a block of holding registers holding fields of mixed
+    formats and word orders. decode() packs the whole block into bytes once per byte
+    order and unpacks all fields with one struct call per pass.
+    """
+
+    def __init__(self, fields, count):
+        """
+        :param fields: list of (register offset, format, word_order)
+        :param count: number of registers in the block
+        """
+        self.fields = tuple(fields)
+        self.count = count
+        self._pack_be = struct.Struct(f">{count}H")
+        self._pack_le = struct.Struct(f"<{count}H")
+        passes = []
+        for index, (offset, format, word_order) in sorted(
+            enumerate(self.fields), key=lambda f: f[1][0]
+        ):
+            if format not in FORMATS:
+                raise ValueError(f"unsupported format {format}")
+            if word_order not in WORD_ORDERS:
+                raise ValueError(f"unsupported word_order {word_order}")
+            if offset + FORMATS[format][1] > count:
+                raise ValueError(f"field at offset {offset} is outside of the block")
+            pack_le, unpack_le = WORD_ORDERS[word_order]
+            single = FORMATS[format][1] == 1
+            for p in passes:
+                if p.end > offset:
+                    continue
+                if (p.pack_le, p.unpack_le) == (pack_le, unpack_le):
+                    break
+                # a single register only depends on whether its bytes end up swapped
+                if single and p.pack_le ^ p.unpack_le == pack_le ^ unpack_le:
+                    break
+            else:
+                p = _Pass(pack_le, unpack_le)
+                passes.append(p)
+            p.add(index, offset, format)
+        for p in passes:
+            p.compile()
+        self._passes = passes
+        # common case, one pass with fields in the given order needs no scatter
+        self._direct = len(passes) == 1 and passes[0].indexes == list(
+            range(len(self.fields))
+        )
+
+    def __reduce__(self):
+        # struct.Struct cannot be pickled, the layout is compiled again when loaded
+        return BlockLayout, (self.fields, self.count)
+
+    def decode(self, registers):
+        """
+        :param registers: list of 16bit register values, at least count of them
+        :return: list of values in the order of fields
+        :raises struct.error: if fewer than count registers are given
+        """
+        if len(registers) != self.count:
+            registers = registers[: self.count]
+        raw_be = raw_le = None
+        if self._direct:
+            p = self._passes[0]
+            raw = (self._pack_le if p.pack_le else self._pack_be).pack(*registers)
+            return list(p.struct.unpack_from(raw))
+        values = [None] * len(self.fields)
+        for p in self._passes:
+            if p.pack_le:
+                if raw_le is None:
+                    raw_le = self._pack_le.pack(*registers)
+                raw = raw_le
+            else:
+                if raw_be is None:
+                    raw_be = self._pack_be.pack(*registers)
+                raw = raw_be
+            for index, value in zip(p.indexes, p.struct.unpack_from(raw)):
+                values[index] = value
+        return values
+
+
+@lru_cache(maxsize=64)
+def array_layout(size, format="16bit_integer", word_order="standard"):
+    """
+    Function to get the BlockLayout of size registers all holding values of one format
+    :return: BlockLayout
+    """
+    width = register_count(format)
+    fields = [(offset, format, word_order) for offset in range(0, size - width + 1, width)]
+    return BlockLayout(fields, size)
+
+
+def decode_array(registers, format="16bit_integer", word_order="standard"):
+    """
+    Function to decode a register array holding values of one format
+    :param registers: list of 16bit register values
+    :return: list of values, trailing registers not filling a whole value are ignored
+    """
+    return array_layout(len(registers), format, word_order).decode(registers)
+
+
+def encode_value(value, format="16bit_integer", word_order="standard"):
+    """
+    Function to convert a value into holding registers, the inverse of decoding
+    :return: list of 16bit register values
+    """
+    code, width = FORMATS[format]
+    pack_le, unpack_le = WORD_ORDERS[word_order]
+    if code not in "fd":
+        value = int(round(value))
+    raw = struct.pack(("<" if unpack_le else ">") + code, value)
+    return list(struct.unpack(("<" if pack_le else ">") + f"{width}H", raw))
@@ -0,0 +1,169 @@
+import bisect
+import json
+import os
+import time
+
+# upper bounds of the histogram buckets in seconds, 100us to ~150s in steps of sqrt(2)
+BUCKETS = tuple(0.0001 * 2 ** (i / 2) for i in range(42))
+
+
+class Histogram:
+    """Fixed memory latency histogram, one counter per bucket plus sum and max.
+    Percentiles are approximated by the upper bound of their bucket (within 41%).
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        """
+        :return: dict of count, mean, p50, p99 and max in milliseconds
+        """
+        return {
+            "count": self.count,
+            "mean_ms": round(1000 * self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(1000 * self.percentile(50), 3),
+            "p99_ms": round(1000 * self.percentile(99), 3),
+            "max_ms": round(1000 * self.max, 3),
+        }
+
+
+class PollMetrics:
+    """Timing of the stages of the poll cycle: connect, read (one request round trip),
+    decode, publish and the whole cycle. Callers time a stage with time.monotonic()
+    and record() the difference, which costs about a microsecond, so it stays on in
+    production. Histograms cover one report interval and are cleared by report().
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.monotonic()
+        self._interval_start = self.started
+        # event -> seconds from the start of the process to its first occurrence
+        self.startup = {}
+
+    def record(self, stage, seconds):
+        h = self.stages.get(stage)
+        if h is None:
+            h = self.stages[stage] = Histogram()
+        h.record(seconds)
+
+    def mark(self, event):
+        if event not in self.startup:
+            age = process_age()
+            if age is None:
+                age = time.monotonic() - self.started
+            self.startup[event] = round(age, 3)
+
+    def report(self, slave_stats=None, health=None):
+        """
+        Function to summarise the stages since the last report and start a new interval
+        :param slave_stats: dict of slave name -> SlaveStats of the poller
+        :param health: dict of slave name -> SlaveHealth of the poller
+        :return: dict of uptime, interval, stage summaries and slave counters
+        """
+        now = time.monotonic()
+        stages = self.stages
+        self.stages = {}
+        snapshot = {
+            "uptime": round(now - self.started),
+            "interval": round(now - self._interval_start, 1),
+            "startup": dict(self.startup),
+            "stages": {name: h.summary() for name, h in stages.items()},
+            "slaves": {},
+        }
+        self._interval_start = now
+        for name, s in (slave_stats or {}).items():
+            snapshot["slaves"][name] = {
+                "polls": s.polls,
+                "timeouts": s.timeouts,
+                "errors": s.errors,
+                "connects": s.connects,
+                "skipped": s.skipped,
+                "last_duration_ms": round(1000 * s.last_duration, 1),
+            }
+            h = (health or {}).get(name)
+            if h is not None:
+                snapshot["slaves"][name]["circuit"] = h.state
+                snapshot["slaves"][name]["timeout_ms"] = round(1000 * h.rto, 1)
+        return snapshot
+
+
+def process_age():
+    """
+    Function to get the seconds since the process was started, interpreter start-up
+    and imports included
+    :return: seconds, or None without /proc
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime in clock ticks after boot, 22nd field, the name may hold spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def health_measurements(snapshot):
+    """
+    Function to turn a report into Cumulocity series
+    :return: dict of series -> (value, unit)
+    """
+    measurements = {"uptime": (snapshot["uptime"], "s")}
+    for event, seconds in snapshot["startup"].items():
+        measurements[f"{event}_time"] = (seconds, "s")
+    for stage, summary in snapshot["stages"].items():
+        measurements[f"{stage}_count"] = (summary["count"], "")
+        for key in ("p50_ms", "p99_ms", "max_ms"):
+            measurements[f"{stage}_{key[:-3]}"] = (summary[key], "ms")
+    for slave, counters in snapshot["slaves"].items():
+        for key in ("timeouts", "errors", "connects", "skipped"):
+            measurements[f"{slave}_{key}"] = (counters[key], "")
+        if "circuit" in counters:
+            opened = int(counters["circuit"] != "closed")
+            measurements[f"{slave}_circuit_open"] = (opened, "")
+            measurements[f"{slave}_timeout"] = (counters["timeout_ms"], "ms")
+    for key, value in snapshot.get("publish_queue", {}).items():
+        measurements[f"queue_{key}"] = (value, "")
+    for key, value in snapshot.get("store", {}).items():
+        measurements[f"store_{key}"] = (value, "/s" if key == "replay_rate" else "")
+    for key, value in snapshot.get("proxy", {}).items():
+        measurements[f"proxy_{key}"] = (value, "")
+    for key, value in snapshot.get("budget", {}).items():
+        measurements[f"budget_{key}"] = (value, "" if key == "factor" else "B")
+    return measurements
+
+
+def write_stats(path, snapshot):
+    """
+    Function to write a report to a local JSON file, replaced atomically
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f, indent=1)
+    os.replace(tmp, path)
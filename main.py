@@ -1,38 +1,176 @@
 import datetime
 import logging
+import os
 import platform
-import sys
+import signal
 import time
 import ssl
 import pathlib
 
-import yaml
 #MN To interact with Cumulocity IoT devices.
-from c8y.c8y_device import c8yDevice
+from c8y.c8y_gateway import c8yGateway
+from c8y.smartrest import TemplateEncoder
 #MN To read "holding registers" in a Modbus device.
-from modbus.modbus_client import read_hr
+from modbus.async_poller import AsyncPoller
+from modbus.modbus_proxy import ModbusProxy, RegisterCache
+from modbus.modbus_write import WriteQueue, execute_writes, parse_writes
+from aggregation import WindowAggregator
+from capture import CaptureWriter
+from config_cache import ConfigCache
+from data_budget import DataBudget
+from instrumentation import PollMetrics, health_measurements, write_stats
+from report_by_exception import ReportByException
+from sample_history import SampleHistory
+from scheduler import PollScheduler
+from store_forward import MeasurementStore
+from trace_buffer import PUBLISH, VALUE, TraceBuffer, production_logging
 
-#MN Logging to the console is enabled
+#MN Logging to the console is enabled, installed when run as main, not when imported
 log_console = True
-if log_console:
-    root = logging.getLogger()
-    root.setLevel(logging.DEBUG)
-
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.DEBUG)
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    handler.setFormatter(formatter)
-    root.addHandler(handler)
 
 
-if __name__ == "__main__":
-    logging.basicConfig(
-        format="%(asctime)-15s %(levelname)s %(name)-18s %(message)s",
-        level=logging.DEBUG,
-    )
+def send_points(client, points, values, timestamp, child=None):
+    """
+    Function to push the values of points to Cumulocity, one measurement per fragment
+    :param client: c8yGateway
+    :param points: list of Point to push
+    :param values: dict of point name -> value
+    :param timestamp: datetime the values were read
+    :param child: child device id the values belong to, None for the gateway device
+    """
+    fragments = {}
+    for point in points:
+        fragments.setdefault(point.fragment, {})[point.series] = (
+            values[point.name],
+            point.unit,
+        )
+    for fragment, measurements in fragments.items():
+        client.send_batch(fragment, measurements, timestamp, child)
+
+
+def send_windows(client, slave, windows, stats, child=None):
+    """
+    Function to push closed aggregation windows, one measurement per window end and
+    fragment. The mean keeps the series name of the point, other stats get a suffix
+    :param client: c8yGateway
+    :param slave: Slave the values were read from
+    :param windows: list of (window end, point name, summary dict) from WindowAggregator
+    :param stats: names of the summary values to push
+    :param child: child device id the values belong to, None for the gateway device
+    """
+    points = {p.name: p for p in slave.points}
+    measurements = {}
+    for end, name, summary in windows:
+        point = points[name]
+        fragment = measurements.setdefault((end, point.fragment), {})
+        for stat in stats:
+            series = point.series if stat == "mean" else f"{point.series}_{stat}"
+            value = summary[stat]
+            if point.decimals is not None and stat != "count":
+                value = round(value, point.decimals)
+            fragment[series] = (value, "" if stat == "count" else point.unit)
+    for (end, fragment), series in measurements.items():
+        client.send_batch(
+            fragment, series, datetime.datetime.utcfromtimestamp(end), child
+        )
+
+
+def measurement_map(slaves, stats):
+    """
+    Function to list the series every fragment may be pushed with, for SmartREST templates
+    :param slaves: list of Slave
+    :param stats: names of the aggregated values pushed for points with window
+    :return: dict of fragment -> dict of series -> unit
+    """
+    fragments = {}
+    for slave in slaves:
+        for point in slave.points:
+            series = fragments.setdefault(point.fragment, {})
+            if not point.window:
+                series[point.series] = point.unit
+                continue
+            for stat in stats:
+                name = point.series if stat == "mean" else f"{point.series}_{stat}"
+                series[name] = "" if stat == "count" else point.unit
+    return fragments
+
+
+def poller_settings(modbus_config):
+    """
+    Function to get the settings of the AsyncPoller from the modbus section of
+    config.yaml, given at start and again on every reload
+    """
+    circuit_config = modbus_config.get("circuit", {})
+    return {
+        "max_concurrency": modbus_config.get("max_concurrency", 8),
+        "min_timeout": modbus_config.get("min_timeout", 0.2),
+        "circuit_failures": circuit_config.get("failures", 3),
+        "circuit_backoff": circuit_config.get("backoff", 30),
+        "circuit_max_backoff": circuit_config.get("max_backoff", 900),
+        "idle_timeout": modbus_config.get("idle_timeout", 60),
+    }
+
 
+def publish_values(
+    client,
+    slave,
+    values,
+    rbe,
+    aggregator,
+    stats,
+    now,
+    trace=None,
+    history=None,
+    child=None,
+    timestamp=None,
+):
+    """
+    Function to hand the values polled from one slave over to Cumulocity
+    :param client: c8yGateway
+    :param slave: Slave the values were read from
+    :param values: dict of point name -> value
+    :param rbe: ReportByException of the points of the slave without window
+    :param aggregator: WindowAggregator of the points of the slave with window
+    :param stats: names of the aggregated values to push
+    :param now: time.monotonic() of the poll
+    :param trace: TraceBuffer the values are recorded in
+    :param history: SampleHistory the values are kept in
+    :param child: child device id of the slave, None to push to the gateway device
+    :param timestamp: time.time() of the poll, None for now
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    read_time = datetime.datetime.utcfromtimestamp(timestamp)
+    if history is not None:
+        history.append(values, timestamp)
+    # the value lists are only formatted when they are logged
+    verbose = logging.getLogger().isEnabledFor(logging.INFO)
+    if verbose:
+        logging.info(f"{slave.name} values output: {values}")
+    if trace is not None:
+        for name, value in values.items():
+            trace.record(VALUE, name, 0, value)
+    windows = aggregator.add(values, timestamp)
+    if windows:
+        if verbose:
+            logging.info(f"push {len(windows)} aggregated measurements")
+        send_windows(client, slave, windows, stats, child)
+    publish = set(rbe.update(values, now))
+    if publish:
+        if verbose:
+            logging.info(f"push {len(publish)} of {len(slave.points)} measurements")
+        if trace is not None:
+            trace.record(PUBLISH, slave.name, len(publish))
+        send_points(
+            client,
+            [p for p in slave.points if p.name in publish],
+            values,
+            read_time,
+            child,
+        )
+
+
+if __name__ == "__main__":
     if "Ubuntu" in platform.version():
         CONFIG_FILE = "ubuntu/config.yaml"
         CERTS_PATH = "ubuntu/certificates"
@@ -40,8 +178,29 @@ if __name__ == "__main__":
         CONFIG_FILE = "/home/root/myapp/modbus2cumulocity/config.yaml"
         CERTS_PATH = "/home/root/myapp/modbus2cumulocity/certificates"
 #MN Opens and reads a YAML configuration file. The file's contents are loaded into the dictionary s using yaml.load, which safely parses the YAML file.
-    with open(CONFIG_FILE) as f:
-        s = yaml.load(f, Loader=yaml.FullLoader)
+    # config.yaml and the read plans compiled from it are cached in config.cache, an
+    # unchanged config.yaml is neither parsed nor planned again on restart
+    config = ConfigCache(
+        CONFIG_FILE, os.path.join(os.path.dirname(CONFIG_FILE), "config.cache")
+    )
+    s = config.load()
+
+    # recent poll events are kept in memory and only formatted when dumped. Without
+    # logging.verbose only rate limited warnings go to the console, and the trace is
+    # dumped on errors, on SIGUSR1 and on the c8y_Command dump_trace
+    log_config = s.get("logging", {})
+    trace = TraceBuffer(log_config.get("trace_size", 4096))
+    trace_path = log_config.get(
+        "trace_path", os.path.join(os.path.dirname(CONFIG_FILE), "trace.log")
+    )
+    production_logging(
+        trace,
+        log_config.get("warnings_per_minute", 10),
+        trace_path,
+        console=log_console,
+        verbose=log_config.get("verbose", False),
+    )
+    signal.signal(signal.SIGUSR1, lambda signum, frame: trace.dump(trace_path, "signal"))
 
     server_cert_required = s["cumulocity"]["server_cert_required"]
 
@@ -64,7 +223,50 @@ if __name__ == "__main__":
             pathlib_path.is_file()
         ), f"The file {pathlib_path} is inaccessible or not there!"
 
-    client = c8yDevice(
+    # measurements which cannot be published while the uplink is down are kept on flash
+    store_config = s.get("store", {})
+    store = MeasurementStore(
+        store_config.get("path", os.path.join(os.path.dirname(CONFIG_FILE), "outbox.db")),
+        max_rows=store_config.get("max_rows", 50000),
+    )
+
+    # timing of the poll cycle stages, reported every stats interval
+    metrics = PollMetrics()
+    stats_config = s.get("stats", {})
+    stats_interval = stats_config.get("interval", 300)
+    stats_path = stats_config.get(
+        "path", os.path.join(os.path.dirname(CONFIG_FILE), "stats.json")
+    )
+
+    # bytes on the cellular link are counted against budget.monthly_mb, heartbeats,
+    # deadbands and windows of all but the priority points are stretched as the month
+    # is projected over the cap
+    budget_config = s.get("budget", {})
+    budget = None
+    if budget_config.get("monthly_mb"):
+        budget = DataBudget(
+            budget_config.get(
+                "path", os.path.join(os.path.dirname(CONFIG_FILE), "budget.json")
+            ),
+            int(budget_config["monthly_mb"] * 1e6),
+            daily_cap=int(budget_config["daily_mb"] * 1e6)
+            if budget_config.get("daily_mb")
+            else None,
+            max_factor=budget_config.get("max_factor", 16),
+        )
+
+    # measurements go out as SmartREST 2.0 template rows, 201 until the server confirmed
+    # the template collection or with cumulocity.smartrest_templates off
+    templates = None
+    if s["cumulocity"].get("smartrest_templates", True):
+        templates = TemplateEncoder(
+            measurement_map(
+                config.slaves,
+                s.get("aggregation", {}).get("stats", ["mean", "min", "max"]),
+            )
+        )
+
+    client = c8yGateway(
         url=s["cumulocity"]["url"],
         tenant=s["cumulocity"]["tenant"],
         device_id=str(s["cumulocity"]["device_id"]),
@@ -74,359 +276,317 @@ if __name__ == "__main__":
         certfile=certfile,
         keyfile=keyfile,
         cert_reqs=cert_reqs,
+        store=store,
+        replay_batch=store_config.get("replay_batch", 50),
+        replay_rate=store_config.get("replay_rate", 2),
+        metrics=metrics,
+        # polling and publishing are decoupled by a bounded queue, see config.yaml.template
+        queue_size=s.get("publish", {}).get("queue_size", 1000),
+        queue_policy=s.get("publish", {}).get("policy", "spill"),
+        block_timeout=s.get("publish", {}).get("block_timeout", 1.0),
+        coalesce=s.get("publish", {}).get("coalesce", 20),
+        templates=templates,
+        budget=budget,
+    )
+    # with cumulocity.child_devices every slave is a child device of this one, named
+    # after the slave, all of them pushed over the one MQTT session of the gateway
+    children = {}
+    if s["cumulocity"].get("child_devices", False):
+        for sl in config.slaves:
+            children[sl.name] = f"{client.device_id}_{sl.name}"
+            client.add_child(children[sl.name], sl.name, sl.device_type)
+    client.commands["dump_trace"] = lambda args, slave: trace.dump(
+        trace_path, "c8y_Command"
     )
+    # a c8y_Configuration operation replaces config.yaml, which is then reloaded
+    client.on_settings = config.write
     client.start()
 
     # remove this for production
     # while True:
     #     time.sleep(10)
 
-    #1 200CV MBF	'Temp~DEGC	MBF 32bits float
-	#2 202CV MBF	'Turbidity~NTU	MBF 32bits float
-	#3 204CV MBF	'ph~ph 	MBF 32bits float
-	#4 206CV MBF	'Depth~m 	MBF 32bits float
-	#5 208CV MBF	'cond~uS/cm	MBF 32bits float
-	#6 210CV MBF	'nlfcond~uS/cm	MBF 32bits float
-	#7 212CV MBF	'DO SAT~%sat	MBF 32bits float
-	#8 214CV MBF	'DO CB ~%cb	MBF 32bits float
-	#9 216CV MBF	'DO MGL~mg/L	MBF 32bits float
-	#10 218CV MBF	'ORP~mV	MBF 32bits float
-	#11 220CV MBF	'PSI ~psia	MBF 32bits float
-	#12 222CV MBF	'SAL ~psu  	MBF 32bits float
-	#13 224CV MBF	'SP cond~uS/cm	MBF 32bits float
-	#14 226CV MBF	'TDS~mg/L	MBF 32bits float
-	#15 228CV MBF	'TSS~mg/L	MBF 32bits float
-	#16 230CV MBF	'PH MV~mV	MBF 32bits float
-	#17 232CV MBF	'CABLE POWER~volt	MBF 32bits float
-	#18 234CV MBF	'Stores average Battery Voltage ~V	MBF 32bits float
-	#19 236CV MBI 1	 Level (Low = 0, High = 1) MBI 16bits integer
-
-
-    # Totally 19 registers will be polled
+    # The datalogger channels (address, format, unit and series name of each) come from
+    # modbus.registers in config.yaml, or DEFAULT_REGISTER_MAP in register_map.py which
+    # holds the 19 channels 200CV..236CV. modbus.slaves lists several slaves to poll at
+    # once, otherwise modbus.slave_ip is the only one. Every point belongs to a poll group
+    # with its own interval. The groups due together are merged into as few
+    # read_holding_registers requests per slave as possible, one request for 200..236
+    # when all of them are due.
+    slaves = list(config.slaves)
+    groups = config.groups
+    # slave name -> names of its priority points, kept when the budget stretches the
+    # deadbands and windows of the others
+    priority = {}
+
     # Temperature, Turbidity, Battery Voltage + rest of above are polled by FX30 every 6 minutes
-    # pushed to Cumulocity around the same interval.
-    # Level switch is polled by FX30 every 10 seconds, and pushed to
-    # Cumulocity as changed or the first reading
-    last_read = None
-    last_read_time = None
+    # and pushed to Cumulocity every modbus.send_interval minutes, or earlier when they move
+    # past the deadband of their point. Level switch is polled every 10 seconds with deadband
+    # 0, it is pushed as changed or the first reading
+    rbe = {}
+    # points with a window are polled faster and pushed as min/max/mean of each window
+    aggregators = {}
+    aggregate_stats = list(s.get("aggregation", {}).get("stats", ["mean", "min", "max"]))
+    # the last history.size polls of every poll group of every slave are kept in
+    # memory, written to history_<slave>.csv next to config.yaml on the c8y_Command
+    # dump_history
+    history_size = s.get("history", {}).get("size", 720)
+    histories = {}
+
+    def slave_state(sl):
+        # publish state of one slave, built again when a reload changes the slave
+        rbe[sl.name] = ReportByException(
+            [p for p in sl.points if not p.window],
+            default_heartbeat=60 * config.config["modbus"].get("send_interval", 6),
+        )
+        aggregators[sl.name] = WindowAggregator(sl.points)
+        histories[sl.name] = (
+            SampleHistory(sl.points, history_size) if history_size else None
+        )
+        priority[sl.name] = {p.name for p in sl.points if p.priority}
+        if budget is not None:
+            rbe[sl.name].scale(budget.factor, priority[sl.name])
+            aggregators[sl.name].scale(budget.factor, priority[sl.name])
+
+    for sl in slaves:
+        slave_state(sl)
 
-    SEND_INTERVAL = 6
+    def dump_history(args, slave):
+        for name, history in histories.items():
+            if history is not None:
+                history.write_csv(
+                    os.path.join(os.path.dirname(CONFIG_FILE), f"history_{name}.csv")
+                )
+
+    client.commands["dump_history"] = dump_history
+
+    # the c8y_Command "set [slave] name=value ..." writes writable points, the poll
+    # loop writes and reads back the registers between two poll cycles and the
+    # operation is reported when it is done
+    writes = WriteQueue()
+    client.commands["set"] = lambda args, slave: writes.submit(
+        *parse_writes(args, slaves, slave)
+    )
+    scheduler = PollScheduler(groups)
+    # local Modbus TCP clients reading the slave listed in proxy.ports on a port of the
+    # gateway are answered from the registers of the last poll, up to proxy.max_age old
+    proxy_config = s.get("proxy", {})
+    cache = None
+    proxy = None
+    if proxy_config.get("ports"):
+        cache = RegisterCache()
+        by_name = {sl.name: sl for sl in slaves}
+        proxy = ModbusProxy(
+            {port: by_name[name] for name, port in proxy_config["ports"].items()},
+            cache,
+            host=proxy_config.get("host", "0.0.0.0"),
+            max_age=proxy_config.get("max_age", 10),
+        )
+        proxy.start()
+    # the raw registers of every read are appended to capture.path, to be replayed
+    # offline by benchmarks/replay_capture.py
+    capture_config = s.get("capture", {})
+    capture = None
+    if capture_config.get("path"):
+        capture = CaptureWriter(
+            capture_config["path"],
+            max_bytes=int(capture_config.get("max_mb", 64) * 1024 * 1024),
+        )
+    def on_circuit(sl, opened):
+        # one alarm per slave, raised when its circuit opens and cleared when it closes
+        child = children.get(sl.name)
+        alarm_type = "c8y_ModbusSlaveUnreachable"
+        if child is None:
+            alarm_type += f"_{sl.name}"
+        if opened:
+            text = f"Modbus slave {sl.name} at {sl.host} not answering"
+            client.send_alarm(alarm_type, text, child=child)
+        else:
+            client.clear_alarm(alarm_type, child=child)
+
+    poller = AsyncPoller(
+        metrics=metrics,
+        trace=trace,
+        cache=cache,
+        capture=capture,
+        on_circuit=on_circuit,
+        **poller_settings(s["modbus"]),
+    )
+    next_report = time.monotonic() + stats_interval
+    budget_interval = budget_config.get("interval", 60)
+    next_budget = time.monotonic() + budget_interval
+
+    # sections applied by a reload of config.yaml, the others need a restart
+    RELOADED = ("modbus", "aggregation")
+
+    def reload_config():
+        # only the slaves and poll groups touched by the new config.yaml are rebuilt,
+        # the others keep their connections, read plans, deadlines and publish state
+        old_config = config.config
+        try:
+            diff = config.reload()
+        except Exception as e:
+            logging.error(f"{CONFIG_FILE} not reloaded, the old config stays: {e}")
+            return
+        for name in diff["changed"] | diff["removed"]:
+            # windows still open are pushed before the aggregator goes away
+            windows = aggregators[name].close()
+            if windows:
+                send_windows(
+                    client,
+                    diff["old_slaves"][name],
+                    windows,
+                    aggregate_stats,
+                    children.get(name),
+                )
+            poller.forget(diff["old_slaves"][name])
+        for name in diff["removed"]:
+            if name in children:
+                client.remove_child(children[name])
+            for state in (rbe, aggregators, histories, priority, children):
+                state.pop(name, None)
+        poller.configure(**poller_settings(config.config["modbus"]))
+        slaves[:] = config.slaves
+        aggregate_stats[:] = config.config.get("aggregation", {}).get(
+            "stats", ["mean", "min", "max"]
+        )
+        heartbeat = 60 * config.config["modbus"].get("send_interval", 6)
+        for sl in slaves:
+            if sl.name in diff["added"] | diff["changed"]:
+                slave_state(sl)
+            else:
+                rbe[sl.name].set_default_heartbeat(heartbeat)
+                if budget is not None:
+                    rbe[sl.name].scale(budget.factor, priority[sl.name])
+                    aggregators[sl.name].scale(budget.factor, priority[sl.name])
+            if sl.name in diff["added"] and config.config["cumulocity"].get(
+                "child_devices", False
+            ):
+                children[sl.name] = f"{client.device_id}_{sl.name}"
+                client.add_child(children[sl.name], sl.name, sl.device_type)
+        for name in diff["groups"]:
+            scheduler.remove(name)
+            if name in config.groups:
+                scheduler.add(name, *config.groups[name])
+        if client.templates is not None:
+            encoder = TemplateEncoder(measurement_map(slaves, aggregate_stats))
+            if encoder.xid != client.templates.xid:
+                client.set_templates(encoder)
+        if proxy is not None:
+            by_name = {sl.name: sl for sl in slaves}
+            proxy.update(
+                {
+                    port: by_name[name]
+                    for name, port in proxy_config["ports"].items()
+                    if name in by_name
+                }
+            )
+        restart = [
+            k
+            for k in set(old_config) | set(config.config)
+            if k not in RELOADED and old_config.get(k) != config.config.get(k)
+        ]
+        logging.warning(
+            f"{CONFIG_FILE} reloaded: slaves added {sorted(diff['added'])}, changed "
+            f"{sorted(diff['changed'])}, removed {sorted(diff['removed'])}, poll groups "
+            f"changed {sorted(diff['groups'])}"
+        )
+        if restart:
+            logging.warning(f"restart to apply the changes of {sorted(restart)}")
 
     try:
         while True:
-            server_ip = s["modbus"]["slave_ip"]
-            
-            values1 = read_hr(
-                holding_register=199,
-                size=36,
-                server_ip=server_ip,
-                format="32bit_float",
-                word_order="reverse",
-            )
-            logging.info(f"values output: {values1}")
-            
-            
-            values1 = [round(v, 4) for v in values1]
-            logging.info(f"rounded values: {values1}")
-            values2 = read_hr(
-                holding_register=235,
-                size=1,
-                server_ip=server_ip,
-                format="16bit_integer",
+            due_at, due = scheduler.wait(writes.pending)
+            poller.close_idle()
+            # windows which ended are pushed on every wake up, not only with the next
+            # values of their slave, which may not answer for a long time
+            now = time.time()
+            for sl in slaves:
+                windows = aggregators[sl.name].flush(now)
+                if windows:
+                    send_windows(
+                        client, sl, windows, aggregate_stats, children.get(sl.name)
+                    )
+            if writes.pending.is_set():
+                written = execute_writes(
+                    poller,
+                    writes.take(),
+                    config.config["modbus"].get("register_base", 1),
+                )
+                # the new values are published on their next poll
+                for name, points in written.items():
+                    if name in rbe:
+                        for point in points:
+                            rbe[name].reset(point)
+            if not due:
+                continue
+            key = frozenset(due)
+            jobs = []
+            for sl in slaves:
+                plan = config.plan(sl, key)
+                if plan:
+                    jobs.append((sl, plan))
+
+            start = time.monotonic()
+            poller.poll(
+                jobs,
+                lambda sl, values: publish_values(
+                    client,
+                    sl,
+                    values,
+                    rbe[sl.name],
+                    aggregators[sl.name],
+                    aggregate_stats,
+                    due_at,
+                    trace,
+                    histories[sl.name],
+                    children.get(sl.name),
+                ),
             )
-            logging.info(f"values output: {values2}")         
-            
-            values = values1 + values2
-            if len(values) == 19:
-                if last_read is None:
-                    logging.info("first push, all 19 measurements")
-                    client.send(
-                        "datalogger",
-                        "Temp(200)",
-                        values[0],
-                        "degC",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "TURBIDITY(202)",
-                        values[1],
-                        "NTU",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "PH(204)",
-                        values[2],
-                        "ph",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DEPTH(206)",
-                        values[3],
-                        "m",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "COND(208)",
-                        values[4],
-                        "uS/cm",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "nLfCond(210)",
-                        values[5],
-                        "uS/cm",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DO(212)",
-                        values[6],
-                        "%sat",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DO(214)",
-                        values[7],
-                        "%cb",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DO(216)",
-                        values[8],
-                        "mg/L",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "ORP(218)",
-                        values[9],
-                        "mV",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "PRESSURE(220)",
-                        values[10],
-                        "psia",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "SAL(222)",
-                        values[11],
-                        "psu",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "Sp Cond(224)",
-                        values[12],
-                        "uS/cm",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "TDS(226)",
-                        values[13],
-                        "mg/L",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "TSS(228)",
-                        values[14],
-                        "mg/L",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "PH(230)",
-                        values[15],
-                        "mV",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "CABLEPOWER(232)",
-                        values[16],
-                        "volt",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "Bat(234)",
-                        values[17],
-                        "V",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "Level(236)",
-                        values[18],
-                        "",
-                        datetime.datetime.utcnow(),
-                    )
-                    last_read = values
-                    last_read_time = time.time()
-                else:
-                    if time.time() - last_read_time > 60 * SEND_INTERVAL:
-                        logging.info(
-                            f"{SEND_INTERVAL} mins reached, push 19 measurements"
-                        )
-                    client.send(
-                        "datalogger",
-                        "Temp(200)",
-                        values[0],
-                        "DEGC",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "TURBIDITY(202)",
-                        values[1],
-                        "NTU",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "PH(204)",
-                        values[2],
-                        "ph",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DEPTH(206)",
-                        values[3],
-                        "m",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "COND(208)",
-                        values[4],
-                        "uS/cm",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "nLfCond(210)",
-                        values[5],
-                        "uS/cm",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DO(212)",
-                        values[6],
-                        "%sat",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DO(214)",
-                        values[7],
-                        "%cb",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "DO(216)",
-                        values[8],
-                        "mg/L",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "ORP(218)",
-                        values[9],
-                        "mV",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "PRESSURE(220)",
-                        values[10],
-                        "psia",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "SAL(222)",
-                        values[11],
-                        "psu",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "Sp Cond(224)",
-                        values[12],
-                        "uS/cm",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "TDS(226)",
-                        values[13],
-                        "mg/L",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "TSS(228)",
-                        values[14],
-                        "mg/L",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "PH(230)",
-                        values[15],
-                        "mV",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "CABLEPOWER(232)",
-                        values[16],
-                        "volt",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "Bat(234)",
-                        values[17],
-                        "V",
-                        datetime.datetime.utcnow(),
-                    )
-                    client.send(
-                        "datalogger",
-                        "Level(236)",
-                        values[18],
-                        "",
-                        datetime.datetime.utcnow(),
-                    )
-                    last_read_time = time.time()
-                if values[18] != last_read[18]:
-                    logging.info("leve changed, push")
-                    client.send(
-                        "datalogger",
-                        "Level(236)",
-                        values[18],
-                        "",
-                        datetime.datetime.utcnow(),
-                    )
-                    last_read = values
+            metrics.record("cycle", time.monotonic() - start)
+            metrics.mark("first_poll")
+            if capture is not None:
+                capture.flush()
+            # a written config.yaml is applied between two poll cycles
+            if config.changed():
+                reload_config()
+            # new read plans are written to config.cache
+            config.save()
+
+            if budget is not None and time.monotonic() >= next_budget:
+                next_budget += budget_interval
+                factor = budget.adjust()
+                for sl in slaves:
+                    rbe[sl.name].scale(factor, priority[sl.name])
+                    aggregators[sl.name].scale(factor, priority[sl.name])
 
-            time.sleep(10)
+            if stats_interval and time.monotonic() >= next_report:
+                next_report += stats_interval
+                snapshot = metrics.report(poller.stats, poller.health)
+                snapshot["publish_queue"] = client.outbox.stats()
+                snapshot["store"] = store.stats()
+                if budget is not None:
+                    snapshot["budget"] = budget.usage()
+                if proxy is not None:
+                    snapshot["proxy"] = proxy.stats()
+                client.send_batch(
+                    "c8y_GatewayHealth",
+                    health_measurements(snapshot),
+                    datetime.datetime.utcnow(),
+                )
+                try:
+                    write_stats(stats_path, snapshot)
+                except OSError as e:
+                    logging.error(f"cannot write {stats_path}: {e}")
     except (KeyboardInterrupt, SystemExit):
         logging.info("Received keyboard interrupt, quitting ...")
+        poller.close()
+        if proxy is not None:
+            proxy.close()
+        if capture is not None:
+            capture.close()
+        logging.info(f"outbox: {store.stats()}")
+        if budget is not None:
+            budget.save()
         client.on = False
         exit(0)
@@ -1,10 +1,203 @@
 import logging
 import socket
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from time import sleep
 import struct
 
 from pymodbus.client import ModbusTcpClient
+from pymodbus.exceptions import ModbusIOException
+
+from modbus.decoder import decode_array, register_count
+
+
+class PooledConnection:
+    """A Modbus TCP client which is kept open between reads to one slave.
+    connects counts every successful TCP connect, reconnects only the ones after the first.
+    """
+
+    def __init__(self, host, port, unit, timeout):
+        self.host = host
+        self.port = port
+        self.unit = unit
+        self.client = ModbusTcpClient(host, port=port, timeout=timeout)
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.backoff = 0
+        self.retry_at = 0.0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        self.client.close()
+
+
+class ModbusConnectionPool:
+    """Pool of Modbus TCP clients keyed by (host, port, unit id).
+    A connection is health checked before use, reconnected with exponential backoff
+    when it is down, and closed once it has been idle for idle_timeout seconds, by a
+    timer thread started with the first connection.
+    """
+
+    def __init__(self, idle_timeout=60, min_backoff=1, max_backoff=60, timeout=3):
+        self.idle_timeout = idle_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def _get(self, host, port, unit):
+        key = (host, port, unit)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = PooledConnection(host, port, unit, self.timeout)
+                self._connections[key] = conn
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap, name="modbus_pool", daemon=True
+                )
+                self._reaper.start()
+        return conn
+
+    def _reap(self):
+        # idle connections are closed even when read_hr is not called again for long
+        stop = self._stop
+        while not stop.wait(max(1, self.idle_timeout / 2)):
+            self.close_idle()
+
+    def _ensure_connected(self, conn, now):
+        if conn.client.is_socket_open():
+            return True
+        if now < conn.retry_at:
+            logging.debug(
+                f"{conn.host}:{conn.port}/{conn.unit} backing off for {conn.retry_at - now:.1f}s"
+            )
+            return False
+        if conn.client.connect():
+            if conn.connects:
+                conn.reconnects += 1
+            conn.connects += 1
+            conn.backoff = 0
+            conn.retry_at = 0.0
+            return True
+        conn.failures += 1
+        conn.backoff = min(
+            self.max_backoff, conn.backoff * 2 if conn.backoff else self.min_backoff
+        )
+        conn.retry_at = now + conn.backoff
+        logging.warning(
+            f"cannot connect to {conn.host}:{conn.port}, retry in {conn.backoff}s"
+        )
+        return False
+
+    @contextmanager
+    def connection(self, host, port=502, unit=1):
+        """
+        Context manager yielding a connected PooledConnection, or None if the slave is
+        unreachable or still backing off. Call drop(conn) on a transport error so that
+        the next use reconnects.
+        """
+        conn = self._get(host, port, unit)
+        with conn.lock:
+            now = time.monotonic()
+            conn.last_used = now
+            yield conn if self._ensure_connected(conn, now) else None
+            conn.last_used = time.monotonic()
+
+    def drop(self, conn):
+        conn.failures += 1
+        conn.close()
+
+    def close_idle(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            idle = [
+                c
+                for c in self._connections.values()
+                if now - c.last_used > self.idle_timeout
+            ]
+        for conn in idle:
+            # skip connections which are in use right now
+            if not conn.lock.acquire(blocking=False):
+                continue
+            try:
+                if conn.client.is_socket_open():
+                    logging.debug(f"closing idle connection to {conn.host}:{conn.port}")
+                    conn.close()
+            finally:
+                conn.lock.release()
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._stop.set()
+            self._stop = threading.Event()
+            self._reaper = None
+        for conn in connections:
+            conn.close()
+
+    def stats(self):
+        """
+        :return: dict of (host, port, unit) -> connects, reconnects, failures and connected flag
+        """
+        with self._lock:
+            return {
+                key: {
+                    "connects": c.connects,
+                    "reconnects": c.reconnects,
+                    "failures": c.failures,
+                    "connected": c.client.is_socket_open(),
+                }
+                for key, c in self._connections.items()
+            }
+
+
+# shared by all read_hr callers unless a pool is passed in
+default_pool = ModbusConnectionPool()
+
+
+def read_registers(
+    holding_register, size, server_ip="127.0.0.1", port=502, slave=1, pool=None
+):
+    """
+    Function to read a block of raw holding registers from Modbus TCP Server
+    :param holding_register: HR address
+    :param size: number of registers to read
+    :param server_ip: address of server
+    :param port: TCP port of server
+    :param slave: modbus unit id
+    :param pool: ModbusConnectionPool to take the connection from, default_pool if None
+    :return: list of 16bit register values, or None if no data received
+    """
+    result = None
+    if pool is None:
+        pool = default_pool
+
+    with pool.connection(server_ip, port, slave) as conn:
+        if conn is not None:
+            try:
+                result = conn.client.read_holding_registers(
+                    address=holding_register, count=size, slave=slave
+                )
+                if isinstance(result, ModbusIOException):
+                    # no or broken response, reconnect on next read
+                    pool.drop(conn)
+            except Exception as e:
+                logging.error(e)
+                pool.drop(conn)
+
+    if result is None or result.isError():
+        logging.warning(f"No data received, error: {result}")
+        return None
+    return result.registers
 
 
 def read_hr(
@@ -13,119 +206,62 @@ def read_hr(
     server_ip="127.0.0.1",
     format="16bit_integer",
     word_order="standard",
+    port=502,
+    slave=1,
+    pool=None,
 ):
     """
     Function to read holding register from Modbus TCP Server
     :param holding_register: HR address
     :param size: number of registers to read
     :param server_ip: address of server
-    :format: 16bit_integer(default),
-             32bit_integer
+    :format: 16bit_integer(default), 16bit_uint
+             32bit_integer, 32bit_uint
              32bit_float, a single precision IEEE-754 floating point number
-    :word_order: only apply to 32bit_integer and 32bit_float
-             standard(default), upper 16 bits are in Modbus register n, lower 16 bits are in register n+1.
+             64bit_integer, 64bit_uint, 64bit_float
+    :word_order: standard(default), upper 16 bits are in Modbus register n, lower 16 bits are in register n+1.
              reverse, lower 16 bits are in Modbus register n, upper 16 bits are in register n+1.
+             byteswap, as standard with the two bytes of every register swapped.
+             reverse_byteswap, as reverse with the two bytes of every register swapped.
+    :param port: TCP port of server
+    :param slave: modbus unit id
+    :param pool: ModbusConnectionPool to take the connection from, default_pool if None
     :return: list of values
     """
-    result = None
-    read_output = None
-    # initialise client, default ports and modbus address
-    client = ModbusTcpClient(server_ip)
-
-    # read all 4 registers
-    try:
-        result = client.read_holding_registers(
-            address=holding_register, count=size, slave=1
+    registers = read_registers(holding_register, size, server_ip, port, slave, pool)
+    if registers is None:
+        return []
+    return decode_registers(registers, format, word_order)
+
+
+def decode_registers(registers, format="16bit_integer", word_order="standard"):
+    """
+    Function to convert raw holding registers into values
+    :param registers: list of 16bit register values
+    :format: same as read_hr
+    :word_order: same as read_hr
+    :return: list of values
+    """
+    size = len(registers)
+    width = register_count(format)
+    if size % width:
+        logging.warning(
+            f"format is {format}, but number of registers to read is not a multiple of {width}: {size}"
         )
-        logging.debug(result)
-    except Exception as e:
-        logging.error(e)
-        client.close()
-
-    # clean up
-    client.close()
-
-    logging.debug(result)
-
-    modbus_data = []
-    # check if result data received, build results data
-    if format == "16bit_integer":
-        try:
-            for j in range(size):
-                # get param from result
-                modbus_register = result.getRegister(j)
-                # check if register needs conversion for signed value
-                modbus_register = twos_comp(modbus_register)
-                # append to result array
-                modbus_data.append(modbus_register)
-            logging.debug("Valid modbus data received")
-
-        except AttributeError as e:
-            logging.warning(f"No data received, error: {e}")
-    elif format == "32bit_integer":
-        if (size % 2) == 1:
-            logging.warning(
-                f"format is 32bit_integer, but number of registers to read is odd number: {size}"
-            )
-        try:
-            for j in range(0, size, 2):
-                # get param from result
-                if word_order == "standard":
-                    upper_16bits = result.getRegister(j)
-                    lower_16bits = result.getRegister(j + 1)
-                else:
-                    upper_16bits = result.getRegister(j + 1)
-                    lower_16bits = result.getRegister(j)
-                combined_value = (upper_16bits << 16) | lower_16bits
-                # check if combined_value needs conversion for signed value
-                combined_value = twos_comp_32bit(combined_value)
-                # append to result array
-                modbus_data.append(combined_value)
-            logging.debug("Valid modbus data received")
-
-        except AttributeError as e:
-            logging.warning(f"No data received, error: {e}")
-    elif format == "32bit_float":
-        if (size % 2) == 1:
-            logging.warning(
-                f"format is 32bit_float, but number of registers to read is odd number: {size}"
-            )
-        try:
-            for j in range(0, size, 2):
-                # get param from result
-                if word_order == "standard":
-                    upper_16bits = result.getRegister(j)
-                    lower_16bits = result.getRegister(j + 1)
-                else:
-                    upper_16bits = result.getRegister(j + 1)
-                    lower_16bits = result.getRegister(j)
-                combined_value = (upper_16bits << 16) | lower_16bits
-                # convert IEEE-754 floating point number into float
-                combined_value = convert_to_float(combined_value)
-                # append to result array
-                modbus_data.append(combined_value)
-            logging.debug("Valid modbus data received")
-
-        except AttributeError as e:
-            logging.warning(f"No data received, error: {e}")
-    return modbus_data
+    return decode_array(registers, format, word_order)
 
 
 # All modbus registers stored as 16bit signed words. Convert to integer
 def twos_comp(input_word):
     if input_word > 0x7FFF:
-        logging.debug(f"calculating 2's compliment of {input_word}")
         input_word = input_word - int((input_word << 1) & 2**16)
-        logging.debug(f"New value: {input_word}")
 
     return input_word
 
 
 def twos_comp_32bit(input_word):
     if input_word > 0x7FFFFFFF:
-        logging.debug(f"Calculating 2's complement of {input_word}")
-        input_word = input_word - ((input_word << 1) & 0xFFFFFFFF)
-        logging.debug(f"New value: {input_word}")
+        input_word = input_word - ((input_word << 1) & 0x100000000)
 
     return input_word
 
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import struct
+import threading
+import time
+
+logger = logging.getLogger("modbus_proxy")
+
+MBAP = struct.Struct(">HHHB")
+READ_HOLDING_REGISTERS = 3
+# modbus exception codes sent back to local clients
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_VALUE = 3
+GATEWAY_PATH_UNAVAILABLE = 0x0A
+GATEWAY_TARGET_FAILED = 0x0B
+
+
+class RegisterCache:
+    """Holding registers last read from every slave, with the time they were read.
+    The poller put()s every block it reads, the proxy get()s ranges of registers no
+    older than max_age. Shared between the poller and the proxy thread, a range is
+    always taken from one consistent state so a 32 bit value is never torn.
+    """
+
+    def __init__(self):
+        # (slave name, unit) -> {address: (register, time.monotonic() of the read)}
+        self._registers = {}
+        self._lock = threading.Lock()
+
+    def put(self, slave, unit, address, registers, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            cache = self._registers.setdefault((slave, unit), {})
+            for i, register in enumerate(registers):
+                cache[address + i] = (register, now)
+
+    def get(self, slave, unit, address, count, max_age, now=None):
+        """
+        Function to get count registers from address, all of them read within max_age
+        :return: list of registers, None if any of them is missing or too old
+        """
+        if now is None:
+            now = time.monotonic()
+        oldest = now - max_age
+        registers = []
+        with self._lock:
+            cache = self._registers.get((slave, unit))
+            if cache is None:
+                return None
+            for a in range(address, address + count):
+                entry = cache.get(a)
+                if entry is None or entry[1] < oldest:
+                    return None
+                registers.append(entry[0])
+        return registers
+
+
+class ModbusProxy:
+    """Local Modbus TCP server answering read holding registers requests of other
+    clients on site (HMI, commissioning laptop) from the RegisterCache filled by the
+    poll cycle of the gateway, so the slaves only ever see the gateway.
+    Every slave is served on a port of its own. Reads with all registers in the cache
+    and not older than max_age, whatever block of the poller they were read in, are
+    answered without touching the slave. Misses are read from the slave over one
+    upstream connection per slave, one at a time, and clients asking for a range inside
+    one being read meanwhile wait for that read instead of sending their own.
+    Other function codes are answered with exception illegal function, frames of another
+    protocol than Modbus close the connection.
+    The server runs its own event loop in a daemon thread.
+    """
+
+    def __init__(self, routes, cache, host="0.0.0.0", max_age=10.0):
+        """
+        :param routes: dict of local TCP port -> Slave served on it
+        :param cache: RegisterCache filled by the poller
+        :param max_age: seconds a cached register is served for
+        """
+        self.routes = routes
+        self.cache = cache
+        self.host = host
+        self.max_age = max_age
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="modbus_proxy", daemon=True
+        )
+        self._servers = []
+        # slave name -> upstream client and the lock serialising its reads
+        self._upstream = {}
+        self._locks = {}
+        # (slave name, unit, address, count) -> future of the upstream read in flight
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        for port, slave in self.routes.items():
+            try:
+                server = self.loop.run_until_complete(
+                    asyncio.start_server(
+                        lambda r, w, port=port: self._serve(port, r, w),
+                        self.host,
+                        port,
+                    )
+                )
+            except OSError as e:
+                logger.error(f"cannot serve {slave.name} on port {port}: {e}")
+                continue
+            logger.info(f"serving {slave.name} on {self.host}:{port}")
+            self._servers.append(server)
+        self.loop.run_forever()
+        # the connections of clients still open are closed before the loop
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def stats(self):
+        """
+        :return: dict of reads served from the cache, read from the slave, waiting
+                 for a read of another client, and failed
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+    def update(self, routes):
+        """
+        Function to serve the slaves of a reloaded config on the ports opened at start,
+        ports added or removed need a restart
+        """
+
+        def swap():
+            for port, slave in routes.items():
+                old = self.routes.get(port)
+                if old is not None and old != slave:
+                    self._close(old)
+                    self.routes[port] = slave
+
+        self.loop.call_soon_threadsafe(swap)
+
+    async def _serve(self, port, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(MBAP.size)
+                transaction, protocol, length, unit = MBAP.unpack(header)
+                if protocol != 0 or not 2 <= length <= 254:
+                    # not a Modbus frame, there is no telling where the next one starts
+                    logger.warning(
+                        "port %d: protocol %d length %d, closing", port, protocol, length
+                    )
+                    break
+                pdu = await reader.readexactly(length - 1)
+                response = await self._handle(self.routes[port], unit, pdu)
+                writer.write(
+                    MBAP.pack(transaction, protocol, len(response) + 1, unit) + response
+                )
+                # a client not reading its responses holds up only its own connection
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, slave, unit, pdu):
+        # request PDU in, response PDU out
+        function = pdu[0]
+        if function != READ_HOLDING_REGISTERS or len(pdu) != 5:
+            return bytes((function | 0x80, ILLEGAL_FUNCTION))
+        address, count = struct.unpack_from(">HH", pdu, 1)
+        if not 1 <= count <= 125:
+            return bytes((function | 0x80, ILLEGAL_DATA_VALUE))
+        registers = self.cache.get(slave.name, unit, address, count, self.max_age)
+        if registers is not None:
+            self.hits += 1
+        else:
+            registers = await self._read_upstream(slave, unit, address, count)
+            if isinstance(registers, int):
+                self.errors += 1
+                return bytes((function | 0x80, registers))
+        return struct.pack(f">BB{count}H", function, 2 * count, *registers)
+
+    async def _read_upstream(self, slave, unit, address, count):
+        # a client asking for a range inside one already being read waits for that read
+        for (name, u, a, c), inflight in self._inflight.items():
+            if (name, u) == (slave.name, unit) and a <= address <= a + c - count:
+                self.coalesced += 1
+                result = await asyncio.shield(inflight)
+                if isinstance(result, int):
+                    return result
+                return result[address - a : address - a + count]
+        key = (slave.name, unit, address, count)
+        future = self.loop.create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._read(slave, unit, address, count)
+        except Exception as e:
+            logger.warning("%s: proxy connect: %s", slave.name, e)
+            self._close(slave)
+            result = GATEWAY_PATH_UNAVAILABLE
+        finally:
+            del self._inflight[key]
+        future.set_result(result)
+        return result
+
+    async def _read(self, slave, unit, address, count):
+        # one request at a time per slave, the previous one may have filled the cache
+        lock = self._locks.setdefault(slave.name, asyncio.Lock())
+        async with lock:
+            registers = self.cache.get(slave.name, unit, address, count, self.max_age)
+            if registers is not None:
+                self.coalesced += 1
+                return registers
+            self.misses += 1
+            client = await self._connect(slave)
+            if client is None:
+                return GATEWAY_PATH_UNAVAILABLE
+            try:
+                result = await asyncio.wait_for(
+                    client.read_holding_registers(address, count, slave=unit),
+                    slave.timeout,
+                )
+            except Exception as e:
+                logger.warning(
+                    "%s: proxy read %d/%d: %s", slave.name, address, count, e
+                )
+                self._close(slave)
+                return GATEWAY_TARGET_FAILED
+            if result.isError():
+                return getattr(result, "exception_code", GATEWAY_TARGET_FAILED)
+            self.cache.put(slave.name, unit, address, result.registers)
+            return result.registers
+
+    async def _connect(self, slave):
+        client = self._upstream.get(slave.name)
+        if client is None:
+            from pymodbus.client import AsyncModbusTcpClient
+
+            client = AsyncModbusTcpClient(
+                slave.host,
+                port=slave.port,
+                timeout=slave.timeout,
+                retries=0,
+                reconnect_delay=0,
+            )
+            self._upstream[slave.name] = client
+        if not client.connected:
+            await client.connect()
+        return client if client.connected else None
+
+    def _close(self, slave):
+        client = self._upstream.pop(slave.name, None)
+        if client is not None:
+            client.close()
+
+    def close(self):
+        def stop():
+            for server in self._servers:
+                server.close()
+            for client in self._upstream.values():
+                client.close()
+            self.loop.stop()
+
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(stop)
+            self._thread.join(5)
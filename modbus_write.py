@@ -0,0 +1,215 @@
+import logging
+import struct
+import threading
+from collections import namedtuple
+from concurrent import futures
+
+from modbus.decoder import FORMATS, encode_value
+
+logger = logging.getLogger("modbus_write")
+
+# largest number of holding registers allowed in one write multiple registers request
+# by the modbus spec
+MAX_WRITE_COUNT = 123
+
+# protocol address and registers of one write_registers request (function 16), and the
+# points it sets
+WriteBlock = namedtuple("WriteBlock", "address registers points")
+
+
+def parse_writes(text, slaves, slave_name=None):
+    """
+    Function to parse the arguments of a set command: [slave] name=value ...
+    :param text: e.g. "datalogger temp_high=30.5 interval=600"
+    :param slaves: list of Slave
+    :param slave_name: slave the command was sent to (a child device), otherwise the
+             first word names it, it may be left out when there is only one slave
+    :return: (Slave, list of (Point, value))
+    """
+    words = text.split()
+    if slave_name is None and words and "=" not in words[0]:
+        slave_name = words.pop(0)
+    if slave_name is None:
+        if len(slaves) != 1:
+            raise ValueError("name the slave to write to: set <slave> name=value ...")
+        slave = slaves[0]
+    else:
+        slave = next((sl for sl in slaves if sl.name == slave_name), None)
+        if slave is None:
+            raise ValueError(f"unknown slave {slave_name}")
+    if not words:
+        raise ValueError("nothing to write: set [slave] name=value ...")
+    points = {p.name: p for p in slave.points}
+    point_values = []
+    for word in words:
+        name, _, text_value = word.partition("=")
+        point = points.get(name)
+        if point is None:
+            raise ValueError(f"{slave.name}: unknown point {name}")
+        if not point.writable:
+            raise ValueError(f"{slave.name}: {name} is not writable")
+        try:
+            if FORMATS[point.format][0] in "fd":
+                value = float(text_value)
+            else:
+                value = int(text_value)
+            # out of range values fail here instead of on the slave
+            encode_value(value, point.format, point.word_order)
+        except (ValueError, OverflowError, struct.error):
+            raise ValueError(f"{name}: invalid {point.format} value {text_value!r}")
+        point_values.append((point, value))
+    return slave, point_values
+
+
+def plan_writes(point_values, register_base=1, max_count=MAX_WRITE_COUNT):
+    """
+    Function to encode the values of points and merge the writes to adjacent registers
+    into as few write_registers requests as possible. Unlike reads, gaps are never
+    bridged, registers nobody asked for are not written
+    :param point_values: list of (Point, value), the last value of a point wins
+    :param register_base: number of the first register as used by the datalogger
+    :param max_count: largest number of registers in one request
+    :return: list of WriteBlock
+    """
+    encoded = {}
+    for point, value in point_values:
+        encoded[point.name] = (
+            point,
+            encode_value(value, point.format, point.word_order),
+        )
+    blocks = []
+    start = None
+    registers = []
+    covered = []
+    for point, point_registers in sorted(
+        encoded.values(), key=lambda e: e[0].address
+    ):
+        p_start = point.address - register_base
+        if start is not None and p_start < start + len(registers):
+            raise ValueError(f"{point.name} overlaps {covered[-1].name}")
+        if (
+            start is not None
+            and p_start == start + len(registers)
+            and len(registers) + len(point_registers) <= max_count
+        ):
+            registers += point_registers
+            covered.append(point)
+            continue
+        if start is not None:
+            blocks.append(WriteBlock(start, tuple(registers), tuple(covered)))
+        start, registers, covered = p_start, list(point_registers), [point]
+    if start is not None:
+        blocks.append(WriteBlock(start, tuple(registers), tuple(covered)))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "%d points planned into %d writes: %s",
+            len(encoded),
+            len(blocks),
+            [(b.address, len(b.registers)) for b in blocks],
+        )
+    return blocks
+
+
+class WriteQueue:
+    """Write requests handed over from the thread running the Cumulocity operations to
+    the poll loop, which executes them between two poll cycles over the connections of
+    the poller, so writes never interleave with its reads. (The ModbusProxy, when on,
+    reads cache misses over a connection of its own.)
+    pending is set while requests are waiting, the poll loop wakes up on it instead of
+    sleeping until the next poll group is due.
+    """
+
+    def __init__(self):
+        self.pending = threading.Event()
+        self._requests = []
+        self._lock = threading.Lock()
+
+    def submit(self, slave, point_values):
+        """
+        Function to queue writes to one slave
+        :param point_values: list of (Point, value)
+        :return: concurrent.futures.Future of the text reporting the verified writes,
+                 raising RuntimeError when any of them failed
+        """
+        future = futures.Future()
+        with self._lock:
+            self._requests.append((slave, point_values, future))
+            self.pending.set()
+        return future
+
+    def take(self):
+        """
+        Function to take all waiting requests
+        :return: list of (Slave, list of (Point, value), Future)
+        """
+        with self._lock:
+            requests, self._requests = self._requests, []
+            self.pending.clear()
+        return requests
+
+
+def execute_writes(poller, requests, register_base=1):
+    """
+    Function to run the write requests taken from a WriteQueue. The requests to one
+    slave are planned together, so a bulk reconfiguration sent as several operations
+    still goes out in as few requests as the registers allow
+    :param poller: AsyncPoller whose connections are used
+    :param requests: list of (Slave, list of (Point, value), Future)
+    :param register_base: number of the first register as used by the datalogger
+    :return: dict of slave name -> names of the points written and verified
+    """
+    by_slave = {}
+    for slave, point_values, future in requests:
+        # an operation given up while waiting is not written anymore
+        if future.set_running_or_notify_cancel():
+            by_slave.setdefault(slave.name, (slave, []))[1].append(
+                (point_values, future)
+            )
+    written = {}
+    for slave, pending in by_slave.values():
+        try:
+            blocks = plan_writes(
+                [pv for point_values, _ in pending for pv in point_values],
+                register_base,
+            )
+        except ValueError as e:
+            for _, future in pending:
+                future.set_exception(RuntimeError(str(e)))
+            continue
+        try:
+            errors = poller.write(slave, blocks)
+        except Exception as e:
+            # the operations fail instead of waiting forever, the next slave is written
+            logger.error("%s: writes failed: %s", slave.name, e)
+            for _, future in pending:
+                future.set_exception(RuntimeError(f"{slave.name}: {e}"))
+            continue
+        failed = {}
+        for block, error in zip(blocks, errors):
+            for point in block.points:
+                if error is None:
+                    written.setdefault(slave.name, set()).add(point.name)
+                else:
+                    failed[point.name] = error
+        logger.warning(
+            "%s: %d write requests for %d operations, %d points failed",
+            slave.name,
+            len(blocks),
+            len(pending),
+            len(failed),
+        )
+        for point_values, future in pending:
+            errors = {
+                p.name: failed[p.name] for p, _ in point_values if p.name in failed
+            }
+            if errors:
+                future.set_exception(
+                    RuntimeError(", ".join(f"{n}: {e}" for n, e in errors.items()))
+                )
+            else:
+                future.set_result(
+                    f"{slave.name}: "
+                    + " ".join(f"{p.name}={v}" for p, v in point_values)
+                    + " written and read back"
+                )
+    return written
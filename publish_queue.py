@@ -0,0 +1,104 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger("publish_queue")
+
+POLICIES = ("drop_oldest", "block", "spill")
+
+
+class PublishQueue:
+    """Bounded queue of measurement batches between the poller and the publisher worker.
+    put() never waits longer than block_timeout, so a slow uplink cannot hold up the
+    next poll. When the queue is full the policy decides:
+        drop_oldest  the oldest batch is dropped to make room
+        block        put() waits up to block_timeout for room, then drops the oldest
+        spill        the new batch is handed to spill(), e.g. written to the store
+    """
+
+    def __init__(self, maxsize=1000, policy="drop_oldest", block_timeout=1.0, spill=None):
+        """
+        :param maxsize: batches kept in memory
+        :param policy: one of POLICIES
+        :param spill: function called with a batch which does not fit, for policy spill
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"unknown publish queue policy {policy}")
+        if policy == "spill" and spill is None:
+            raise ValueError("publish queue policy spill needs a spill function")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill = spill
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self.queued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        """
+        Function to queue a batch, applying the policy when the queue is full
+        :return: True if the batch was queued
+        """
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.policy == "spill":
+                    self.spilled += 1
+                    # written outside of the lock, the worker can go on draining
+                    self._cond.release()
+                    try:
+                        self.spill(item)
+                    finally:
+                        self._cond.acquire()
+                    return False
+                if self.policy == "block":
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._items) >= self.maxsize:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._cond.wait(remaining):
+                            break
+                if len(self._items) >= self.maxsize:
+                    self._items.popleft()
+                    self.dropped += 1
+                    logger.warning("publish queue full, oldest batch dropped")
+            self._items.append(item)
+            self.queued += 1
+            self.high_water = max(self.high_water, len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def get_many(self, max_items, timeout=None):
+        """
+        Function to take up to max_items batches, oldest first
+        :param timeout: seconds to wait for the first batch
+        :return: list of batches, empty after timeout
+        """
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            items = []
+            while self._items and len(items) < max_items:
+                items.append(self._items.popleft())
+            if items:
+                # wake up a put() waiting for room
+                self._cond.notify_all()
+            return items
+
+    def stats(self):
+        """
+        :return: dict of depth, high water mark, batches queued, dropped and spilled
+        """
+        with self._cond:
+            return {
+                "depth": len(self._items),
+                "high_water": self.high_water,
+                "queued": self.queued,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+            }
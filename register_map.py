@@ -0,0 +1,256 @@
+import logging
+from collections import namedtuple
+
+from modbus.decoder import FORMATS, BlockLayout, register_count
+
+# largest number of holding registers allowed in one read request by the modbus spec
+MAX_READ_COUNT = 125
+
+# deadband/deadband_pct/heartbeat(seconds) are the publish rules of report_by_exception,
+# group is the poll group of the point, a point with window(seconds) is published as
+# one aggregated measurement per window instead. The data budget never throttles
+# priority points, writable points may be set by the c8y_Command set
+Point = namedtuple(
+    "Point",
+    "name address format word_order unit series fragment decimals "
+    "deadband deadband_pct heartbeat group window priority writable",
+    defaults=(
+        "16bit_integer",
+        "standard",
+        "",
+        None,
+        "datalogger",
+        None,
+        None,
+        None,
+        None,
+        "default",
+        None,
+        False,
+        False,
+    ),
+)
+
+# one modbus TCP slave and the points polled from it, pipeline is the number of read
+# requests which may be in flight on its connection at once
+Slave = namedtuple(
+    "Slave",
+    "name host port unit timeout points pipeline device_type",
+    defaults=(1, "c8y_ModbusSlave"),
+)
+
+# protocol address and count of one read_holding_registers request, the points it
+# covers, the register offset of each point inside the block and the BlockLayout
+# decoding all of them at once
+ReadBlock = namedtuple("ReadBlock", "address count points offsets layout")
+
+
+def _float_channel(name, address, unit, series):
+    return {
+        "name": name,
+        "address": address,
+        "format": "32bit_float",
+        "word_order": "reverse",
+        "unit": unit,
+        "series": series,
+        "decimals": 4,
+        "group": "analog",
+    }
+
+
+# the 19 channels of the datalogger, used when config.yaml has no modbus.registers
+DEFAULT_REGISTER_MAP = [
+    _float_channel("temp", 200, "degC", "Temp(200)"),
+    _float_channel("turbidity", 202, "NTU", "TURBIDITY(202)"),
+    _float_channel("ph", 204, "ph", "PH(204)"),
+    _float_channel("depth", 206, "m", "DEPTH(206)"),
+    _float_channel("cond", 208, "uS/cm", "COND(208)"),
+    _float_channel("nlfcond", 210, "uS/cm", "nLfCond(210)"),
+    _float_channel("do_sat", 212, "%sat", "DO(212)"),
+    _float_channel("do_cb", 214, "%cb", "DO(214)"),
+    _float_channel("do_mgl", 216, "mg/L", "DO(216)"),
+    _float_channel("orp", 218, "mV", "ORP(218)"),
+    _float_channel("pressure", 220, "psia", "PRESSURE(220)"),
+    _float_channel("sal", 222, "psu", "SAL(222)"),
+    _float_channel("sp_cond", 224, "uS/cm", "Sp Cond(224)"),
+    _float_channel("tds", 226, "mg/L", "TDS(226)"),
+    _float_channel("tss", 228, "mg/L", "TSS(228)"),
+    _float_channel("ph_mv", 230, "mV", "PH(230)"),
+    _float_channel("cable_power", 232, "volt", "CABLEPOWER(232)"),
+    _float_channel("battery", 234, "V", "Bat(234)"),
+    {
+        "name": "level",
+        "address": 236,
+        "format": "16bit_integer",
+        "series": "Level(236)",
+        "deadband": 0,
+        "group": "level",
+        "priority": True,
+    },
+]
+
+# the analog sensors only change slowly, the level switch is watched closely
+DEFAULT_POLL_GROUPS = {
+    "analog": {"interval": 360},
+    "level": {"interval": 10},
+}
+
+
+def load_register_map(modbus_config):
+    """
+    Function to build the list of points from the modbus section of config.yaml
+    :param modbus_config: dict, modbus section of config.yaml
+    :return: list of Point
+    """
+    entries = modbus_config.get("registers") or DEFAULT_REGISTER_MAP
+    points = []
+    names = set()
+    for entry in entries:
+        point = Point(**entry)
+        if point.series is None:
+            point = point._replace(series=point.name)
+        if point.format not in FORMATS:
+            raise ValueError(f"{point.name}: unsupported format {point.format}")
+        if point.name in names:
+            raise ValueError(f"{point.name}: duplicated point name")
+        names.add(point.name)
+        points.append(point)
+    return points
+
+
+def load_slaves(modbus_config):
+    """
+    Function to build the list of slaves from the modbus section of config.yaml. Without
+    modbus.slaves there is one slave at modbus.slave_ip polling modbus.registers.
+    Every slave entry has name, ip, port(502), unit(1), timeout(seconds, 3),
+    pipeline(1), registers (modbus.registers when left out) and type (type of its
+    child device, c8y_ModbusSlave)
+    :param modbus_config: dict, modbus section of config.yaml
+    :return: list of Slave
+    """
+    entries = modbus_config.get("slaves") or [
+        {"name": "datalogger", "ip": modbus_config["slave_ip"]}
+    ]
+    slaves = []
+    for entry in entries:
+        name = entry.get("name", entry["ip"])
+        if any(s.name == name for s in slaves):
+            raise ValueError(f"{name}: duplicated slave name")
+        registers = entry.get("registers") or modbus_config.get("registers")
+        slaves.append(
+            Slave(
+                name,
+                entry["ip"],
+                entry.get("port", 502),
+                entry.get("unit", 1),
+                entry.get("timeout", modbus_config.get("timeout", 3)),
+                load_register_map({"registers": registers}),
+                entry.get("pipeline", 1),
+                entry.get("type", "c8y_ModbusSlave"),
+            )
+        )
+    return slaves
+
+
+def load_poll_groups(modbus_config, points):
+    """
+    Function to get the poll groups from the modbus section of config.yaml
+    :param modbus_config: dict, modbus section of config.yaml
+    :param points: list of Point
+    :return: dict of group name -> (interval, phase) in seconds of the groups in use
+    """
+    entries = modbus_config.get("groups", DEFAULT_POLL_GROUPS)
+    groups = {
+        name: (g["interval"], g.get("phase", 0)) for name, g in entries.items()
+    }
+    # points without group are polled every poll_interval seconds
+    groups.setdefault("default", (modbus_config.get("poll_interval", 10), 0))
+    used = {p.group for p in points}
+    for name in used - set(groups):
+        raise ValueError(f"unknown poll group {name}")
+    return {name: g for name, g in groups.items() if name in used}
+
+
+def point_size(point):
+    return register_count(point.format)
+
+
+def plan_reads(points, max_gap=0, register_base=1, max_count=MAX_READ_COUNT):
+    """
+    Function to compile points into the smallest set of holding register reads
+    :param points: list of Point
+    :param max_gap: number of unused registers which may be read to merge two ranges
+    :param register_base: number of the first register as used by the datalogger,
+             1 when the datalogger register 200 is protocol address 199
+    :param max_count: largest number of registers in one request
+    :return: list of ReadBlock
+    """
+    blocks = []
+    start = end = None
+    covered = []
+
+    def close_block():
+        offsets = tuple(p.address - register_base - start for p in covered)
+        layout = BlockLayout(
+            [(o, p.format, p.word_order) for o, p in zip(offsets, covered)],
+            end - start,
+        )
+        blocks.append(ReadBlock(start, end - start, tuple(covered), offsets, layout))
+
+    for point in sorted(points, key=lambda p: p.address):
+        p_start = point.address - register_base
+        p_end = p_start + point_size(point)
+        if (
+            start is not None
+            and p_start - end <= max_gap
+            and max(end, p_end) - start <= max_count
+        ):
+            end = max(end, p_end)
+            covered.append(point)
+            continue
+        if start is not None:
+            close_block()
+        start, end, covered = p_start, p_end, [point]
+    if start is not None:
+        close_block()
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(
+            "%d points planned into %d reads: %s",
+            len(points),
+            len(blocks),
+            [(b.address, b.count) for b in blocks],
+        )
+    return blocks
+
+
+def decode_block(block, registers):
+    """
+    Function to convert the registers read for one ReadBlock into point values
+    :return: dict of point name -> value
+    """
+    values = {}
+    for point, value in zip(block.points, block.layout.decode(registers)):
+        if point.decimals is not None:
+            value = round(value, point.decimals)
+        values[point.name] = value
+    return values
+
+
+def read_points(plan, server_ip, port=502, slave=1, pool=None):
+    """
+    Function to execute a read plan against one slave
+    :param plan: list of ReadBlock from plan_reads
+    :return: dict of point name -> value, points of failed reads are left out
+    """
+    # imported here, the pymodbus sync client is not needed by the asyncio poller
+    from modbus.modbus_client import read_registers
+
+    values = {}
+    for block in plan:
+        registers = read_registers(
+            block.address, block.count, server_ip, port, slave, pool
+        )
+        if registers is None:
+            continue
+        values.update(decode_block(block, registers))
+    return values
@@ -0,0 +1,105 @@
+import time
+
+
+class _Channel:
+    # last published value of one point and its publish rules
+    __slots__ = ("deadband", "deadband_pct", "heartbeat", "base", "value", "sent_at")
+
+    def __init__(self, deadband, deadband_pct, heartbeat):
+        self.deadband = deadband
+        self.deadband_pct = deadband_pct
+        self.heartbeat = heartbeat
+        # configured rules, scale() multiplies these
+        self.base = (deadband, deadband_pct, heartbeat)
+        self.value = None
+        self.sent_at = None
+
+
+class ReportByException:
+    """Change detection stage between the poller and the publisher.
+    A value is published the first time it is read, when it moves past the absolute
+    (deadband) or percentage (deadband_pct) deadband of its point compared to the last
+    published value, or when the heartbeat of its point expires. A point without any
+    deadband is only published on its heartbeat, deadband 0 publishes every change.
+    """
+
+    def __init__(self, points, default_heartbeat=360):
+        """
+        :param points: list of Point
+        :param default_heartbeat: seconds between publishes of a point without heartbeat
+        """
+        # points following default_heartbeat
+        self._default = {p.name for p in points if p.heartbeat is None}
+        self._channels = {
+            p.name: _Channel(
+                p.deadband,
+                p.deadband_pct,
+                p.heartbeat if p.heartbeat is not None else default_heartbeat,
+            )
+            for p in points
+        }
+
+    def update(self, values, now=None):
+        """
+        Function to select the values which need to be published, they are remembered
+        as last published values
+        :param values: dict of point name -> value
+        :param now: time.monotonic() of the read
+        :return: list of point names to publish
+        """
+        if now is None:
+            now = time.monotonic()
+        publish = []
+        for name, value in values.items():
+            c = self._channels.get(name)
+            if c is None:
+                continue
+            if c.sent_at is None or now - c.sent_at >= c.heartbeat:
+                pass
+            else:
+                delta = abs(value - c.value)
+                if not (
+                    (c.deadband is not None and delta > c.deadband)
+                    or (
+                        c.deadband_pct is not None
+                        and delta > abs(c.value) * c.deadband_pct / 100
+                    )
+                ):
+                    continue
+            c.value = value
+            c.sent_at = now
+            publish.append(name)
+        return publish
+
+    def scale(self, factor, keep=()):
+        """
+        Function to stretch the heartbeats and deadbands of all points but keep by
+        factor, 1 restores the configured rules. Deadband 0 stays 0
+        :param keep: names of points whose rules are left as configured
+        """
+        for name, c in self._channels.items():
+            f = 1 if name in keep else factor
+            deadband, deadband_pct, heartbeat = c.base
+            c.deadband = None if deadband is None else deadband * f
+            c.deadband_pct = None if deadband_pct is None else deadband_pct * f
+            c.heartbeat = heartbeat * f
+
+    def set_default_heartbeat(self, heartbeat):
+        """
+        Function to change the heartbeat of the points without heartbeat of their own,
+        e.g. on a reload of config.yaml. It replaces the configured rule, scale() has to
+        be applied again after it
+        """
+        for name in self._default:
+            c = self._channels[name]
+            c.base = c.base[:2] + (heartbeat,)
+            c.heartbeat = heartbeat
+
+    def reset(self, name=None):
+        """
+        Function to forget the last published value of one or all points, so that they
+        are published on the next read
+        """
+        for key, c in self._channels.items():
+            if name is None or key == name:
+                c.value = c.sent_at = None
@@ -0,0 +1,167 @@
+import bisect
+import heapq
+import math
+import time
+from array import array
+
+from modbus.decoder import FORMATS
+
+# stored for an integer point which was not read in a cycle, floats get NaN
+MISSING_INT = -(2**63)
+
+
+class _Ring:
+    # the samples of the points of one poll group, one row per poll of the group
+    __slots__ = ("capacity", "times", "columns", "count", "next")
+
+    def __init__(self, points, capacity):
+        self.capacity = capacity
+        self.times = array("d", [0.0]) * capacity
+        # point name -> (ring, value of a missing sample)
+        self.columns = {}
+        for p in points:
+            if FORMATS[p.format][0] in "fd":
+                self.columns[p.name] = (array("d", [math.nan]) * capacity, math.nan)
+            else:
+                missing = MISSING_INT
+                self.columns[p.name] = (array("q", [missing]) * capacity, missing)
+        self.count = 0
+        self.next = 0
+
+    def append(self, values, timestamp):
+        i = self.next
+        self.times[i] = timestamp
+        for name, (ring, missing) in self.columns.items():
+            value = values.get(name)
+            ring[i] = missing if value is None else value
+        self.next = (i + 1) % self.capacity
+        self.count += 1
+
+    def segments(self, since, until):
+        # index ranges of the ring holding since <= time < until, oldest first
+        if self.count < self.capacity:
+            ranges = [(0, self.count)]
+        else:
+            ranges = [(self.next, self.capacity), (0, self.next)]
+        segments = []
+        for lo, hi in ranges:
+            if since is not None:
+                lo = bisect.bisect_left(self.times, since, lo, hi)
+            if until is not None:
+                hi = bisect.bisect_left(self.times, until, lo, hi)
+            if lo < hi:
+                segments.append((lo, hi))
+        return segments
+
+    def rows(self, since):
+        # (time, dict of point name -> value) of every poll since, oldest first
+        for lo, hi in self.segments(since, None):
+            for i in range(lo, hi):
+                row = {}
+                for name, (ring, missing) in self.columns.items():
+                    value = ring[i]
+                    # NaN != NaN
+                    if value == value and value != missing:
+                        row[name] = value
+                yield self.times[i], row
+
+
+class SampleHistory:
+    """Fixed capacity history of the values of a set of points. The points of every
+    poll group share one ring of capacity polls with a timestamp column of its own, so
+    a group polled every 10 seconds neither writes rows for the points of a group
+    polled every 6 minutes nor pushes their samples out. Every point has its own
+    array('d') (float formats) or array('q') (integer formats) column, a sample costs
+    8 bytes plus its share of the 8 byte timestamp of its group instead of a boxed
+    float in a list. The arrays are allocated once, views() returns memoryview slices
+    into them without copying.
+    """
+
+    def __init__(self, points, capacity):
+        """
+        :param points: list of Point to keep, integer formats are kept as int64
+        :param capacity: number of polls kept of every poll group, the oldest are
+                 overwritten
+        """
+        self.capacity = capacity
+        groups = {}
+        for p in points:
+            groups.setdefault(p.group, []).append(p)
+        # poll group -> _Ring
+        self.groups = {g: _Ring(ps, capacity) for g, ps in groups.items()}
+        # point name -> _Ring holding it
+        self._rings = {
+            name: ring for ring in self.groups.values() for name in ring.columns
+        }
+
+    def __len__(self):
+        return sum(min(r.count, r.capacity) for r in self.groups.values())
+
+    def nbytes(self):
+        return sum(
+            r.times.itemsize * len(r.times)
+            + sum(a.itemsize * len(a) for a, _ in r.columns.values())
+            for r in self.groups.values()
+        )
+
+    def append(self, values, timestamp=None):
+        """
+        Function to add the values of one poll, a row is added to the ring of every
+        poll group with a point in values
+        :param values: dict of point name -> value, points of a polled group left out
+                 are stored missing
+        :param timestamp: time.time() of the poll
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        polled = {self._rings[name] for name in values if name in self._rings}
+        for ring in polled:
+            ring.append(values, timestamp)
+
+    def views(self, name, since=None, until=None):
+        """
+        Function to get the samples of a point between since and until without copying
+        :param name: point name
+        :param since: first time.time() included, None for the oldest sample
+        :param until: first time.time() excluded, None for the newest sample
+        :return: list of (timestamps, values) memoryview pairs, two when the window
+                 wraps around the end of the ring, missing samples included
+        """
+        ring = self._rings[name]
+        values = memoryview(ring.columns[name][0])
+        times = memoryview(ring.times)
+        return [
+            (times[lo:hi], values[lo:hi]) for lo, hi in ring.segments(since, until)
+        ]
+
+    def window(self, name, since=None, until=None):
+        """
+        Function to copy the samples of a point between since and until
+        :return: (array of timestamps, array of values), missing samples left out
+        """
+        ring, missing = self._rings[name].columns[name]
+        times = array("d")
+        values = array(ring.typecode)
+        for t, v in self.views(name, since, until):
+            for i in range(len(t)):
+                value = v[i]
+                # NaN != NaN
+                if value != value or value == missing:
+                    continue
+                times.append(t[i])
+                values.append(value)
+        return times, values
+
+    def write_csv(self, path, since=None):
+        """
+        Function to write the samples since a time to a CSV file, one row per poll,
+        the polls of all groups merged by time
+        """
+        names = list(self._rings)
+        with open(path, "w") as f:
+            f.write(",".join(["time"] + names) + "\n")
+            for t, row in heapq.merge(
+                *(r.rows(since) for r in self.groups.values()), key=lambda r: r[0]
+            ):
+                values = [str(row[name]) if name in row else "" for name in names]
+                f.write(",".join([f"{t:.3f}"] + values) + "\n")
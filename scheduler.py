@@ -0,0 +1,80 @@
+import heapq
+import logging
+import time
+
+
+class PollScheduler:
+    """Multi-rate poll scheduler. Every poll group has its own interval and phase, the
+    next deadlines are kept in a priority queue on the monotonic clock. Deadlines advance
+    by whole intervals from the start, so the poll period does not drift with the time
+    the poll took, and periods missed while a poll overran are skipped.
+    """
+
+    def __init__(self, groups, align=0.5, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param groups: dict of group name -> (interval, phase) in seconds
+        :param align: groups due within align seconds of each other are polled together
+        :param clock: monotonic clock
+        :param sleep: function to wait a number of seconds
+        """
+        self.align = align
+        self.clock = clock
+        self.sleep = sleep
+        self._intervals = {}
+        self._heap = []
+        start = clock()
+        for name, (interval, phase) in groups.items():
+            self.add(name, interval, phase, start)
+
+    def add(self, name, interval, phase=0, start=None):
+        if interval <= 0:
+            raise ValueError(f"poll group {name}: interval must be positive")
+        if start is None:
+            start = self.clock()
+        self._intervals[name] = interval
+        heapq.heappush(self._heap, (start + phase, name))
+
+    def remove(self, name):
+        self._intervals.pop(name, None)
+        self._heap = [e for e in self._heap if e[1] != name]
+        heapq.heapify(self._heap)
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """
+        Function to take the groups which are due at now, and reschedule them
+        :return: (deadline, list of group names), (None, []) if nothing is due
+        """
+        if not self._heap or self._heap[0][0] > now:
+            return None, []
+        deadline = self._heap[0][0]
+        popped = []
+        while self._heap and self._heap[0][0] <= max(now, deadline + self.align):
+            popped.append(heapq.heappop(self._heap))
+        for at, name in popped:
+            interval = self._intervals[name]
+            at += interval
+            if at <= now:
+                missed = int((now - at) // interval) + 1
+                logging.warning(f"poll group {name} overran, {missed} polls skipped")
+                at += missed * interval
+            heapq.heappush(self._heap, (at, name))
+        return deadline, [name for at, name in popped]
+
+    def wait(self, interrupt=None):
+        """
+        Function to sleep until the next groups are due
+        :param interrupt: threading.Event ending the sleep early when it is set
+        :return: (deadline, list of due group names), (None, []) when interrupted
+        """
+        while True:
+            now = self.clock()
+            deadline, due = self.pop_due(now)
+            if due:
+                return deadline, due
+            if interrupt is None:
+                self.sleep(self.next_deadline() - now)
+            elif interrupt.wait(self.next_deadline() - now):
+                return None, []
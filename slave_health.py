@@ -0,0 +1,129 @@
+import random
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class SlaveHealth:
+    """Round trip time estimate and circuit breaker of one slave.
+    The timeout of a request is the smoothed round trip time plus four times its mean
+    deviation (as TCP does, RFC 6298), between min_timeout and the timeout of the slave,
+    and doubles after every timeout until a reply comes back.
+    After failures polls in a row the circuit opens and the slave is not polled. Once
+    backoff seconds passed one poll is let through (half open): a reply closes the
+    circuit, a failure opens it again for twice as long, up to max_backoff.
+    """
+
+    __slots__ = (
+        "max_timeout",
+        "min_timeout",
+        "failures",
+        "backoff",
+        "max_backoff",
+        "srtt",
+        "rttvar",
+        "rto",
+        "state",
+        "failed",
+        "retry_at",
+        "_next_backoff",
+    )
+
+    def __init__(
+        self, max_timeout, min_timeout=0.2, failures=3, backoff=30, max_backoff=900
+    ):
+        """
+        :param max_timeout: seconds, the timeout of the slave
+        :param min_timeout: seconds a request is given at least
+        :param failures: failed polls in a row opening the circuit
+        :param backoff: seconds the circuit first stays open
+        """
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.failures = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.srtt = None
+        self.rttvar = 0.0
+        # the full timeout until the first reply was timed
+        self.rto = max_timeout
+        self.state = CLOSED
+        self.failed = 0
+        self.retry_at = 0.0
+        self._next_backoff = backoff
+
+    def configure(self, min_timeout, failures, backoff, max_backoff):
+        """
+        Function to change the settings, an open circuit keeps its retry time
+        """
+        self.min_timeout = min(min_timeout, self.max_timeout)
+        self.failures = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rto = min(self.max_timeout, max(self.min_timeout, self.rto))
+        if self.state == CLOSED:
+            self._next_backoff = backoff
+        else:
+            self._next_backoff = min(max_backoff, self._next_backoff)
+
+    def timeout(self):
+        return self.rto
+
+    def sample(self, rtt):
+        """
+        Function to update the round trip time estimate with the time of a reply
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(
+            self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar)
+        )
+
+    def allow(self, now):
+        """
+        Function to check whether the slave may be polled now
+        """
+        if self.state == OPEN:
+            if now < self.retry_at:
+                return False
+            self.state = HALF_OPEN
+        return True
+
+    def success(self):
+        """
+        Function to count a poll which got replies
+        :return: True if this closed the circuit
+        """
+        self.failed = 0
+        if self.state == CLOSED:
+            return False
+        self.state = CLOSED
+        self._next_backoff = self.backoff
+        return True
+
+    def failure(self, now, timed_out=False):
+        """
+        Function to count a poll which failed to connect or timed out
+        :return: True if this opened a closed circuit
+        """
+        if timed_out:
+            self.rto = min(self.max_timeout, 2 * self.rto)
+        self.failed += 1
+        if self.state == HALF_OPEN:
+            self._open(now)
+            return False
+        if self.state == CLOSED and self.failed >= self.failures:
+            self._open(now)
+            return True
+        return False
+
+    def _open(self, now):
+        # a little jitter, so that slaves behind one dead switch are not probed at once
+        self.retry_at = now + self._next_backoff * random.uniform(0.9, 1.1)
+        self._next_backoff = min(self.max_backoff, 2 * self._next_backoff)
+        self.state = OPEN
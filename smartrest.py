@@ -0,0 +1,92 @@
+import hashlib
+import logging
+
+logger = logging.getLogger("smartrest")
+
+# message ids of our templates start here, clear of the static templates 100..999
+FIRST_MESSAGE_ID = 1000
+
+
+def csv_field(value):
+    # quote SmartREST fields holding a separator or quote
+    value = str(value)
+    if any(c in value for c in ',"\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def compact_timestamp(timestamp):
+    # ISO 8601 with milliseconds, 24 characters
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class TemplateEncoder:
+    """SmartREST 2.0 measurement templates for a fixed measurement map.
+    Every fragment gets one template holding all of its series, used when a batch has
+    all of them (first reads and heartbeats), and every series gets a template of its
+    own for batches with only some of them (changes past the deadband). Series name,
+    unit and measurement type live in the template on the server, so a poll cycle goes
+    out as rows of message id, time and values only:
+        1000,2026-01-01T00:00:00.000Z,21.5,7.02,...
+    The collection id (X-ID) is derived from the templates, a changed map registers a
+    new collection instead of clashing with the old one.
+    """
+
+    def __init__(self, measurement_map, prefix="modbus2c8y"):
+        """
+        :param measurement_map: dict of fragment -> dict of series -> unit
+        :param prefix: start of the template collection id
+        """
+        self._full = {}
+        self._single = {}
+        lines = []
+        message_id = FIRST_MESSAGE_ID
+        for fragment, series_units in measurement_map.items():
+            series = tuple(series_units)
+            self._full[fragment] = (str(message_id), series)
+            lines.append(self._template(message_id, fragment, series_units.items()))
+            message_id += 1
+            for name, unit in series_units.items():
+                self._single[(fragment, name)] = str(message_id)
+                lines.append(self._template(message_id, fragment, [(name, unit)]))
+                message_id += 1
+        self.template_lines = lines
+        digest = hashlib.sha1("\n".join(lines).encode()).hexdigest()[:10]
+        self.xid = f"{prefix}_{digest}"
+        # set once the server confirmed the template collection
+        self.ready = False
+
+    @staticmethod
+    def _template(message_id, fragment, series_units):
+        # 10,msgId,POST,MEASUREMENT,,type,time,path,type,value,...
+        # empty values (time and every series value) are taken from the row
+        fields = ["10", str(message_id), "POST", "MEASUREMENT", "", csv_field(fragment), ""]
+        for series, unit in series_units:
+            path = f"{fragment}.{series}"
+            fields += [csv_field(f"{path}.value"), "NUMBER", ""]
+            fields += [csv_field(f"{path}.unit"), "STRING", csv_field(unit)]
+        return ",".join(fields)
+
+    def encode(self, fragment, measurements, timestamp):
+        """
+        Function to encode a batch into template rows
+        :param measurements: dict of series -> (value, unit)
+        :param timestamp: datetime of the batch
+        :return: (list of rows, dict of the measurements without template)
+        """
+        time = compact_timestamp(timestamp)
+        full = self._full.get(fragment)
+        if full is not None and len(measurements) == len(full[1]):
+            message_id, series = full
+            if all(s in measurements for s in series):
+                values = ",".join(str(measurements[s][0]) for s in series)
+                return [f"{message_id},{time},{values}"], {}
+        rows = []
+        rest = {}
+        for series, (value, unit) in measurements.items():
+            message_id = self._single.get((fragment, series))
+            if message_id is None:
+                rest[series] = (value, unit)
+            else:
+                rows.append(f"{message_id},{time},{value}")
+        return rows, rest
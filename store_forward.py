@@ -0,0 +1,132 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("store_forward")
+
+
+class MeasurementStore:
+    """Disk backed FIFO of MQTT payloads which could not be published.
+    Backed by a SQLite database in WAL mode so it survives restarts. Payloads are
+    written while the uplink is down, and also with the uplink up for as long as
+    older payloads are waiting, so that they go out in order. Every put is a single
+    transaction, and the oldest rows are evicted once max_rows is reached.
+    """
+
+    def __init__(self, path, max_rows=50000):
+        """
+        :param path: database file, e.g. on the FX30 flash next to config.yaml
+        :param max_rows: largest number of payloads kept, oldest are dropped first
+        """
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # fsync on checkpoint only, a power cut may lose the last rows but not corrupt the file
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, payload TEXT)"
+        )
+        self._depth = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self.stored = 0
+        self.replayed = 0
+        self.evicted = 0
+        self._replay_started = None
+        self._replay_seconds = 0.0
+        self._replay_rows = 0
+        if self._depth:
+            logger.info(f"{self._depth} payloads waiting in {path}")
+
+    def depth(self):
+        return self._depth
+
+    def put(self, topic, payloads):
+        """
+        Function to append payloads, evicting the oldest ones beyond max_rows
+        :param topic: MQTT topic the payloads are published on
+        :param payloads: list of payload strings
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT INTO outbox (topic, payload) VALUES (?, ?)",
+                    [(topic, p) for p in payloads],
+                )
+                excess = self._depth + len(payloads) - self.max_rows
+                if excess > 0:
+                    self._db.execute(
+                        "DELETE FROM outbox WHERE id IN "
+                        "(SELECT id FROM outbox ORDER BY id LIMIT ?)",
+                        (excess,),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                # e.g. disk full, without the rollback every later put would fail on
+                # the transaction left open. SQLite rolls back by itself on some errors
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+            self._depth += len(payloads)
+            self.stored += len(payloads)
+            if excess > 0:
+                self._depth -= excess
+                self.evicted += excess
+                logger.warning("outbox full, %d oldest payloads dropped", excess)
+
+    def peek(self, count):
+        """
+        :return: list of (id, topic, payload) of the oldest count payloads
+        """
+        with self._lock:
+            if self._replay_started is None:
+                self._replay_started = time.monotonic()
+            return self._db.execute(
+                "SELECT id, topic, payload FROM outbox ORDER BY id LIMIT ?", (count,)
+            ).fetchall()
+
+    def remove(self, last_id):
+        """
+        Function to remove all payloads up to and including last_id once published
+        """
+        with self._lock:
+            removed = self._db.execute(
+                "DELETE FROM outbox WHERE id <= ?", (last_id,)
+            ).rowcount
+            self._depth -= removed
+            self.replayed += removed
+            now = time.monotonic()
+            self._replay_rows += removed
+            if self._depth == 0:
+                self._replay_seconds += now - self._replay_started
+                logger.info(
+                    "outbox drained, %d payloads replayed in %.1fs",
+                    self._replay_rows,
+                    now - self._replay_started,
+                )
+                self._replay_started = None
+                self._replay_rows = 0
+
+    def stats(self):
+        """
+        :return: dict of queue depth, payloads stored, replayed and evicted, and replay
+                 throughput in payloads per second
+        """
+        with self._lock:
+            seconds = self._replay_seconds
+            if self._replay_started is not None:
+                seconds += time.monotonic() - self._replay_started
+            return {
+                "depth": self._depth,
+                "stored": self.stored,
+                "replayed": self.replayed,
+                "evicted": self.evicted,
+                "replay_rate": round(self.replayed / seconds, 1) if seconds else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
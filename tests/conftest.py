@@ -0,0 +1,29 @@
+import atexit
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# on the device the modules are imported from the modbus and c8y packages (see
+# benchmarks/mirror_tree.py), here both packages are the flat repository
+for name in ("modbus", "c8y"):
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [ROOT]
+        sys.modules[name] = package
+
+# c8y_device.py, the base of the gateway, only ships in the .update package, it is
+# extracted from there into a directory added to the c8y package
+UPDATES = sorted(glob.glob(os.path.join(ROOT, "modbus2cumulocity.*.update")))
+if UPDATES:
+    from benchmarks.mirror_tree import extract_c8y_device
+
+    C8Y_DEVICE_DIR = tempfile.mkdtemp(prefix="c8y_device_")
+    atexit.register(shutil.rmtree, C8Y_DEVICE_DIR, True)
+    extract_c8y_device(UPDATES[-1], os.path.join(C8Y_DEVICE_DIR, "c8y_device.py"))
+    sys.modules["c8y"].__path__.append(C8Y_DEVICE_DIR)
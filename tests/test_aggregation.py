@@ -0,0 +1,38 @@
+from aggregation import WindowAggregator
+from modbus.register_map import Point
+
+
+def test_windows():
+    aggregator = WindowAggregator([Point("a", 1, window=60), Point("b", 2)])
+    assert "a" in aggregator and "b" not in aggregator
+    assert aggregator.add({"a": 1, "b": 5}, 120) == []
+    assert aggregator.add({"a": 3}, 150) == []
+    assert aggregator.add({"a": 2}, 179) == []
+    (closed,) = aggregator.add({"a": 10}, 180)
+    end, name, summary = closed
+    assert (end, name) == (180, "a")
+    assert summary == {"mean": 2, "min": 1, "max": 3, "count": 3, "last": 2}
+
+
+def test_close_pushes_open_windows():
+    aggregator = WindowAggregator([Point("a", 1, window=60)])
+    aggregator.add({"a": 1}, 120)
+    aggregator.add({"a": 2}, 130)
+    assert aggregator.close(140) == [
+        (140, "a", {"mean": 1.5, "min": 1, "max": 2, "count": 2, "last": 2})
+    ]
+    assert aggregator.close(150) == []
+
+
+def test_flush_without_new_values():
+    aggregator = WindowAggregator([Point("a", 1, window=60)])
+    aggregator.add({"a": 1}, 120)
+    aggregator.add({"a": 3}, 130)
+    assert aggregator.flush(170) == []
+    # the slave stopped answering, the window is closed by the tick at its end
+    assert aggregator.flush(181) == [
+        (180, "a", {"mean": 2, "min": 1, "max": 3, "count": 2, "last": 3})
+    ]
+    assert aggregator.flush(300) == []
+    # and not pushed again with the next values
+    assert aggregator.add({"a": 5}, 310) == []
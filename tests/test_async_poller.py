@@ -0,0 +1,127 @@
+import socket
+
+import pytest
+
+from benchmarks.modbus_simulator import SimulatedSlave
+from modbus import async_poller
+from modbus.async_poller import PIPELINE_FAILURES, AsyncPoller
+from modbus.modbus_proxy import RegisterCache
+from modbus.modbus_write import plan_writes
+from modbus.register_map import Point, Slave, plan_reads
+
+# 4 reads of 10 registers
+POINTS = [Point(f"p{a}", a, "32bit_float") for a in range(1, 80, 2)]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def simulator():
+    simulator = SimulatedSlave(POINTS, _free_port(), latency=0.01).start()
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def poller():
+    poller = AsyncPoller()
+    yield poller
+    poller.close()
+
+
+def _slave(simulator, pipeline):
+    return Slave("logger", simulator.host, simulator.port, 1, 3, POINTS, pipeline)
+
+
+def _plan():
+    return plan_reads(POINTS, max_count=10)
+
+
+def test_pipelined_reads_match_serial_reads(simulator, poller):
+    plan = _plan()
+    assert len(plan) == 8
+    serial = poller.poll([(_slave(simulator, 1), plan)])["logger"]
+    assert len(serial) == len(POINTS)
+    requests = simulator.requests
+    pipelined = poller.poll([(_slave(simulator, 4), plan)])["logger"]
+    assert pipelined == serial
+    assert simulator.requests - requests == len(plan)
+    assert poller.stats["logger"].errors == 0
+
+
+def test_falls_back_to_serial_reads(simulator, poller, monkeypatch):
+    slave = _slave(simulator, 4)
+    plan = _plan()
+
+    async def rejected(client, slave, blocks, depth):
+        return [ConnectionResetError()] * len(blocks)
+
+    monkeypatch.setattr(poller, "_read_pipelined", rejected)
+    for _ in range(PIPELINE_FAILURES - 1):
+        # every poll is read again serially, no values are lost
+        assert len(poller.poll([(slave, plan)])["logger"]) == len(POINTS)
+        assert poller._depth(slave) == 4
+    poller.poll([(slave, plan)])
+    assert poller._depth(slave) == 1
+    # tried again once the back-off expired, for twice as long when it fails again
+    _, backoff = poller._pipeline_retry["logger"]
+    assert backoff == 2 * async_poller.PIPELINE_RETRY
+    poller._pipeline_retry["logger"] = (0, backoff)
+    assert poller._depth(slave) == 4
+
+
+def test_one_failed_poll_keeps_the_pipeline(simulator, poller, monkeypatch):
+    slave = _slave(simulator, 4)
+    plan = _plan()
+    read_pipelined = poller._read_pipelined
+    failures = iter([True] + [False] * PIPELINE_FAILURES)
+
+    async def flaky(client, slave, blocks, depth):
+        if next(failures):
+            return [TimeoutError()] * len(blocks)
+        return await read_pipelined(client, slave, blocks, depth)
+
+    monkeypatch.setattr(poller, "_read_pipelined", flaky)
+    for _ in range(PIPELINE_FAILURES):
+        poller.poll([(slave, plan)])
+    assert poller._depth(slave) == 4
+    assert "logger" not in poller._pipeline_failed
+
+
+def test_probe_pipeline(simulator, poller):
+    slave = _slave(simulator, 1)
+    best, rates = poller.probe_pipeline(slave, _plan()[0], depths=(1, 4), requests=8)
+    assert best in (1, 4)
+    assert all(rate > 0 for rate in rates.values())
+
+
+def test_probe_pipeline_rejected_at_first_depth(simulator, poller):
+    slave = _slave(simulator, 1)
+    # beyond the registers of the slave
+    (block,) = plan_reads([Point("x", 1000)])
+    best, rates = poller.probe_pipeline(slave, block, depths=(1, 2), requests=2)
+    assert (best, rates) == (None, {1: None})
+
+
+def test_write_is_read_back(simulator, poller):
+    poller.cache = RegisterCache()
+    slave = _slave(simulator, 1)
+    blocks = plan_writes([(POINTS[0], 21.5), (POINTS[1], -3.0), (POINTS[5], 7.25)])
+    assert len(blocks) == 2
+    assert poller.write(slave, blocks) == [None, None]
+    # the registers read back are served by the proxy without a read of their own
+    registers = poller.cache.get("logger", 1, 0, 4, max_age=60)
+    assert registers == list(blocks[0].registers)
+    values = poller.poll([(slave, _plan())])["logger"]
+    assert (values["p1"], values["p3"], values["p11"]) == (21.5, -3.0, 7.25)
+
+
+def test_write_rejected_by_the_slave(simulator, poller):
+    slave = _slave(simulator, 1)
+    blocks = plan_writes([(Point("x", 1000), 1)])
+    (error,) = poller.write(slave, blocks)
+    assert error.startswith("write 999/1")
@@ -0,0 +1,248 @@
+import datetime
+import ssl
+from concurrent import futures
+
+import pytest
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+
+from c8y.c8y_gateway import c8yGateway
+from c8y.smartrest import TemplateEncoder
+from store_forward import MeasurementStore
+
+T = datetime.datetime(2026, 1, 2, 3, 4, 5, 600000)
+
+
+class FakeMessageInfo:
+    def __init__(self, rc):
+        self.rc = rc
+        self.mid = 1
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload.encode()
+
+
+class FakeClient:
+    """Records what the gateway publishes instead of sending it"""
+
+    def __init__(self):
+        self.published = []
+        self.rc = MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload, qos=0):
+        if self.rc == MQTT_ERR_SUCCESS:
+            self.published.append((topic, payload, qos))
+        return FakeMessageInfo(self.rc)
+
+    def subscribe(self, topic):
+        pass
+
+
+@pytest.fixture
+def gateway(tmp_path, monkeypatch):
+    def make(**kwargs):
+        # c8y_device.yaml is written into the working directory
+        monkeypatch.chdir(tmp_path)
+        gateway = c8yGateway(
+            url="localhost",
+            tenant="t",
+            device_id="gw",
+            device_type="FX30",
+            ca_certs=None,
+            certfile=None,
+            keyfile=None,
+            cert_reqs=ssl.CERT_NONE,
+            **kwargs,
+        )
+        gateway._client = FakeClient()
+        return gateway
+
+    return make
+
+
+def test_encode_batch(gateway):
+    client = gateway()
+    (message,) = client.encode_batch(
+        "datalogger", {"Temp(200)": (21.5, "degC"), "PH(204)": (7.0, "ph")}, T
+    )
+    assert message == (
+        "201,datalogger,2026-01-02T03:04:05.600000Z,"
+        "datalogger,Temp(200),21.5,degC,datalogger,PH(204),7.0,ph"
+    )
+
+
+def test_encode_batch_splits_at_max_payload(gateway):
+    client = gateway(max_payload=120)
+    measurements = {f"s{i}": (i, "V") for i in range(10)}
+    messages = client.encode_batch("f", measurements, T)
+    assert len(messages) > 1
+    assert all(len(m) <= 120 for m in messages)
+    assert all(m.startswith("201,f,2026-01-02T03:04:05.600000Z,f,") for m in messages)
+    series = [part for m in messages for part in m.split(",")[4::4]]
+    assert series == list(measurements)
+
+
+def test_encode_lines_per_topic(gateway):
+    client = gateway()
+    topics = client.encode_lines(
+        [
+            ("f", {"a": (1, "")}, T, None),
+            ("f", {"b": (2, "")}, T, "gw_logger"),
+            ("g", {"c": (3, "")}, T, None),
+        ]
+    )
+    assert sorted(topics) == ["s/us", "s/us/gw_logger"]
+    assert [line.split(",")[1] for line in topics["s/us"]] == ["f", "g"]
+    assert len(topics["s/us/gw_logger"]) == 1
+
+
+def test_encode_lines_with_templates(gateway):
+    templates = TemplateEncoder({"f": {"a": "", "b": ""}})
+    client = gateway(templates=templates)
+    batches = [("f", {"a": (1, ""), "x": (2, "")}, T, "gw_logger")]
+    # 201 until the server confirmed the collection
+    assert list(client.encode_lines(batches)) == ["s/us/gw_logger"]
+    templates.ready = True
+    topics = client.encode_lines(batches)
+    assert topics[f"s/uc/{templates.xid}/gw_logger"] == [
+        "1001,2026-01-02T03:04:05.600Z,1"
+    ]
+    assert topics["s/us/gw_logger"] == ["201,f,2026-01-02T03:04:05.600000Z,f,x,2,"]
+
+
+def test_template_collection_registered(gateway):
+    templates = TemplateEncoder({"f": {"a": ""}})
+    client = gateway(templates=templates)
+    topic = f"s/ut/{templates.xid}"
+    client._on_message(None, None, FakeMessage("s/dt", "41,not found"))
+    assert client._client.published == [
+        (topic, "\n".join(templates.template_lines), 1),
+        (topic, "", 1),
+    ]
+    assert not templates.ready
+    client._on_message(None, None, FakeMessage("s/dt", "20,1,2"))
+    assert templates.ready
+    # a collection refused after registering it is not registered again
+    templates.ready = False
+    client._on_message(None, None, FakeMessage("s/dt", "41,not found"))
+    assert len(client._client.published) == 2
+
+
+def test_pack_lines(gateway):
+    client = gateway(max_payload=10)
+    assert client.pack_lines(["aaaa", "bbbb", "cccccc", "dd"]) == [
+        "aaaa\nbbbb",
+        "cccccc\ndd",
+    ]
+
+
+def test_stored_while_down_and_replayed_together(gateway, tmp_path):
+    store = MeasurementStore(str(tmp_path / "outbox.db"))
+    client = gateway(store=store)
+    client.publish_measurements("s/us", ["a", "b"])
+    assert client._client.published == []
+    client.connected = True
+    # older payloads are waiting, a new one goes behind them
+    client.publish_measurements("s/us", ["c"])
+    assert store.depth() == 3
+    client.replay()
+    assert [p for _, p, _ in client._client.published] == ["a\nb\nc"]
+    assert store.depth() == 0
+
+
+def test_replay_rate(gateway, tmp_path):
+    store = MeasurementStore(str(tmp_path / "outbox.db"))
+    store.put("s/us", [str(i) for i in range(6)])
+    client = gateway(store=store, replay_batch=1, replay_rate=2)
+    client.connected = True
+    # the bucket starts full
+    client.replay()
+    assert len(client._client.published) == 2
+    client.replay()
+    assert len(client._client.published) == 2
+    # half a second refills one token
+    client._replay_time -= 0.5
+    client.replay()
+    assert [p for _, p, _ in client._client.published] == ["0", "1", "2"]
+    # a long pause does not add up to a burst
+    client._replay_time -= 60
+    client.replay()
+    assert len(client._client.published) == 5
+
+
+def test_replay_stops_when_publish_fails(gateway, tmp_path):
+    store = MeasurementStore(str(tmp_path / "outbox.db"))
+    store.put("s/us", ["a"])
+    client = gateway(store=store, measurement_qos=0)
+    client.connected = True
+    client._client.rc = MQTT_ERR_NO_CONN
+    client.replay()
+    assert store.depth() == 1
+
+
+@pytest.mark.parametrize("qos,stored", [(0, 1), (1, 0)])
+def test_no_connection(gateway, tmp_path, qos, stored):
+    # paho keeps a QoS 1 message it could not send, but drops a QoS 0 one
+    store = MeasurementStore(str(tmp_path / "outbox.db"))
+    client = gateway(store=store, measurement_qos=qos)
+    client.connected = True
+    client._client.rc = MQTT_ERR_NO_CONN
+    client.publish_measurements("s/us", ["a"])
+    assert store.depth() == stored
+
+
+def test_command_result(gateway):
+    client = gateway()
+    client.commands["echo"] = lambda args, slave: f"{args}, {slave}"
+    client._execute_command('511,gw,"echo a ""b"""')
+    assert [payload for _, payload, _ in client._client.published] == [
+        "501,c8y_Command",
+        '503,c8y_Command,"a ""b"", None"',
+    ]
+
+
+def test_command_error(gateway):
+    client = gateway()
+
+    def fail(args, slave):
+        raise ValueError("bad, args")
+
+    client.commands["fail"] = fail
+    client._execute_command("511,gw,fail now")
+    client._execute_command("511,gw,nothing")
+    assert [payload for _, payload, _ in client._client.published] == [
+        "501,c8y_Command",
+        '502,c8y_Command,"bad, args"',
+        "501,c8y_Command",
+        '502,c8y_Command,"Command Unknown"',
+    ]
+
+
+def test_command_future_of_a_child(gateway):
+    client = gateway()
+    client.children["gw_logger"] = ("logger", "c8y_ModbusSlave")
+    done = {}
+
+    def submit(args, slave):
+        done[args] = futures.Future()
+        return done[args]
+
+    client.commands["set"] = submit
+    client._execute_command("511,gw_logger,set a=1")
+    client._execute_command("511,gw_logger,set b=2")
+    assert client._client.published == [
+        ("s/us/gw_logger", "501,c8y_Command", 2),
+        ("s/us/gw_logger", "501,c8y_Command", 2),
+    ]
+    # reported at QoS 1 once the poll loop completed the future, without waiting
+    done["b=2"].set_exception(RuntimeError("b: read back 3"))
+    done["a=1"].set_result("logger: a=1 written and read back")
+    assert client._client.published[2:] == [
+        ("s/us/gw_logger", "502,c8y_Command,b: read back 3", 1),
+        ("s/us/gw_logger", "503,c8y_Command,logger: a=1 written and read back", 1),
+    ]
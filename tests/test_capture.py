@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from capture import CaptureWriter, read_capture
+
+
+def _write(path, *blocks):
+    writer = CaptureWriter(str(path))
+    for slave, address, registers in blocks:
+        writer.write(slave, 1, 100.0, address, registers)
+    writer.flush()
+    writer.close()
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "capture.bin"
+    _write(path, ("a", 199, [1, 2, 3]), ("b", 10, [4]))
+    reads = list(read_capture(str(path)))
+    assert [r[1:] for r in reads] == [("a", 1, 199, (1, 2, 3)), ("b", 1, 10, (4,))]
+    assert reads[0][0] == reads[1][0]
+
+
+def test_truncated_file_is_read_up_to_the_cut(tmp_path):
+    path = tmp_path / "capture.bin"
+    _write(path, ("a", 199, [1, 2, 3]), ("a", 210, [4, 5]))
+    size = os.path.getsize(path)
+    # the last record is 20 bytes: type, 15 bytes of header, 2 registers
+    for cut in range(size - 1, size - 21, -1):
+        os.truncate(path, cut)
+        assert [r[3:] for r in read_capture(str(path))] == [(199, (1, 2, 3))]
+
+
+def test_torn_tail_is_cut_before_appending(tmp_path):
+    path = tmp_path / "capture.bin"
+    _write(path, ("a", 199, [1, 2, 3]), ("a", 210, [4, 5]))
+    os.truncate(path, os.path.getsize(path) - 1)
+    _write(path, ("a", 220, [6]))
+    assert [r[3:] for r in read_capture(str(path))] == [(199, (1, 2, 3)), (220, (6,))]
+
+
+@pytest.mark.parametrize("corruption", ["type", "count"])
+def test_corrupt_file_is_moved_aside(tmp_path, corruption):
+    path = tmp_path / "capture.bin"
+    _write(path, ("a", 199, [1, 2, 3]), ("a", 210, [4, 5]))
+    data = bytearray(path.read_bytes())
+    # the last record is 20 bytes, its type or its number of registers is garbage
+    if corruption == "type":
+        data[-20] = 9
+    else:
+        data[-6:-4] = (2000).to_bytes(2, "little")
+    path.write_bytes(data)
+    _write(path, ("a", 220, [6]))
+    assert [r[3:] for r in read_capture(str(path))] == [(220, (6,))]
+    corrupt = read_capture(f"{path}.corrupt")
+    assert next(corrupt)[3:] == (199, (1, 2, 3))
+    with pytest.raises(ValueError):
+        next(corrupt)
+    assert os.path.getsize(f"{path}.corrupt") == len(data)
+
+
+def test_not_a_capture_file(tmp_path):
+    path = tmp_path / "capture.bin"
+    path.write_bytes(b"something else")
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+    with pytest.raises(ValueError):
+        CaptureWriter(str(path))
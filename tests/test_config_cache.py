@@ -0,0 +1,152 @@
+import os
+
+import pytest
+
+import config_cache
+from config_cache import ConfigCache
+
+CONFIG = """modbus:
+  slave_ip: 127.0.0.1
+  max_gap: 8
+"""
+
+
+@pytest.fixture
+def paths(tmp_path):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(CONFIG)
+    return str(config_file), str(tmp_path / "config.cache")
+
+
+def _load(paths):
+    config = ConfigCache(*paths)
+    config.load()
+    return config
+
+
+def _compile(paths):
+    config = _load(paths)
+    for slave in config.slaves:
+        for groups in config.groups:
+            config.plan(slave, frozenset([groups]))
+    config.save()
+    return config
+
+
+def test_unchanged_config_is_loaded_from_the_cache(paths):
+    compiled = _compile(paths)
+    assert not compiled.hit
+    config = _load(paths)
+    assert config.hit
+    assert config.config == compiled.config
+    assert config.slaves == compiled.slaves
+    assert config.groups == compiled.groups
+    assert config.plans.keys() == compiled.plans.keys()
+
+
+def test_touched_config_is_checked_by_content(paths):
+    _compile(paths)
+    config_file = paths[0]
+    st = os.stat(config_file)
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    config = _load(paths)
+    assert config.hit
+    # the new mtime is saved, the next start needs no SHA-1
+    config.save()
+    assert ConfigCache(*paths)._read_cache()["key"]["mtime_ns"] == os.stat(
+        config_file
+    ).st_mtime_ns
+
+
+def test_changed_config_is_compiled_again(paths):
+    _compile(paths)
+    config_file = paths[0]
+    st = os.stat(config_file)
+    # same size, other content: the SHA-1 tells
+    with open(config_file, "w") as f:
+        f.write(CONFIG.replace("max_gap: 8", "max_gap: 9"))
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    config = _load(paths)
+    assert not config.hit
+    assert config.config["modbus"]["max_gap"] == 9
+    assert config.plans == {}
+
+
+def test_changed_code_is_compiled_again(paths, monkeypatch):
+    _compile(paths)
+    monkeypatch.setattr(config_cache, "_code_key", lambda: (0, 0))
+    assert not _load(paths).hit
+
+
+def test_broken_cache_is_ignored(paths):
+    with open(paths[1], "wb") as f:
+        f.write(b"not a pickle")
+    config = _load(paths)
+    assert not config.hit
+    assert config.slaves[0].host == "127.0.0.1"
+
+
+SLAVES = """modbus:
+  max_gap: 8
+  groups:
+    analog:
+      interval: 360
+    level:
+      interval: 10
+  slaves:
+    - name: a
+      ip: 10.0.0.1
+    - name: b
+      ip: 10.0.0.2
+    - name: c
+      ip: 10.0.0.3
+"""
+
+
+def _rewrite(config_file, text):
+    st = os.stat(config_file)
+    with open(config_file, "w") as f:
+        f.write(text)
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_reload_diff(paths):
+    _rewrite(paths[0], SLAVES)
+    config = _compile(paths)
+    plan = config.plans[("a", frozenset(["analog"]))]
+    _rewrite(
+        paths[0],
+        SLAVES.replace("interval: 10", "interval: 20")
+        .replace("10.0.0.2", "10.0.0.20")
+        .replace("name: c\n      ip: 10.0.0.3", "name: d\n      ip: 10.0.0.4"),
+    )
+    assert config.changed()
+    diff = config.reload()
+    assert diff["added"] == {"d"}
+    assert diff["changed"] == {"b"}
+    assert diff["removed"] == {"c"}
+    assert diff["groups"] == {"level"}
+    assert sorted(diff["old_slaves"]) == ["a", "b", "c"]
+    # only the plans of the unchanged slave are kept
+    assert config.plans[("a", frozenset(["analog"]))] is plan
+    assert {name for name, _ in config.plans} == {"a"}
+
+
+def test_reload_with_other_layout_changes_every_slave(paths):
+    _rewrite(paths[0], SLAVES)
+    config = _compile(paths)
+    _rewrite(paths[0], SLAVES.replace("max_gap: 8", "max_gap: 0"))
+    diff = config.reload()
+    assert diff["changed"] == {"a", "b", "c"}
+    assert config.plans == {}
+
+
+def test_invalid_reload_keeps_the_config(paths):
+    _rewrite(paths[0], SLAVES)
+    config = _compile(paths)
+    slaves = config.slaves
+    _rewrite(paths[0], SLAVES.replace("name: b", "name: a"))
+    with pytest.raises(ValueError):
+        config.reload()
+    assert config.slaves == slaves
+    assert not config.changed()
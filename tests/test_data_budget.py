@@ -0,0 +1,49 @@
+import json
+
+from data_budget import MESSAGE_OVERHEAD, DataBudget
+
+# 2024-01-16 00:00 UTC, half of January gone
+MID_MONTH = 1705363200.0
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_message_counts_encoded_bytes(tmp_path):
+    budget = DataBudget(str(tmp_path / "b.json"), 10**6, clock=Clock(MID_MONTH))
+    budget.message("s/us", "é")
+    budget.message("s/ds", b"ab", received=True)
+    assert budget.usage()["day"] == 4 + 2 + 4 + 2 + 2 * MESSAGE_OVERHEAD
+
+
+def test_adjust_raises_and_lowers_factor(tmp_path):
+    clock = Clock(MID_MONTH)
+    budget = DataBudget(str(tmp_path / "b.json"), 1000, step=2, clock=clock)
+    budget.add(sent=600)
+    # 600 bytes in half a month project to about 1200
+    assert budget.adjust() == 2
+    assert budget.adjust() == 4
+    # next month, nothing used yet
+    clock.now += 20 * 86400
+    assert budget.usage()["month"] == 0
+    assert budget.adjust() == 2
+
+
+def test_saved_on_change_and_hourly(tmp_path):
+    path = tmp_path / "b.json"
+    clock = Clock(MID_MONTH)
+    budget = DataBudget(str(path), 10**9, clock=clock)
+    budget.adjust()
+    assert not path.exists()
+    clock.now += 3600
+    budget.adjust()
+    assert json.loads(path.read_text())["factor"] == 1.0
+    budget.add(sent=10**9)
+    budget.adjust()
+    assert json.loads(path.read_text())["factor"] == 1.5
+    assert DataBudget(str(path), 10**9, clock=clock).factor == 1.5
@@ -0,0 +1,75 @@
+import itertools
+import math
+
+import pytest
+
+from modbus.decoder import (
+    FORMATS,
+    WORD_ORDERS,
+    BlockLayout,
+    decode_array,
+    encode_value,
+)
+
+VALUES = {
+    "16bit_integer": [0, 1, -1, 32767, -32768],
+    "16bit_uint": [0, 1, 65535],
+    "32bit_integer": [0, -2, 2**31 - 1, -(2**31)],
+    "32bit_uint": [0, 70000, 2**32 - 1],
+    "32bit_float": [0.0, 1.5, -273.25, 1e10],
+    "64bit_integer": [0, -3, 2**63 - 1, -(2**63)],
+    "64bit_uint": [0, 2**64 - 1],
+    "64bit_float": [0.0, math.pi, -1e300],
+}
+
+
+@pytest.mark.parametrize(
+    "format,word_order", list(itertools.product(sorted(FORMATS), sorted(WORD_ORDERS)))
+)
+def test_round_trip(format, word_order):
+    width = FORMATS[format][1]
+    for value in VALUES[format]:
+        registers = encode_value(value, format, word_order)
+        assert len(registers) == width
+        assert all(0 <= r <= 0xFFFF for r in registers)
+        layout = BlockLayout([(0, format, word_order)], width)
+        assert layout.decode(registers) == [pytest.approx(value, rel=1e-7)]
+
+
+@pytest.mark.parametrize(
+    "word_order,registers",
+    [
+        ("standard", [0x3F80, 0x0000]),
+        ("reverse", [0x0000, 0x3F80]),
+        ("byteswap", [0x803F, 0x0000]),
+        ("reverse_byteswap", [0x0000, 0x803F]),
+    ],
+)
+def test_float_word_orders(word_order, registers):
+    assert encode_value(1.0, "32bit_float", word_order) == registers
+    assert decode_array(registers, "32bit_float", word_order) == [1.0]
+
+
+def test_mixed_block():
+    fields = [
+        (0, "32bit_float", "reverse"),
+        (2, "16bit_integer", "standard"),
+        (3, "32bit_uint", "byteswap"),
+        (6, "16bit_uint", "reverse_byteswap"),
+    ]
+    values = [2.5, -7, 123456, 4660]
+    registers = [0] * 7
+    for (offset, format, word_order), value in zip(fields, values):
+        encoded = encode_value(value, format, word_order)
+        registers[offset : offset + len(encoded)] = encoded
+    assert BlockLayout(fields, 7).decode(registers) == values
+
+
+def test_field_outside_block():
+    with pytest.raises(ValueError):
+        BlockLayout([(1, "32bit_float", "standard")], 2)
+
+
+def test_out_of_range():
+    with pytest.raises(Exception):
+        encode_value(70000, "16bit_integer")
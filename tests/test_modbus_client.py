@@ -0,0 +1,56 @@
+import socket
+import time
+
+import pytest
+
+from benchmarks.modbus_simulator import SimulatedSlave
+from modbus.modbus_client import ModbusConnectionPool, read_hr
+from modbus.register_map import Point
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def slave():
+    slave = SimulatedSlave([Point("a", 1, "32bit_float")], _free_port()).start()
+    yield slave
+    slave.stop()
+
+
+def test_connection_is_reused(slave):
+    pool = ModbusConnectionPool()
+    for _ in range(3):
+        values = read_hr(0, 2, slave.host, "32bit_float", port=slave.port, pool=pool)
+        assert len(values) == 1
+    (stats,) = pool.stats().values()
+    assert (stats["connects"], stats["reconnects"], stats["connected"]) == (1, 0, True)
+    pool.close_all()
+
+
+def test_idle_connection_is_closed_without_another_read(slave):
+    pool = ModbusConnectionPool(idle_timeout=0.2)
+    read_hr(0, 1, slave.host, port=slave.port, pool=pool)
+    deadline = time.monotonic() + 3
+    while any(s["connected"] for s in pool.stats().values()):
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    # reconnected on the next read
+    assert read_hr(0, 1, slave.host, port=slave.port, pool=pool)
+    (stats,) = pool.stats().values()
+    assert stats["reconnects"] == 1
+    pool.close_all()
+
+
+def test_unreachable_slave_backs_off():
+    pool = ModbusConnectionPool(timeout=0.5)
+    port = _free_port()
+    assert read_hr(0, 1, "127.0.0.1", port=port, pool=pool) == []
+    with pool.connection("127.0.0.1", port) as conn:
+        # still backing off, no connect is tried
+        assert conn is None
+    (stats,) = pool.stats().values()
+    assert stats["failures"] == 1
@@ -0,0 +1,105 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from benchmarks.modbus_simulator import SimulatedSlave
+from modbus.modbus_proxy import MBAP, ModbusProxy, RegisterCache
+from modbus.register_map import Point, Slave
+
+POINTS = [Point(f"p{a}", a, "32bit_float") for a in range(1, 40, 2)]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_cache_serves_any_covered_range():
+    cache = RegisterCache()
+    cache.put("logger", 1, 0, list(range(10)), now=100)
+    cache.put("logger", 1, 10, list(range(10, 20)), now=105)
+    assert cache.get("logger", 1, 3, 4, max_age=10, now=106) == [3, 4, 5, 6]
+    # across two blocks of the poller
+    assert cache.get("logger", 1, 8, 4, max_age=10, now=106) == [8, 9, 10, 11]
+    assert cache.get("logger", 1, 8, 4, max_age=10, now=111) is None
+    assert cache.get("logger", 1, 18, 4, max_age=10, now=106) is None
+    assert cache.get("logger", 2, 0, 1, max_age=10, now=106) is None
+
+
+@pytest.fixture
+def proxy():
+    simulator = SimulatedSlave(POINTS, _free_port(), latency=0.2).start()
+    slave = Slave("logger", simulator.host, simulator.port, 1, 3, POINTS)
+    port = _free_port()
+    proxy = ModbusProxy({port: slave}, RegisterCache(), host="127.0.0.1")
+    proxy.start()
+    proxy.port = port
+    proxy.simulator = simulator
+    yield proxy
+    proxy.close()
+    simulator.stop()
+
+
+def _connect(port):
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port), timeout=5)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _request(sock, pdu, transaction=1, protocol=0, unit=1):
+    sock.sendall(MBAP.pack(transaction, protocol, len(pdu) + 1, unit) + pdu)
+    header = sock.recv(MBAP.size)
+    if not header:
+        return None
+    assert MBAP.unpack(header)[0] == transaction
+    return sock.recv(260)
+
+
+def _read(port, address, count):
+    with _connect(port) as sock:
+        response = _request(sock, struct.pack(">BHH", 3, address, count))
+    assert response[:2] == bytes((3, 2 * count))
+    return list(struct.unpack(f">{count}H", response[2:]))
+
+
+def test_sub_range_served_from_cache(proxy):
+    registers = _read(proxy.port, 0, 40)
+    assert _read(proxy.port, 5, 10) == registers[5:15]
+    assert proxy.stats()["misses"] == 1
+    assert proxy.stats()["hits"] == 1
+    assert proxy.simulator.requests == 1
+
+
+def test_sub_range_waits_for_read_in_flight(proxy):
+    results = {}
+    whole = threading.Thread(
+        target=lambda: results.update(whole=_read(proxy.port, 0, 40))
+    )
+    whole.start()
+    time.sleep(0.1)
+    part = _read(proxy.port, 20, 4)
+    whole.join()
+    assert part == results["whole"][20:24]
+    assert proxy.stats()["misses"] == 1
+    assert proxy.stats()["coalesced"] == 1
+
+
+def test_illegal_function(proxy):
+    with _connect(proxy.port) as sock:
+        response = _request(sock, struct.pack(">BHH", 6, 0, 1))
+    assert response == bytes((0x86, 1))
+
+
+def test_other_protocol_closes_the_connection(proxy):
+    with _connect(proxy.port) as sock:
+        assert _request(sock, struct.pack(">BHH", 3, 0, 1), protocol=1) is None
+    assert proxy.simulator.requests == 0
@@ -0,0 +1,123 @@
+import pytest
+
+from modbus.decoder import encode_value
+from modbus.modbus_write import (
+    MAX_WRITE_COUNT,
+    WriteQueue,
+    execute_writes,
+    parse_writes,
+    plan_writes,
+)
+from modbus.register_map import Point, Slave
+
+
+def _point(name, address, format="16bit_uint", word_order="standard"):
+    return Point(name, address, format, word_order, writable=True)
+
+
+def test_adjacent_writes_are_one_request():
+    a = _point("a", 300, "32bit_float", "reverse")
+    b = _point("b", 302)
+    (block,) = plan_writes([(b, 7), (a, 2.5)], register_base=1)
+    assert block.address == 299
+    assert list(block.registers) == encode_value(2.5, "32bit_float", "reverse") + [7]
+    assert [p.name for p in block.points] == ["a", "b"]
+
+
+def test_gaps_are_not_bridged():
+    blocks = plan_writes([(_point("a", 10), 1), (_point("b", 12), 2)], 0)
+    assert [(b.address, b.registers) for b in blocks] == [(10, (1,)), (12, (2,))]
+
+
+def test_max_write_count():
+    points = [(_point(f"p{i}", i), i) for i in range(200)]
+    blocks = plan_writes(points, 0)
+    assert [len(b.registers) for b in blocks] == [MAX_WRITE_COUNT, 200 - MAX_WRITE_COUNT]
+
+
+def test_overlap():
+    with pytest.raises(ValueError):
+        plan_writes([(_point("a", 10, "32bit_uint"), 1), (_point("b", 11), 2)], 0)
+
+
+def test_last_value_wins():
+    a = _point("a", 10)
+    (block,) = plan_writes([(a, 1), (a, 2)], 0)
+    assert block.registers == (2,)
+
+
+def test_parse_writes():
+    points = [_point("a", 10, "32bit_float"), _point("b", 12), Point("c", 13)]
+    one = Slave("logger", "h", 502, 1, 3, points)
+    two = one._replace(name="other")
+    slave, writes = parse_writes("a=1.5 b=3", [one])
+    assert slave is one
+    assert [(p.name, v) for p, v in writes] == [("a", 1.5), ("b", 3)]
+    slave, writes = parse_writes("other b=4", [one, two])
+    assert slave is two
+    slave, writes = parse_writes("b=4", [one, two], slave_name="other")
+    assert slave is two
+    for text, slaves in (
+        ("b=4", [one, two]),
+        ("c=1", [one]),
+        ("x=1", [one]),
+        ("b=1.5", [one]),
+        ("b=70000", [one]),
+        ("a=1e300", [one]),
+        ("nobody b=1", [one]),
+        ("logger", [one]),
+    ):
+        with pytest.raises(ValueError):
+            parse_writes(text, slaves)
+
+
+class FakePoller:
+    """Answers writes with the errors given per slave, or raises them"""
+
+    def __init__(self, **errors):
+        self.errors = errors
+        self.written = []
+
+    def write(self, slave, blocks):
+        error = self.errors.get(slave.name)
+        if isinstance(error, Exception):
+            raise error
+        self.written.append((slave.name, [b.address for b in blocks]))
+        return [error] * len(blocks)
+
+
+def test_execute_writes():
+    points = [_point("a", 10), _point("b", 11), _point("c", 20)]
+    one = Slave("one", "h", 502, 1, 3, points)
+    two = one._replace(name="two")
+    queue = WriteQueue()
+    first = queue.submit(one, [(points[0], 1)])
+    second = queue.submit(one, [(points[1], 2), (points[2], 3)])
+    failed = queue.submit(two, [(points[0], 4)])
+    poller = FakePoller(two="bad value")
+    written = execute_writes(poller, queue.take(), register_base=0)
+    # the operations to one slave are planned together
+    assert poller.written == [("one", [10, 20]), ("two", [10])]
+    assert written == {"one": {"a", "b", "c"}}
+    assert first.result() == "one: a=1 written and read back"
+    assert second.result() == "one: b=2 c=3 written and read back"
+    with pytest.raises(RuntimeError, match="a: bad value"):
+        failed.result()
+    assert not queue.pending.is_set()
+
+
+def test_execute_writes_goes_on_after_a_failed_slave():
+    point = _point("a", 10)
+    one = Slave("one", "h", 502, 1, 3, [point])
+    two = one._replace(name="two")
+    queue = WriteQueue()
+    failed = queue.submit(one, [(point, 1)])
+    cancelled = queue.submit(two, [(point, 2)])
+    written = queue.submit(two, [(point, 3)])
+    cancelled.cancel()
+    poller = FakePoller(one=RuntimeError("Event loop is closed"))
+    assert execute_writes(poller, queue.take(), register_base=0) == {"two": {"a"}}
+    with pytest.raises(RuntimeError, match="one: Event loop is closed"):
+        failed.result()
+    assert poller.written == [("two", [10])]
+    assert written.result() == "two: a=3 written and read back"
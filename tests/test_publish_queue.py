@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from publish_queue import PublishQueue
+
+
+def test_drop_oldest():
+    queue = PublishQueue(maxsize=2)
+    for i in range(3):
+        assert queue.put(i)
+    assert queue.get_many(10) == [1, 2]
+    assert queue.stats() == {
+        "depth": 0,
+        "high_water": 2,
+        "queued": 3,
+        "dropped": 1,
+        "spilled": 0,
+    }
+
+
+def test_get_many_oldest_first():
+    queue = PublishQueue()
+    for i in range(5):
+        queue.put(i)
+    assert queue.get_many(3) == [0, 1, 2]
+    assert queue.get_many(3) == [3, 4]
+    assert queue.get_many(3, timeout=0.01) == []
+
+
+def test_block_waits_for_room():
+    queue = PublishQueue(maxsize=1, policy="block", block_timeout=5)
+    queue.put(0)
+    taker = threading.Timer(0.05, queue.get_many, (1,))
+    taker.start()
+    start = time.monotonic()
+    assert queue.put(1)
+    taker.join()
+    assert time.monotonic() - start < 5
+    assert queue.get_many(10) == [1]
+    assert queue.stats()["dropped"] == 0
+
+
+def test_block_drops_oldest_after_timeout():
+    queue = PublishQueue(maxsize=1, policy="block", block_timeout=0.05)
+    queue.put(0)
+    start = time.monotonic()
+    assert queue.put(1)
+    assert time.monotonic() - start >= 0.05
+    assert queue.get_many(10) == [1]
+    assert queue.stats()["dropped"] == 1
+
+
+def test_spill():
+    spilled = []
+    queue = PublishQueue(maxsize=1, policy="spill", spill=spilled.append)
+    assert queue.put(0)
+    assert not queue.put(1)
+    assert spilled == [1]
+    assert queue.get_many(10) == [0]
+    assert queue.stats()["spilled"] == 1
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        PublishQueue(policy="newest")
+    with pytest.raises(ValueError):
+        PublishQueue(policy="spill")
@@ -0,0 +1,74 @@
+import pytest
+
+from modbus.register_map import (
+    DEFAULT_REGISTER_MAP,
+    MAX_READ_COUNT,
+    Point,
+    decode_block,
+    load_register_map,
+    plan_reads,
+)
+
+
+def _points(*addresses, format="16bit_integer"):
+    return [Point(f"p{a}", a, format) for a in addresses]
+
+
+def test_adjacent_points_are_one_read():
+    blocks = plan_reads(_points(10, 11, 12), register_base=0)
+    assert [(b.address, b.count) for b in blocks] == [(10, 3)]
+    assert blocks[0].offsets == (0, 1, 2)
+
+
+def test_gap_merge():
+    points = _points(10, 15, 40)
+    assert [(b.address, b.count) for b in plan_reads(points, 0, 0)] == [
+        (10, 1),
+        (15, 1),
+        (40, 1),
+    ]
+    assert [(b.address, b.count) for b in plan_reads(points, 4, 0)] == [
+        (10, 6),
+        (40, 1),
+    ]
+
+
+def test_max_read_count():
+    points = _points(*range(0, 300, 2), format="32bit_float")
+    blocks = plan_reads(points, max_gap=8, register_base=0)
+    assert all(b.count <= MAX_READ_COUNT for b in blocks)
+    assert sum(len(b.points) for b in blocks) == len(points)
+    # no point is split between two reads
+    for b in blocks:
+        assert b.offsets[-1] + 2 <= b.count
+
+
+def test_register_base():
+    blocks = plan_reads(_points(200, 201), register_base=1)
+    assert blocks[0].address == 199
+    blocks = plan_reads(_points(200, 201), register_base=0)
+    assert blocks[0].address == 200
+
+
+def test_decode_block():
+    points = [
+        Point("temp", 200, "32bit_float", "reverse", decimals=2),
+        Point("level", 202, "16bit_integer"),
+    ]
+    (block,) = plan_reads(points, register_base=1)
+    # 21.456 as a float, low word first
+    registers = [42467, 16811, 65535]
+    assert decode_block(block, registers) == {"temp": 21.46, "level": -1}
+
+
+def test_default_register_map():
+    points = load_register_map({})
+    assert len(points) == len(DEFAULT_REGISTER_MAP)
+    (block,) = plan_reads(points, max_gap=8, register_base=1)
+    assert (block.address, block.count) == (199, 37)
+
+
+def test_register_map_rejects_duplicates():
+    entry = {"name": "a", "address": 1}
+    with pytest.raises(ValueError):
+        load_register_map({"registers": [entry, entry]})
@@ -0,0 +1,61 @@
+from modbus.register_map import Point
+from report_by_exception import ReportByException
+
+
+def test_first_read_is_published():
+    rbe = ReportByException([Point("a", 1, deadband=1)])
+    assert rbe.update({"a": 5}, 0) == ["a"]
+
+
+def test_deadband():
+    rbe = ReportByException([Point("a", 1, deadband=1)], default_heartbeat=100)
+    rbe.update({"a": 5}, 0)
+    assert rbe.update({"a": 5.9}, 1) == []
+    assert rbe.update({"a": 6.1}, 2) == ["a"]
+    # compared to the last published value, not the last read
+    assert rbe.update({"a": 6.5}, 3) == []
+    assert rbe.update({"a": 7.2}, 4) == ["a"]
+
+
+def test_deadband_pct():
+    rbe = ReportByException([Point("a", 1, deadband_pct=10)], default_heartbeat=100)
+    rbe.update({"a": 50}, 0)
+    assert rbe.update({"a": 54}, 1) == []
+    assert rbe.update({"a": 56}, 2) == ["a"]
+
+
+def test_deadband_zero_publishes_every_change():
+    rbe = ReportByException([Point("a", 1, deadband=0)], default_heartbeat=100)
+    rbe.update({"a": 1}, 0)
+    assert rbe.update({"a": 1}, 1) == []
+    assert rbe.update({"a": 0}, 2) == ["a"]
+
+
+def test_heartbeat():
+    rbe = ReportByException(
+        [Point("a", 1), Point("b", 2, heartbeat=10)], default_heartbeat=60
+    )
+    rbe.update({"a": 1, "b": 1}, 0)
+    assert rbe.update({"a": 1, "b": 1}, 9) == []
+    assert rbe.update({"a": 1, "b": 1}, 10) == ["b"]
+    assert rbe.update({"a": 1, "b": 1}, 60) == ["a", "b"]
+
+
+def test_scale_and_default_heartbeat():
+    rbe = ReportByException(
+        [Point("a", 1, deadband=1), Point("p", 2)], default_heartbeat=60
+    )
+    rbe.scale(2, keep={"p"})
+    rbe.update({"a": 0, "p": 0}, 0)
+    assert rbe.update({"a": 1.5, "p": 0}, 60) == ["p"]
+    assert rbe.update({"a": 2.5, "p": 0}, 61) == ["a"]
+    rbe.set_default_heartbeat(10)
+    rbe.scale(1)
+    assert rbe.update({"a": 2.5, "p": 0}, 71) == ["a", "p"]
+
+
+def test_reset():
+    rbe = ReportByException([Point("a", 1)], default_heartbeat=60)
+    rbe.update({"a": 1}, 0)
+    rbe.reset("a")
+    assert rbe.update({"a": 1}, 1) == ["a"]
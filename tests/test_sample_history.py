@@ -0,0 +1,62 @@
+import math
+
+from modbus.register_map import Point
+from sample_history import SampleHistory
+
+POINTS = [
+    Point("temp", 200, "32bit_float", group="analog"),
+    Point("ph", 202, "32bit_float", group="analog"),
+    Point("level", 236, "16bit_integer", group="level"),
+]
+
+
+def test_groups_keep_their_own_polls():
+    history = SampleHistory(POINTS, 4)
+    history.append({"temp": 20.5, "ph": 7.0, "level": 1}, 0)
+    for t in range(10, 100, 10):
+        history.append({"level": t // 10 % 2}, t)
+    # the level polls do not push the analog sample out
+    times, values = history.window("temp")
+    assert (list(times), list(values)) == ([0.0], [20.5])
+    times, values = history.window("level")
+    assert list(times) == [60.0, 70.0, 80.0, 90.0]
+    assert list(values) == [0, 1, 0, 1]
+    assert len(history) == 5
+
+
+def test_nbytes():
+    history = SampleHistory(POINTS, 720)
+    # 8 bytes per value and 8 per timestamp of each group
+    assert history.nbytes() == 720 * (2 * 8 + 8) + 720 * (8 + 8)
+
+
+def test_missing_samples():
+    history = SampleHistory(POINTS, 4)
+    history.append({"temp": 1.0, "level": 1}, 0)
+    (times, values), = history.views("ph")
+    assert list(times) == [0.0] and math.isnan(values[0])
+    assert list(history.window("ph")[1]) == []
+
+
+def test_views_wrap_around():
+    history = SampleHistory(POINTS[:1], 3)
+    for t in range(5):
+        history.append({"temp": float(t)}, t)
+    views = history.views("temp")
+    assert [list(v) for _, v in views] == [[2.0], [3.0, 4.0]]
+    views = history.views("temp", since=3, until=4)
+    assert [list(t) for t, _ in views] == [[3.0]]
+
+
+def test_write_csv_merges_the_groups(tmp_path):
+    history = SampleHistory(POINTS, 4)
+    history.append({"temp": 20.5, "ph": 7.0, "level": 1}, 0)
+    history.append({"level": 0}, 10)
+    path = tmp_path / "history.csv"
+    history.write_csv(str(path))
+    assert path.read_text().splitlines() == [
+        "time,temp,ph,level",
+        "0.000,20.5,7.0,",
+        "0.000,,,1",
+        "10.000,,,0",
+    ]
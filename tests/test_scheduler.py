@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+from scheduler import PollScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_groups_and_phase():
+    clock = FakeClock()
+    scheduler = PollScheduler(
+        {"fast": (10, 0), "slow": (60, 5)}, clock=clock, sleep=clock.sleep
+    )
+    assert scheduler.wait() == (1000.0, ["fast"])
+    assert scheduler.wait() == (1005.0, ["slow"])
+    assert scheduler.wait() == (1010.0, ["fast"])
+
+
+def test_aligned_groups_are_polled_together():
+    clock = FakeClock()
+    scheduler = PollScheduler(
+        {"a": (10, 0), "b": (10, 0.2)}, clock=clock, sleep=clock.sleep
+    )
+    deadline, due = scheduler.wait()
+    assert sorted(due) == ["a", "b"]
+
+
+def test_overrun_skips_missed_periods():
+    clock = FakeClock()
+    scheduler = PollScheduler({"fast": (10, 0)}, clock=clock, sleep=clock.sleep)
+    assert scheduler.wait() == (1000.0, ["fast"])
+    # the poll took 35s, the deadlines 1010..1030 are skipped
+    clock.now += 35
+    assert scheduler.wait() == (1010.0, ["fast"])
+    assert scheduler.next_deadline() == 1040.0
+    assert scheduler.wait() == (1040.0, ["fast"])
+
+
+def test_no_drift():
+    clock = FakeClock()
+    scheduler = PollScheduler({"fast": (10, 0)}, clock=clock, sleep=clock.sleep)
+    for i in range(5):
+        deadline, due = scheduler.wait()
+        assert deadline == 1000.0 + 10 * i
+        clock.now += 3
+
+
+def test_interrupt():
+    clock = FakeClock()
+    scheduler = PollScheduler({"fast": (10, 0)}, clock=clock)
+    scheduler.wait()
+    interrupt = threading.Event()
+    interrupt.set()
+    assert scheduler.wait(interrupt) == (None, [])
+
+
+def test_interval_must_be_positive():
+    with pytest.raises(ValueError):
+        PollScheduler({"bad": (0, 0)})
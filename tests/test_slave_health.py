@@ -0,0 +1,33 @@
+from modbus.slave_health import CLOSED, HALF_OPEN, OPEN, SlaveHealth
+
+
+def test_timeout_follows_round_trips():
+    health = SlaveHealth(3.0, min_timeout=0.2)
+    assert health.timeout() == 3.0
+    for _ in range(20):
+        health.sample(0.01)
+    assert health.timeout() == 0.2
+    health.failure(0, timed_out=True)
+    assert health.timeout() == 0.4
+    for _ in range(5):
+        health.failure(0, timed_out=True)
+    assert health.timeout() == 3.0
+
+
+def test_circuit():
+    health = SlaveHealth(3.0, failures=3, backoff=30, max_backoff=100)
+    assert not health.failure(0)
+    assert not health.failure(0)
+    assert health.failure(0)
+    assert health.state == OPEN
+    assert not health.allow(10)
+    assert health.allow(40)
+    assert health.state == HALF_OPEN
+    # a failed probe opens it again for about twice as long
+    assert not health.failure(40)
+    assert health.state == OPEN
+    assert not health.allow(40 + 50)
+    assert health.allow(40 + 70)
+    assert health.success()
+    assert health.state == CLOSED
+    assert not health.success()
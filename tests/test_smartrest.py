@@ -0,0 +1,65 @@
+import datetime
+
+from c8y.smartrest import TemplateEncoder, csv_field
+
+T = datetime.datetime(2026, 1, 2, 3, 4, 5, 600000)
+TIME = "2026-01-02T03:04:05.600Z"
+MAP = {"water": {"temp": "C", "ph": "pH"}, "level": {"level": "m"}}
+
+
+def test_templates():
+    encoder = TemplateEncoder(MAP)
+    assert encoder.template_lines == [
+        "10,1000,POST,MEASUREMENT,,water,,water.temp.value,NUMBER,,water.temp.unit,"
+        "STRING,C,water.ph.value,NUMBER,,water.ph.unit,STRING,pH",
+        "10,1001,POST,MEASUREMENT,,water,,water.temp.value,NUMBER,,water.temp.unit,"
+        "STRING,C",
+        "10,1002,POST,MEASUREMENT,,water,,water.ph.value,NUMBER,,water.ph.unit,"
+        "STRING,pH",
+        "10,1003,POST,MEASUREMENT,,level,,level.level.value,NUMBER,,level.level.unit,"
+        "STRING,m",
+        "10,1004,POST,MEASUREMENT,,level,,level.level.value,NUMBER,,level.level.unit,"
+        "STRING,m",
+    ]
+    assert not encoder.ready
+
+
+def test_full_row():
+    encoder = TemplateEncoder(MAP)
+    # in the order of the template, not of the batch
+    rows, rest = encoder.encode("water", {"ph": (7.02, "pH"), "temp": (21.5, "C")}, T)
+    assert rows == [f"1000,{TIME},21.5,7.02"]
+    assert rest == {}
+
+
+def test_single_series_rows():
+    encoder = TemplateEncoder(MAP)
+    rows, rest = encoder.encode("water", {"ph": (7.02, "pH")}, T)
+    assert rows == [f"1002,{TIME},7.02"]
+    assert rest == {}
+
+
+def test_series_without_template():
+    encoder = TemplateEncoder(MAP)
+    measurements = {"temp": (21.5, "C"), "flow": (3, "l/s")}
+    rows, rest = encoder.encode("water", measurements, T)
+    assert rows == [f"1001,{TIME},21.5"]
+    assert rest == {"flow": (3, "l/s")}
+    rows, rest = encoder.encode("air", {"temp": (8, "C")}, T)
+    assert (rows, rest) == ([], {"temp": (8, "C")})
+
+
+def test_xid():
+    xid = TemplateEncoder(MAP).xid
+    assert xid.startswith("modbus2c8y_")
+    assert TemplateEncoder(MAP).xid == xid
+    assert TemplateEncoder({"water": {"temp": "C"}}).xid != xid
+    assert TemplateEncoder({"water": {"temp": "K", "ph": "pH"}}).xid != xid
+    assert TemplateEncoder(MAP, prefix="fx30").xid.startswith("fx30_")
+
+
+def test_csv_field():
+    assert csv_field("temp") == "temp"
+    assert csv_field(1.5) == "1.5"
+    assert csv_field("a,b") == '"a,b"'
+    assert csv_field('say "hi"') == '"say ""hi"""'
@@ -0,0 +1,51 @@
+import pytest
+
+from store_forward import MeasurementStore
+
+
+def test_fifo_and_remove(tmp_path):
+    store = MeasurementStore(str(tmp_path / "outbox.db"))
+    store.put("s/us", ["a", "b"])
+    store.put("s/us/child", ["c"])
+    rows = store.peek(2)
+    assert [(topic, payload) for _, topic, payload in rows] == [
+        ("s/us", "a"),
+        ("s/us", "b"),
+    ]
+    store.remove(rows[-1][0])
+    assert store.depth() == 1
+    assert [payload for _, _, payload in store.peek(10)] == ["c"]
+    stats = store.stats()
+    assert (stats["stored"], stats["replayed"], stats["depth"]) == (3, 2, 1)
+
+
+def test_survives_restart(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    store = MeasurementStore(path)
+    store.put("s/us", ["a", "b"])
+    store.close()
+    store = MeasurementStore(path)
+    assert store.depth() == 2
+    assert [payload for _, _, payload in store.peek(10)] == ["a", "b"]
+
+
+def test_oldest_are_evicted(tmp_path):
+    store = MeasurementStore(str(tmp_path / "outbox.db"), max_rows=3)
+    store.put("s/us", ["a", "b"])
+    store.put("s/us", ["c", "d", "e"])
+    assert store.depth() == 3
+    assert [payload for _, _, payload in store.peek(10)] == ["c", "d", "e"]
+    assert store.stats()["evicted"] == 2
+
+
+def test_failed_put_is_rolled_back(tmp_path):
+    store = MeasurementStore(str(tmp_path / "outbox.db"), max_rows=3)
+    store.put("s/us", ["a"])
+    # the second row cannot be bound, after the first one was inserted
+    with pytest.raises(Exception):
+        store.put("s/us", ["b", object()])
+    assert store.stats()["stored"] == 1
+    assert store.depth() == 1
+    store.put("s/us", ["c"])
+    assert [payload for _, _, payload in store.peek(10)] == ["a", "c"]
+    assert store.depth() == 2
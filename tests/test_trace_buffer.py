@@ -0,0 +1,95 @@
+import logging
+
+import pytest
+
+from trace_buffer import (
+    POLL,
+    READ,
+    DumpOnError,
+    RateLimitFilter,
+    TraceBuffer,
+    production_logging,
+)
+
+
+@pytest.fixture
+def root_logger():
+    # production_logging changes the root logger, it is restored afterwards
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_ring_keeps_the_newest_records():
+    trace = TraceBuffer(3)
+    for i in range(5):
+        trace.record(READ, "logger", i, 0.5)
+    records = trace.records()
+    assert [r[3] for r in records] == [2, 3, 4]
+    assert {(r[1], r[2], r[4]) for r in records} == {(READ, "logger", 0.5)}
+
+
+def test_dump(tmp_path):
+    trace = TraceBuffer(8)
+    trace.record(POLL, "a", 19, 0.25)
+    trace.record(READ, "b", 199)
+    path = tmp_path / "trace.log"
+    assert trace.dump(str(path), "test") == 2
+    header, poll, read = path.read_text().splitlines()
+    assert header == "trace dump (test), 2 records"
+    assert poll.split()[1:] == ["poll", "a", "19", "0.25"]
+    assert read.split()[1:] == ["read", "b", "199", "0"]
+
+
+def _record(lineno=1, msg="x"):
+    return logging.LogRecord("poller", logging.WARNING, "p.py", lineno, msg, (), None)
+
+
+def test_rate_limit_per_call_site():
+    limit = RateLimitFilter(rate=2, period=60)
+    assert [limit.filter(_record()) for _ in range(4)] == [True, True, False, False]
+    assert limit.filter(_record(lineno=2))
+    # the next one let through tells how many were suppressed
+    limit._sites[("poller", "p.py", 1)][0] -= 60
+    record = _record()
+    assert limit.filter(record)
+    assert record.msg == "x (2 similar messages suppressed)"
+
+
+def test_dump_on_error(tmp_path):
+    trace = TraceBuffer(8)
+    trace.record(POLL, "a")
+    path = tmp_path / "trace.log"
+    log = logging.getLogger("test_dump_on_error")
+    log.propagate = False
+    log.addHandler(DumpOnError(trace, str(path), min_interval=60))
+    log.warning("slow")
+    assert not path.exists()
+    log.error("failed")
+    assert path.read_text().startswith("trace dump (error: failed)")
+    # at most once per min_interval
+    path.unlink()
+    log.error("failed again")
+    assert not path.exists()
+
+
+def test_importing_main_installs_no_handler(root_logger):
+    handlers = list(root_logger.handlers)
+    import main  # noqa: F401
+
+    assert root_logger.handlers == handlers
+
+
+def test_production_logging(root_logger, tmp_path):
+    root_logger.handlers.clear()
+    production_logging(TraceBuffer(8), 5, str(tmp_path / "trace.log"))
+    assert root_logger.level == logging.WARNING
+    console, dump = root_logger.handlers
+    assert isinstance(console.filters[0], RateLimitFilter)
+    assert isinstance(dump, DumpOnError)
+    root_logger.handlers.clear()
+    production_logging(TraceBuffer(8), console=False, verbose=True)
+    assert root_logger.level == logging.DEBUG
+    assert root_logger.handlers == []
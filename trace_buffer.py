@@ -0,0 +1,182 @@
+import datetime
+import itertools
+import logging
+import struct
+import sys
+import time
+
+logger = logging.getLogger("trace")
+
+# events kept in the ring buffer
+POLL = 1  # slave polled: number of values, seconds
+READ = 2  # read request answered: start address, seconds
+TIMEOUT = 3  # slave poll timed out: 0, timeout
+ERROR = 4  # read or connect error: start address or 0
+CONNECT = 5  # connection opened: 0, seconds
+VALUE = 6  # value read: 0, value
+PUBLISH = 7  # measurements handed to the gateway: number of series
+EVENTS = {
+    POLL: "poll",
+    READ: "read",
+    TIMEOUT: "timeout",
+    ERROR: "error",
+    CONNECT: "connect",
+    VALUE: "value",
+    PUBLISH: "publish",
+}
+
+# wall time, event, name id, int argument, float argument
+_RECORD = struct.Struct("<dBHid")
+
+
+class TraceBuffer:
+    """Fixed size ring buffer of recent poll events, kept as packed binary records in
+    one preallocated bytearray. Recording an event packs a few numbers and costs about
+    a microsecond, nothing is formatted until the buffer is dumped, so it stays on in
+    production in place of DEBUG logging. Names (slaves, points) are stored as ids.
+    """
+
+    def __init__(self, size=4096):
+        """
+        :param size: number of records kept, the oldest ones are overwritten
+        """
+        self.size = size
+        self._buf = bytearray(size * _RECORD.size)
+        # next() of a count is atomic, so the poller and gateway threads can both record
+        self._counter = itertools.count()
+        self._ids = {}
+        self._names = []
+
+    def _id(self, name):
+        i = self._ids.get(name)
+        if i is None:
+            i = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return i
+
+    def record(self, event, name, a=0, b=0.0):
+        slot = next(self._counter) % self.size
+        _RECORD.pack_into(
+            self._buf, slot * _RECORD.size, time.time(), event, self._id(name), a, b
+        )
+
+    def records(self):
+        """
+        :return: list of (time, event, name, int argument, float argument), oldest first
+        """
+        records = [
+            (t, event, self._names[i], a, b)
+            for t, event, i, a, b in _RECORD.iter_unpack(self._buf)
+            if event
+        ]
+        records.sort(key=lambda r: r[0])
+        return records
+
+    def format(self):
+        lines = []
+        for t, event, name, a, b in self.records():
+            stamp = datetime.datetime.utcfromtimestamp(t).strftime("%H:%M:%S.%f")
+            lines.append(f"{stamp} {EVENTS.get(event, event):8s} {name} {a} {b:g}")
+        return lines
+
+    def dump(self, path=None, reason=""):
+        """
+        Function to format the buffer, to a file or to the log
+        :param path: file the trace is written to, the log if None
+        :param reason: why the trace is dumped, written in the header
+        :return: number of records dumped
+        """
+        lines = self.format()
+        header = f"trace dump ({reason}), {len(lines)} records"
+        if path is None:
+            logger.warning(header)
+            for line in lines:
+                logger.warning(line)
+        else:
+            with open(path, "w") as f:
+                f.write(header + "\n")
+                f.write("\n".join(lines) + "\n")
+            logger.warning(f"{header} written to {path}")
+        return len(lines)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most rate records of every call site through per period, and tells how
+    many were suppressed on the next one let through.
+    """
+
+    def __init__(self, rate=10, period=60):
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self._sites = {}
+
+    def filter(self, record):
+        if record.name == logger.name:
+            # trace dumps are asked for, never suppressed
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.period:
+            suppressed = site[2] if site else 0
+            site = self._sites[key] = [now, 0, 0]
+            if suppressed:
+                record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        if site[1] >= self.rate:
+            site[2] += 1
+            return False
+        site[1] += 1
+        return True
+
+
+class DumpOnError(logging.Handler):
+    """Dumps the trace buffer when an error is logged, at most once per min_interval"""
+
+    def __init__(self, trace, path=None, min_interval=60):
+        super().__init__(logging.ERROR)
+        self.trace = trace
+        self.path = path
+        self.min_interval = min_interval
+        self._last = None
+
+    def emit(self, record):
+        if record.name == logger.name:
+            return
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.min_interval:
+            return
+        self._last = now
+        try:
+            self.trace.dump(self.path, f"error: {record.getMessage()}")
+        except Exception:
+            self.handleError(record)
+
+
+def production_logging(
+    trace, warnings_per_minute=10, dump_path=None, console=True, verbose=False
+):
+    """
+    Function to install the log handlers of the gateway, called once by main. Unless
+    verbose, the root logger is switched from DEBUG to rate limited warnings, with the
+    trace buffer dumped on errors
+    :param trace: TraceBuffer to dump
+    :param dump_path: file the trace is dumped to, the log if None
+    :param console: log to stdout
+    :param verbose: log everything down to DEBUG, neither rate limited nor dumped
+    """
+    root = logging.getLogger()
+    handler = None
+    if console:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+        root.addHandler(handler)
+    if verbose:
+        root.setLevel(logging.DEBUG)
+        return
+    root.setLevel(logging.WARNING)
+    if handler is not None:
+        handler.addFilter(RateLimitFilter(warnings_per_minute, 60))
+    root.addHandler(DumpOnError(trace, dump_path))